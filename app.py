@@ -1,22 +1,43 @@
 import eventlet
 eventlet.monkey_patch()
+from eventlet import tpool
 import os
-import io
-import zipfile
-import subprocess
-import sys
+import shutil
 import tempfile
 import threading
+import queue
 import uuid
+import socket
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session
+import random
+import json
+import re
+import itertools
+import click
+import hashlib
+import multiprocessing
+import pypdfium2
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, Response, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from flask_socketio import SocketIO, emit
-from docxtpl import DocxTemplate
+from flask_socketio import SocketIO, emit, join_room
 from dotenv import load_dotenv
-from sqlalchemy import or_, text, inspect
+from sqlalchemy import text, inspect, bindparam
+from sqlalchemy.exc import IntegrityError
+from converter import ConverterPool, ConversionError, register_fonts
+from docx_cache import get_compiled_template
+from rendering import RenderPool, convert_record_to_context, docx_filename, merged_filename, render_merged
+from stamping import DEVANAGARI_FONT, StampingUnsupported, get_stamp_template
+from zipstream import ZipStream
+from artifact_cache import ArtifactCache, file_sha256
+from archive_store import ArchiveStore
+from query_cache import QueryCache
+from query_plans import create_indexes, explain, full_scans
+from sqlite_pubsub import SQLiteManager
+from jobstore import JobStore, PENDING, RENDERED, CONVERTED, DONE, FAILED, TRANSIENT, PERMANENT
+from metrics import Gauges, render_prometheus, summarize_timings
 
 # Load environment variables
 load_dotenv()
@@ -26,33 +47,148 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'change-me')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DB_URI')
 app.config['TEMPLATE_PATH'] = os.getenv('TEMPLATE', 'AIB Degree - Copy.docx')
 app.config['OUTPUT_DIR'] = os.getenv('OUTPUT_DIR', 'output')
+app.config['LIBREOFFICE_PATH'] = os.getenv('LIBREOFFICE_PATH', 'libreoffice')
+app.config['CONVERTER_POOL_SIZE'] = int(os.getenv('CONVERTER_POOL_SIZE', '4'))
+# Seconds a conversion may take before its soffice is killed and restarted.
+app.config['CONVERT_TIMEOUT'] = float(os.getenv('CONVERT_TIMEOUT', '300'))
+# A Python that can import LibreOffice's UNO bindings, for when this one
+# cannot (e.g. a virtualenv). Looked for next to soffice and as the system
+# python3 if unset.
+app.config['UNO_PYTHON'] = os.getenv('UNO_PYTHON') or None
+app.config['PIPELINE_QUEUE_SIZE'] = int(os.getenv('PIPELINE_QUEUE_SIZE', '16'))
+# Conversion attempts per file; transient failures back off exponentially
+# from CONVERT_RETRY_BACKOFF seconds, capped at CONVERT_RETRY_MAX_DELAY.
+app.config['CONVERT_MAX_ATTEMPTS'] = int(os.getenv('CONVERT_MAX_ATTEMPTS', '3'))
+app.config['CONVERT_RETRY_BACKOFF'] = float(os.getenv('CONVERT_RETRY_BACKOFF', '1'))
+app.config['CONVERT_RETRY_MAX_DELAY'] = float(os.getenv('CONVERT_RETRY_MAX_DELAY', '30'))
+# N > 0 renders in a pool of N worker processes, off the eventlet hub. 0
+# renders in-process on the hub, which holds up other requests meanwhile.
+app.config['RENDER_WORKERS'] = int(os.getenv('RENDER_WORKERS', '1'))
+app.config['RENDER_CHUNK_SIZE'] = int(os.getenv('RENDER_CHUNK_SIZE', '25'))
+# Added to the render workers' nice value; 0 leaves their priority alone.
+app.config['RENDER_NICENESS'] = int(os.getenv('RENDER_NICENESS', '10'))
+# Pages per document for the "merged" output format; each is converted once.
+app.config['MERGE_CHUNK_SIZE'] = int(os.getenv('MERGE_CHUNK_SIZE', '200'))
+# 'stamp' writes PDFs by stamping each record onto a background converted
+# once per template, instead of converting every DOCX with LibreOffice. The
+# first stamping job for a template checks its first STAMP_VERIFY_RECORDS
+# records against LibreOffice and stamps only if no page differs by more
+# than STAMP_MAX_DIFF; `python benchmark.py stamp` checks again on synthetic
+# records. Records it cannot reproduce are still converted.
+app.config['PDF_ENGINE'] = os.getenv('PDF_ENGINE', 'libreoffice')
+app.config['STAMP_CACHE_DIR'] = os.getenv('STAMP_CACHE_DIR', 'stamp_cache')
+app.config['STAMP_VERIFY_RECORDS'] = int(os.getenv('STAMP_VERIFY_RECORDS', '5'))
+app.config['STAMP_MAX_DIFF'] = float(os.getenv('STAMP_MAX_DIFF', '0.1'))
+# The font for Unicode Hindi the template's fonts do not have, ideally the
+# one LibreOffice falls back to; empty for the bundled HindiFont.ttf.
+app.config['STAMP_DEVANAGARI_FONT'] = os.getenv('STAMP_DEVANAGARI_FONT', '')
+app.config['DASHBOARD_PAGE_SIZE'] = int(os.getenv('DASHBOARD_PAGE_SIZE', '100'))
+app.config['DASHBOARD_CACHE_TTL'] = float(os.getenv('DASHBOARD_CACHE_TTL', '300'))
+# Durable generation job queue and task state, consumed by worker.py. Set
+# JOB_DB_URI to a shared database (e.g. MySQL) when running on several hosts.
+app.config['JOB_DB_PATH'] = os.getenv('JOB_DB_PATH', 'jobs.db')
+app.config['JOB_DB_URI'] = os.getenv('JOB_DB_URI') or app.config['JOB_DB_PATH']
+app.config['JOB_CONCURRENCY'] = int(os.getenv('JOB_CONCURRENCY', '2'))
+app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+app.config['JOB_HEARTBEAT_INTERVAL'] = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '5'))
+app.config['JOB_STALE_AFTER'] = float(os.getenv('JOB_STALE_AFTER', '60'))
+# Minimum seconds between progress updates sent for one task.
+app.config['PROGRESS_UPDATE_INTERVAL'] = float(os.getenv('PROGRESS_UPDATE_INTERVAL', '1'))
+# Message queue linking the web processes' Socket.IO servers: a Redis/AMQP URL,
+# or sqlite:///path for several processes on one machine. Empty for a single
+# process.
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+# Reuse of previously generated DOCX/PDF files; set ARTIFACT_CACHE_DIR empty to disable.
+app.config['ARTIFACT_CACHE_DIR'] = os.getenv('ARTIFACT_CACHE_DIR', 'artifact_cache')
+app.config['ARTIFACT_CACHE_MAX_MB'] = int(os.getenv('ARTIFACT_CACHE_MAX_MB', '2048'))
+# Finished ZIP archives, kept for downloads and resumed transfers. A task's
+# archive, job and output files are removed ARCHIVE_TTL_HOURS after it
+# finished, or sooner, oldest first, once the archives exceed ARCHIVE_MAX_MB.
+app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR', 'archives')
+app.config['ARCHIVE_TTL_HOURS'] = float(os.getenv('ARCHIVE_TTL_HOURS', '72'))
+app.config['ARCHIVE_MAX_MB'] = int(os.getenv('ARCHIVE_MAX_MB', '20480'))
+# Single-record previews (/preview/<entryno>), cached by record context and
+# template version. PNGs are PREVIEW_WIDTH pixels wide unless ?width= asks.
+# Thumbnails come only from PDFs already made; a full preview that is not
+# goes through the generation workers, and is served once they are done.
+app.config['PREVIEW_CACHE_DIR'] = os.getenv('PREVIEW_CACHE_DIR', 'preview_cache')
+app.config['PREVIEW_CACHE_MAX_MB'] = int(os.getenv('PREVIEW_CACHE_MAX_MB', '512'))
+app.config['PREVIEW_WIDTH'] = int(os.getenv('PREVIEW_WIDTH', '1200'))
+# Warm-up before the first job: bundled fonts registered with LibreOffice
+# (through a fontconfig file under FONTCONFIG_DIR), the template compiled,
+# the database pools opened and, in workers, one conversion per LibreOffice
+# instance. Workers always warm up; web processes do when WARM_UP_ON_START=1.
+# /ready reports the outcome.
+app.config['WARM_UP_ON_START'] = os.getenv('WARM_UP_ON_START', '0') == '1'
+app.config['FONT_DIR'] = os.getenv('FONT_DIR', os.path.join('static', 'fonts'))
+app.config['FONTCONFIG_DIR'] = os.getenv('FONTCONFIG_DIR', 'fontconfig')
+# When set, /metrics requires "Authorization: Bearer <token>".
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
 
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
-socketio = SocketIO(app)
+if app.config['SOCKETIO_MESSAGE_QUEUE'].startswith('sqlite:'):
+    socketio = SocketIO(app, client_manager=SQLiteManager(app.config['SOCKETIO_MESSAGE_QUEUE']))
+else:
+    socketio = SocketIO(app, message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'] or None)
+# Long-lived headless LibreOffice instances, started on first conversion.
+converter_pool = ConverterPool(app.config['CONVERTER_POOL_SIZE'], app.config['LIBREOFFICE_PATH'],
+                               run_blocking=tpool.execute, uno_python=app.config['UNO_PYTHON'],
+                               convert_timeout=app.config['CONVERT_TIMEOUT'])
+job_store = JobStore(app.config['JOB_DB_URI'])
+dashboard_cache = QueryCache(app.config['DASHBOARD_CACHE_TTL'])
+artifact_cache = None
+if app.config['ARTIFACT_CACHE_DIR']:
+    artifact_cache = ArtifactCache(app.config['ARTIFACT_CACHE_DIR'], app.config['ARTIFACT_CACHE_MAX_MB'] * 1024 * 1024)
+preview_cache = ArtifactCache(app.config['PREVIEW_CACHE_DIR'], app.config['PREVIEW_CACHE_MAX_MB'] * 1024 * 1024)
+archive_store = ArchiveStore(app.config['ARCHIVE_DIR'], app.config['ARCHIVE_TTL_HOURS'] * 3600,
+                             app.config['ARCHIVE_MAX_MB'] * 1024 * 1024)
+# This process's pipeline gauges; workers publish them with their heartbeat.
+pipeline_gauges = Gauges()
 
 # ------------------------------
 # Models (for reference)
 # ------------------------------
 
 class Degree(db.Model):
+    # Snapshot of the convocation query, one row per student per cohort.
+    # refresh_degrees() rebuilds it; the dashboard and /generate read it
+    # instead of joining the ERP tables on every request.
     __tablename__ = 'degrees'
-    entryno = db.Column(db.String, primary_key=True)
-    name = db.Column(db.String)
-    name_hindi = db.Column(db.String)
-    spec_name = db.Column(db.String)
-    spec_name_hindi = db.Column(db.String)
-    degree_name = db.Column(db.String)
-    degree_name_hindi = db.Column(db.String)
-    completion_year = db.Column(db.String)
-    convo_day = db.Column(db.String)
-    convo_month_hindi = db.Column(db.String)
-    convo_year = db.Column(db.String)
-    degree_gpa = db.Column(db.String)
-    given_day = db.Column(db.String)
-    given_month = db.Column(db.String)
-    given_year = db.Column(db.String)
+    session_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    programme_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    semester_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    entryno = db.Column(db.String(50), primary_key=True)
+    name = db.Column(db.String(255))
+    name_hindi = db.Column(db.String(255))
+    spec_name = db.Column(db.String(255))
+    spec_name_hindi = db.Column(db.String(255))
+    degree_name = db.Column(db.String(255))
+    degree_name_hindi = db.Column(db.String(255))
+    completion_year = db.Column(db.String(10))
+    convo_day = db.Column(db.String(10))
+    convo_month_hindi = db.Column(db.String(50))
+    convo_year = db.Column(db.String(10))
+    degree_gpa = db.Column(db.String(50))
+    given_day = db.Column(db.String(10))
+    given_month = db.Column(db.String(50))
+    given_year = db.Column(db.String(10))
+    # Hash of the fields above, so a refresh only rewrites changed rows.
+    row_hash = db.Column(db.String(40))
+    __table_args__ = (
+        db.Index('ix_degrees_spec_name', 'session_pk', 'programme_pk', 'semester_pk', 'spec_name'),
+        db.Index('ix_degrees_completion_year', 'session_pk', 'programme_pk', 'semester_pk', 'completion_year'),
+    )
+
+class DegreeSnapshot(db.Model):
+    # When each cohort's rows in `degrees` were last refreshed.
+    __tablename__ = 'degree_snapshots'
+    session_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    programme_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    semester_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    refreshed_at = db.Column(db.DateTime)
+    row_count = db.Column(db.Integer)
 
 # In this approach, we do not create a temporary "GeneratedDegree" table;
 # instead, we fetch query results directly and pass them on.
@@ -74,54 +210,35 @@ def load_user(user_id):
 # Helper functions for template data
 # ------------------------------
 
-def convert_record_to_context(record: dict) -> dict:
-    mapping = {
-        'entryno': 'entryNumber',
-        'name': 'name',
-        'name_hindi': 'name_hindi',
-        'spec_name': 'spec_name',
-        'spec_name_hindi': 'spec_name_hindi',
-        'degree_name': 'degree_name',
-        'degree_name_hindi': 'degree_name_hindi',
-        'completion_year': 'completionYear',
-        'convo_day': 'convo_day',
-        'convo_month_hindi': 'convo_month_hindi',
-        'convo_year': 'convo_year',
-        'degree_gpa': 'degreeGPA',
-        'given_day': 'givenDay',
-        'given_month': 'givenMonth',
-        'given_year': 'givenYear'
-    }
-    return {new_key: record.get(old_key, '') for old_key, new_key in mapping.items()}
-
-def render_docx(context: dict) -> io.BytesIO:
-    tpl = DocxTemplate(app.config['TEMPLATE_PATH'])
-    tpl.render(context)
-    buf = io.BytesIO()
-    tpl.save(buf)
-    buf.seek(0)
-    return buf
+def render_docx(context: dict, docx_path):
+    # Rendered straight into the output file. The template is parsed and
+    # compiled once per file version and reused.
+    tpl = get_compiled_template(app.config['TEMPLATE_PATH'])
+    with open(docx_path, 'w+b') as f:
+        tpl.render_to(f, context)
 
-def convert_worker(docx_path, max_retries=100):
+def convert_worker(docx_path):
+    # Returns (pdf_path, attempts made). Raises ConversionError, carrying
+    # the attempts made, once the file is given up on.
     pdf_path = os.path.join(
         os.path.dirname(docx_path),
         os.path.basename(docx_path).replace('.docx', '.pdf')
     )
-    libreoffice_cmd = os.getenv('LIBREOFFICE_PATH', 'libreoffice')
-    attempt = 0
-    while attempt < max_retries:
+    max_attempts = max(1, app.config['CONVERT_MAX_ATTEMPTS'])
+    delay = app.config['CONVERT_RETRY_BACKOFF']
+    # The converter is back in the pool while we back off, and the pool
+    # restarts a crashed instance before handing it out again.
+    for attempt in range(1, max_attempts + 1):
         try:
-            time.sleep(1)
-            subprocess.run([libreoffice_cmd, '--headless', '--convert-to', 'pdf', docx_path,
-                            '--outdir', os.path.dirname(docx_path)], check=True)
-            break
-        except subprocess.CalledProcessError as e:
-            attempt += 1
-            app.logger.error(f"Attempt {attempt}/{max_retries} failed for {docx_path}: {e}")
-            time.sleep(2)
-    else:
-        app.logger.error(f"Failed converting {docx_path} after {max_retries} attempts.")
-    return pdf_path
+            converter_pool.convert(docx_path, pdf_path)
+            return pdf_path, attempt
+        except ConversionError as e:
+            app.logger.error(f"Attempt {attempt}/{max_attempts} failed for {docx_path}: {e}")
+            if not e.transient or attempt == max_attempts:
+                e.attempts = attempt
+                raise
+        time.sleep(min(delay, app.config['CONVERT_RETRY_MAX_DELAY']) * random.uniform(0.5, 1))
+        delay *= 2
 
 # Dummy helper functions for dropdown data.
 
@@ -184,6 +301,502 @@ def get_semesters():
     ]
 
 
+# ------------------------------
+# Convocation query
+# ------------------------------
+
+CONVOCATION_SQL = """
+    SELECT DISTINCT
+        employee_master.pf_number AS entryno,
+        employee_master.first_name AS name,
+        employee_master.name_hindi,
+        IFNULL(dgpa.dgpa, acad_course_grade_cpi.cpi) AS degree_gpa,
+        acad_degree_name_print.english_prog_name AS degree_name,
+        acad_degree_name_print.engish_spec_name AS spec_name,
+        acad_degree_name_print.hindi_prog_name AS degree_name_hindi,
+        acad_degree_name_print.hindi_spec_name AS spec_name_hindi,
+        acad_session_master.given_year,
+        acad_session_master.given_month,
+        acad_session_master.given_day,
+        acad_session_master.convo_year,
+        acad_session_master.convo_day,
+        acad_session_master.completion_year,
+        acad_session_master.convo_month_hindi
+    FROM
+        employee_master
+        INNER JOIN student_master_programme_details 
+            ON student_master_programme_details.employee_master_pk = employee_master.pk
+        INNER JOIN programme_master 
+            ON programme_master.pk = student_master_programme_details.acad_programme_master_pk
+        INNER JOIN acad_degree_name_print 
+            ON acad_degree_name_print.acad_branch_master_pk = student_master_programme_details.acad_branch_master_pk
+            AND acad_degree_name_print.programme_pk = student_master_programme_details.acad_programme_master_pk
+            AND acad_degree_name_print.batch = student_master_programme_details.batch
+            AND acad_degree_name_print.specialization_pk = student_master_programme_details.specialization_master_pk
+        INNER JOIN acad_course_grade_cpi 
+            ON acad_course_grade_cpi.student_pk = student_master_programme_details.employee_master_pk
+           AND acad_course_grade_cpi.flag = 1
+        LEFT JOIN dgpa 
+            ON dgpa.employee_master_pk = student_master_programme_details.employee_master_pk
+           AND dgpa.flag = student_master_programme_details.pg_status
+        INNER JOIN acad_student_warning_ap 
+            ON acad_student_warning_ap.employee_master_pk = student_master_programme_details.employee_master_pk
+           AND acad_student_warning_ap.flag = 1
+        INNER JOIN acad_session_master
+            ON acad_student_warning_ap.acad_session_master_pk = acad_session_master.pk
+    WHERE
+        acad_student_warning_ap.wap IN (6)
+        AND acad_session_master.pk = :session_pk
+        AND acad_student_warning_ap.acad_semester_pk = :semester_pk
+        AND programme_master.pk = :programme_pk
+        AND acad_student_warning_ap.flag = 1
+        AND acad_course_grade_cpi.flag = 1
+        AND employee_master.identifier_master_pk = 2
+"""
+
+# Columns produced by CONVOCATION_SQL and stored in the snapshot.
+DEGREE_FIELDS = ('entryno', 'name', 'name_hindi', 'degree_gpa', 'degree_name', 'spec_name',
+                 'degree_name_hindi', 'spec_name_hindi', 'given_year', 'given_month', 'given_day',
+                 'convo_year', 'convo_day', 'completion_year', 'convo_month_hindi')
+
+# Upper bound on entry numbers per IN list, well under the bound-parameter
+# limits of both SQLite and MySQL.
+FETCH_CHUNK_SIZE = 500
+
+SNAPSHOT_SQL = (f"SELECT {', '.join(DEGREE_FIELDS)} FROM degrees\n"
+                "    WHERE session_pk = :session_pk AND programme_pk = :programme_pk AND semester_pk = :semester_pk\n")
+
+def convocation_query(by_entryno=False):
+    # The convocation join for one cohort, optionally limited to an
+    # :entrynos list.
+    sql = CONVOCATION_SQL
+    if by_entryno:
+        sql += "    AND employee_master.pf_number IN :entrynos\n"
+    stmt = text(sql + "    ORDER BY employee_master.pf_number\n")
+    return stmt.bindparams(bindparam('entrynos', expanding=True)) if by_entryno else stmt
+
+def fetch_query():
+    return text(SNAPSHOT_SQL + "    AND entryno IN :entrynos\n").bindparams(bindparam('entrynos', expanding=True))
+
+def fetch_records(session_pk, programme_pk, semester_pk, entrynos):
+    # Yields the records one chunk of entry numbers at a time, in the order
+    # of the selection, as the per-entry lookup did.
+    sql = fetch_query()
+    entrynos = list(dict.fromkeys(entrynos))
+    for i in range(0, len(entrynos), FETCH_CHUNK_SIZE):
+        chunk = entrynos[i:i + FETCH_CHUNK_SIZE]
+        rows = db.session.execute(sql, {
+            'session_pk': session_pk,
+            'semester_pk': semester_pk,
+            'programme_pk': programme_pk,
+            'entrynos': chunk
+        })
+        by_entry = {row.entryno: dict(row._mapping) for row in rows}
+        yield from (by_entry[e] for e in chunk if e in by_entry)
+
+def like_escape(value):
+    # Makes user input match literally inside a LIKE pattern.
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Dashboard filters: form field -> (SQL condition, how the value is bound).
+# The LIKE escape character is bound rather than written as ESCAPE '\',
+# since MySQL reads a backslash in a string literal as an escape itself.
+DASHBOARD_FILTERS = {
+    'entryno': ("entryno LIKE :entryno ESCAPE :like_escape", lambda v: like_escape(v) + '%'),
+    'spec_name': ("spec_name LIKE :spec_name ESCAPE :like_escape", lambda v: '%' + like_escape(v) + '%'),
+    'completion_year': ("completion_year = :completion_year", lambda v: v),
+}
+
+def filtered_query(filters, after=None, before=None, limit=None):
+    sql = SNAPSHOT_SQL
+    params = {}
+    for field, value in filters.items():
+        condition, bind = DASHBOARD_FILTERS[field]
+        sql += f"    AND {condition}\n"
+        params[field] = bind(value)
+        if 'ESCAPE' in condition:
+            params['like_escape'] = '\\'
+    # Keyset pagination on entryno; `before` walks backwards for the previous page.
+    if after:
+        sql += "    AND entryno > :after\n"
+        params['after'] = after
+    if before:
+        sql += "    AND entryno < :before\n"
+        params['before'] = before
+    sql += "    ORDER BY entryno" + (" DESC\n" if before else "\n")
+    if limit:
+        sql += "    LIMIT :limit\n"
+        params['limit'] = limit
+    return text(sql), params
+
+def dashboard_page(session_pk, programme_pk, semester_pk, filters, version, after=None, before=None):
+    # `version` is the snapshot's refreshed_at. The cache is per process, so
+    # a refresh in one gunicorn worker only clears that worker's entries;
+    # keying on the version makes the others miss on their next request.
+    cohort = (int(session_pk), int(programme_pk), int(semester_pk))
+    page_size = app.config['DASHBOARD_PAGE_SIZE']
+    cache_key = (version, tuple(sorted(filters.items())), after, before, page_size)
+    page = dashboard_cache.get(cohort, cache_key)
+    if page is not None:
+        return page
+    # One extra row tells us whether there is another page.
+    sql, params = filtered_query(filters, after, before, page_size + 1)
+    params.update({'session_pk': session_pk, 'semester_pk': semester_pk, 'programme_pk': programme_pk})
+    records = [dict(r._mapping) for r in db.session.execute(sql, params)]
+    more = len(records) > page_size
+    records = records[:page_size]
+    if before:
+        records.reverse()
+    page = {
+        'records': records,
+        'has_next': more if not before else True,
+        'has_prev': more if before else bool(after),
+    }
+    dashboard_cache.set(cohort, cache_key, page)
+    return page
+
+def invalidate_dashboard_cache(session_pk=None, programme_pk=None, semester_pk=None):
+    # Call after the cohort's snapshot changes; with no arguments every
+    # cohort is dropped.
+    if session_pk is None:
+        dashboard_cache.invalidate()
+    else:
+        dashboard_cache.invalidate((int(session_pk), int(programme_pk), int(semester_pk)))
+
+# ------------------------------
+# Degree snapshot
+# ------------------------------
+
+_snapshot_tables_ready = False
+
+def ensure_snapshot_tables():
+    # `degrees` used to be keyed on entryno alone. It only holds derived
+    # data, so an old-style table is dropped and rebuilt.
+    global _snapshot_tables_ready
+    if _snapshot_tables_ready:
+        return
+    insp = inspect(db.engine)
+    if insp.has_table('degrees') and 'session_pk' not in {c['name'] for c in insp.get_columns('degrees')}:
+        Degree.__table__.drop(db.engine)
+    db.metadata.create_all(db.engine, tables=[Degree.__table__, DegreeSnapshot.__table__])
+    _snapshot_tables_ready = True
+
+def degree_row_hash(record):
+    payload = json.dumps([record[f] for f in DEGREE_FIELDS], default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def refresh_degrees(session_pk, programme_pk, semester_pk, entrynos=None):
+    # Re-runs the convocation join for one cohort, or only for the given
+    # entry numbers, and writes just the rows that were added, changed or
+    # removed. Returns counts of each.
+    ensure_snapshot_tables()
+    cohort = {'session_pk': int(session_pk), 'programme_pk': int(programme_pk), 'semester_pk': int(semester_pk)}
+    table = Degree.__table__
+    in_cohort = (table.c.session_pk == cohort['session_pk']) & (table.c.programme_pk == cohort['programme_pk']) \
+        & (table.c.semester_pk == cohort['semester_pk'])
+
+    if entrynos is None:
+        batches = [None]
+    else:
+        entrynos = list(dict.fromkeys(entrynos))
+        batches = [entrynos[i:i + FETCH_CHUNK_SIZE] for i in range(0, len(entrynos), FETCH_CHUNK_SIZE)]
+    fresh, existing = {}, {}
+    for batch in batches:
+        params = dict(cohort)
+        current = db.select(table.c.entryno, table.c.row_hash).where(in_cohort)
+        if batch is not None:
+            params['entrynos'] = batch
+            current = current.where(table.c.entryno.in_(batch))
+        for row in db.session.execute(convocation_query(by_entryno=batch is not None), params):
+            # The join can yield several rows per student; the first wins, as
+            # it always has.
+            fresh.setdefault(row.entryno, {f: None if row._mapping[f] is None else str(row._mapping[f])
+                                           for f in DEGREE_FIELDS})
+        existing.update((r.entryno, r.row_hash) for r in db.session.execute(current))
+
+    inserts, updates = [], []
+    for entryno, record in fresh.items():
+        record['row_hash'] = degree_row_hash(record)
+        if entryno not in existing:
+            inserts.append(dict(record, **cohort))
+        elif existing[entryno] != record['row_hash']:
+            updates.append(dict(record, b_entryno=entryno))
+    removed = [e for e in existing if e not in fresh]
+
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    if updates:
+        db.session.execute(
+            table.update().where(in_cohort & (table.c.entryno == bindparam('b_entryno')))
+            .values({f: bindparam(f) for f in DEGREE_FIELDS[1:] + ('row_hash',)}), updates)
+    for i in range(0, len(removed), FETCH_CHUNK_SIZE):
+        db.session.execute(table.delete().where(in_cohort & table.c.entryno.in_(removed[i:i + FETCH_CHUNK_SIZE])))
+    snapshot = db.session.get(DegreeSnapshot, (cohort['session_pk'], cohort['programme_pk'], cohort['semester_pk']))
+    if snapshot is None:
+        snapshot = DegreeSnapshot(**cohort)
+        db.session.add(snapshot)
+    snapshot.refreshed_at = datetime.now()
+    db.session.flush()
+    snapshot.row_count = db.session.execute(db.select(db.func.count()).select_from(table).where(in_cohort)).scalar()
+    db.session.commit()
+    invalidate_dashboard_cache(session_pk, programme_pk, semester_pk)
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(removed),
+            'unchanged': len(fresh) - len(inserts) - len(updates)}
+
+def degree_snapshot(session_pk, programme_pk, semester_pk):
+    # The cohort's snapshot record, building the snapshot on first use.
+    ensure_snapshot_tables()
+    snapshot = db.session.get(DegreeSnapshot, (int(session_pk), int(programme_pk), int(semester_pk)))
+    if snapshot is None:
+        refresh_degrees(session_pk, programme_pk, semester_pk)
+        snapshot = db.session.get(DegreeSnapshot, (int(session_pk), int(programme_pk), int(semester_pk)))
+    return snapshot
+
+@app.cli.command('refresh-degrees')
+@click.option('--session', 'session_pk', type=int, required=True)
+@click.option('--programme', 'programme_pk', type=int, required=True)
+@click.option('--semester', 'semester_pk', type=int, required=True)
+@click.option('--entryno', 'entrynos', multiple=True, help="Only refresh these students (repeatable).")
+def refresh_degrees_command(session_pk, programme_pk, semester_pk, entrynos):
+    """Rebuild the degrees snapshot for one cohort from the ERP tables."""
+    counts = refresh_degrees(session_pk, programme_pk, semester_pk, list(entrynos) or None)
+    click.echo(', '.join(f"{k}={v}" for k, v in counts.items()))
+
+# ------------------------------
+# Query plans
+# ------------------------------
+
+def query_plan_checks(session_pk, programme_pk, semester_pk, entrynos):
+    # (name, statement, params) for every query the dashboard, /generate and
+    # the snapshot refresh run.
+    cohort = {'session_pk': session_pk, 'programme_pk': programme_pk, 'semester_pk': semester_pk}
+    checks = [
+        ('refresh: whole cohort', convocation_query(), cohort),
+        ('refresh: selected students', convocation_query(by_entryno=True), dict(cohort, entrynos=entrynos)),
+        ('generate: selected records', fetch_query(), dict(cohort, entrynos=entrynos)),
+    ]
+    filters = {'entryno': entrynos[0][:2], 'spec_name': 'a', 'completion_year': '2020'}
+    for name, page_filters, after, limit in [
+            ('dashboard: first page', {}, None, app.config['DASHBOARD_PAGE_SIZE'] + 1),
+            ('dashboard: filtered next page', filters, entrynos[0], app.config['DASHBOARD_PAGE_SIZE'] + 1),
+            ('generate: all matching', filters, None, None)]:
+        stmt, params = filtered_query(page_filters, after=after, limit=limit)
+        checks.append((name, stmt, dict(params, **cohort)))
+    return checks
+
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    """Create the ERP table indexes the convocation join relies on."""
+    created = create_indexes(db.engine)
+    click.echo(f"Created {', '.join(created)}" if created else "All indexes already exist.")
+
+@app.cli.command('check-query-plans')
+@click.option('--session', 'session_pk', type=int, default=1)
+@click.option('--programme', 'programme_pk', type=int, default=1)
+@click.option('--semester', 'semester_pk', type=int, default=1)
+@click.option('--entryno', 'entrynos', multiple=True, default=['E001', 'E002'])
+def check_query_plans_command(session_pk, programme_pk, semester_pk, entrynos):
+    """EXPLAIN the dashboard, generate and refresh queries; fail on full table scans."""
+    ensure_snapshot_tables()
+    failed = False
+    with db.engine.connect() as conn:
+        for name, stmt, params in query_plan_checks(session_pk, programme_pk, semester_pk, list(entrynos)):
+            scans = full_scans(explain(conn, stmt, params))
+            click.echo(f"{'FAIL' if scans else 'ok'}  {name}")
+            for detail in scans:
+                click.echo(f"      full scan: {detail}")
+            failed = failed or bool(scans)
+    if failed:
+        raise SystemExit(1)
+
+# ------------------------------
+# Convocation pregeneration
+# ------------------------------
+
+def pregeneration_shards(session_pk, programme_pk, semester_pk, shard_size):
+    # (shard id, records) for the cohort's snapshot in shards of up to
+    # shard_size records, read one keyset page per shard in entry number
+    # order.
+    after, n = None, 0
+    while True:
+        sql, params = filtered_query({}, after=after, limit=shard_size)
+        params.update({'session_pk': session_pk, 'semester_pk': semester_pk, 'programme_pk': programme_pk})
+        records = [dict(r._mapping) for r in db.session.execute(sql, params)]
+        if not records:
+            return
+        yield f"{programme_pk}-{n:04d}", records
+        if len(records) < shard_size:
+            return
+        after, n = records[-1]['entryno'], n + 1
+
+def load_checkpoint(path):
+    # {shard id: latest entry}. A line cut short by an interrupted write is
+    # ignored; that shard simply runs again.
+    done = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done[entry['shard']] = entry
+    except FileNotFoundError:
+        pass
+    return done
+
+def _init_pregeneration_worker():
+    # Importing this module set the worker up; compile the template before
+    # the first shard arrives.
+    get_compiled_template(app.config['TEMPLATE_PATH'])
+
+def pregenerate_shard(out_dir, records, output_format):
+    # Runs in a worker process. Returns [entryno, path, error] per record,
+    # with the path relative to the output root.
+    os.makedirs(out_dir, exist_ok=True)
+    root = os.path.dirname(out_dir)
+    results = []
+    for index, record in enumerate(records):
+        docx_path = os.path.join(out_dir, docx_filename(record, index))
+        try:
+            render_docx(convert_record_to_context(record), docx_path)
+            path = docx_path
+            if output_format == 'pdf':
+                path, _ = convert_worker(docx_path)
+                os.remove(docx_path)
+        except Exception as e:
+            results.append([record.get('entryno'), None, f"{type(e).__name__}: {e}"])
+            continue
+        results.append([record.get('entryno'), os.path.relpath(path, root), None])
+    return results
+
+@app.cli.command('pregenerate')
+@click.option('--session', 'session_pk', type=int, required=True)
+@click.option('--semester', 'semester_pk', type=int, required=True)
+@click.option('--programme', 'programmes', multiple=True, required=True,
+              help="Programme pk (repeatable), or \"all\".")
+@click.option('--output-dir', type=click.Path(file_okay=False), required=True)
+@click.option('--format', 'output_format', type=click.Choice(['pdf', 'docx']), default='pdf')
+@click.option('--workers', type=int, default=app.config['CONVERTER_POOL_SIZE'], show_default=True,
+              help="Worker processes, each with its own LibreOffice.")
+@click.option('--shard-size', type=int, default=200, show_default=True)
+@click.option('--refresh/--no-refresh', default=True, show_default=True,
+              help="Rebuild each cohort's snapshot from the ERP tables first.")
+def pregenerate_command(session_pk, semester_pk, programmes, output_dir, output_format, workers, shard_size,
+                        refresh):
+    """Generate a whole convocation into OUTPUT_DIR/<programme>/, resuming an interrupted run."""
+    if 'all' in programmes:
+        programme_pks = [p['pk'] for p in get_programmes()]
+    else:
+        try:
+            programme_pks = [int(p) for p in programmes]
+        except ValueError:
+            raise click.BadParameter('expected programme pks or "all"', param_hint='--programme')
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, 'checkpoint.jsonl')
+    done = load_checkpoint(checkpoint_path)
+    template_hash = file_sha256(app.config['TEMPLATE_PATH'])
+    workers, shard_size = max(1, workers), max(1, shard_size)
+
+    def cohort_shards():
+        for programme_pk in programme_pks:
+            if refresh:
+                counts = refresh_degrees(session_pk, programme_pk, semester_pk)
+                click.echo(f"programme {programme_pk}: snapshot refreshed, "
+                           + ', '.join(f"{k}={v}" for k, v in counts.items()))
+            else:
+                snapshot = degree_snapshot(session_pk, programme_pk, semester_pk)
+                age = datetime.now() - snapshot.refreshed_at
+                click.echo(f"programme {programme_pk}: snapshot of {snapshot.refreshed_at:%Y-%m-%d %H:%M}, "
+                           f"{age.total_seconds() / 3600:.1f} hours old")
+            for shard_id, records in pregeneration_shards(session_pk, programme_pk, semester_pk, shard_size):
+                yield shard_id, programme_pk, records
+
+    # Shards are read and submitted as workers free up, so only a few are
+    # held in memory however large the convocation.
+    shards, in_flight = [], {}
+    skipped = finished = 0
+    executor = checkpoint = None
+
+    def collect(futures):
+        nonlocal finished
+        for future in futures:
+            shard_id, programme_pk, digest, kept = in_flight.pop(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                click.echo(f"shard {shard_id} failed: {type(e).__name__}: {e}", err=True)
+                continue
+            entry = {'shard': shard_id, 'programme': programme_pk, 'digest': digest,
+                     'results': sorted(kept + results, key=lambda r: r[0] or '')}
+            checkpoint.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            done[shard_id] = entry
+            finished += 1
+            failed = sum(1 for r in results if r[2] is not None)
+            click.echo(f"[{finished}] shard {shard_id}: {len(results) - failed} generated, {failed} failed")
+
+    try:
+        for shard_id, programme_pk, records in cohort_shards():
+            # A shard is redone when its records, the template or the
+            # format changed; otherwise only its failed records run again.
+            payload = json.dumps([records, template_hash, output_format], sort_keys=True, default=str)
+            digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+            previous = done.get(shard_id)
+            kept = []
+            if previous and previous['digest'] == digest:
+                kept = [r for r in previous['results'] if r[2] is None]
+            shards.append((shard_id, digest))
+            succeeded = {r[0] for r in kept}
+            todo = [r for r in records if r['entryno'] not in succeeded]
+            if not todo:
+                skipped += 1
+                continue
+            if executor is None:
+                # One conversion at a time per process; the parallelism
+                # comes from the processes. spawn rather than fork: this
+                # process runs an eventlet hub.
+                os.environ['CONVERTER_POOL_SIZE'] = '1'
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                               initializer=_init_pregeneration_worker)
+                checkpoint = open(checkpoint_path, 'a', encoding='utf-8')
+            while len(in_flight) >= workers * 2:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            out_dir = os.path.join(os.path.abspath(output_dir), f"programme_{programme_pk}")
+            in_flight[executor.submit(pregenerate_shard, out_dir, todo, output_format)] = (
+                shard_id, programme_pk, digest, kept)
+        while in_flight:
+            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+            checkpoint.close()
+    click.echo(f"{len(shards)} shards, {skipped} already done")
+
+    # The manifest covers this run's shards only, whatever else the
+    # checkpoint remembers.
+    records = []
+    current = [done[s] for s, digest in shards if s in done and done[s]['digest'] == digest]
+    for entry in current:
+        for entryno, path, error in entry['results']:
+            records.append({'entryno': entryno, 'programme': entry['programme'], 'shard': entry['shard'],
+                            'path': path, 'status': 'failed' if error else 'done', 'error': error})
+    failed = sum(1 for r in records if r['status'] == 'failed')
+    manifest = {'session': session_pk, 'semester': semester_pk, 'programmes': programme_pks,
+                'format': output_format, 'template_sha256': template_hash,
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'shards': len(shards), 'complete': len(current) == len(shards),
+                'done': len(records) - failed, 'failed': failed, 'records': records}
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    click.echo(f"{manifest['done']} generated, {failed} failed; manifest at {manifest_path}")
+    if failed or not manifest['complete']:
+        raise SystemExit(1)
+
+
 # ------------------------------
 # Routes
 # ------------------------------
@@ -235,71 +848,42 @@ def dashboard():
         flash("Please select session details", "warning")
         return redirect(url_for('select_details'))
     
-    sql = text("""
-        SELECT DISTINCT
-            employee_master.pf_number AS entryno,
-            employee_master.first_name AS name,
-            employee_master.name_hindi,
-            IFNULL(dgpa.dgpa, acad_course_grade_cpi.cpi) AS degree_gpa,
-            acad_degree_name_print.english_prog_name AS degree_name,
-            acad_degree_name_print.engish_spec_name AS spec_name,
-            acad_degree_name_print.hindi_prog_name AS degree_name_hindi,
-            acad_degree_name_print.hindi_spec_name AS spec_name_hindi,
-            acad_session_master.given_year,
-            acad_session_master.given_month,
-            acad_session_master.given_day,
-            acad_session_master.convo_year,
-            acad_session_master.convo_day,
-            acad_session_master.completion_year,
-            acad_session_master.convo_month_hindi
-        FROM
-            employee_master
-            INNER JOIN student_master_programme_details 
-                ON student_master_programme_details.employee_master_pk = employee_master.pk
-            INNER JOIN programme_master 
-                ON programme_master.pk = student_master_programme_details.acad_programme_master_pk
-            INNER JOIN acad_degree_name_print 
-                ON acad_degree_name_print.acad_branch_master_pk = student_master_programme_details.acad_branch_master_pk
-                AND acad_degree_name_print.programme_pk = student_master_programme_details.acad_programme_master_pk
-                AND acad_degree_name_print.batch = student_master_programme_details.batch
-                AND acad_degree_name_print.specialization_pk = student_master_programme_details.specialization_master_pk
-            INNER JOIN acad_course_grade_cpi 
-                ON acad_course_grade_cpi.student_pk = student_master_programme_details.employee_master_pk
-               AND acad_course_grade_cpi.flag = 1
-            LEFT JOIN dgpa 
-                ON dgpa.employee_master_pk = student_master_programme_details.employee_master_pk
-               AND dgpa.flag = student_master_programme_details.pg_status
-            INNER JOIN acad_student_warning_ap 
-                ON acad_student_warning_ap.employee_master_pk = student_master_programme_details.employee_master_pk
-               AND acad_student_warning_ap.flag = 1
-            INNER JOIN acad_session_master
-                ON acad_student_warning_ap.acad_session_master_pk = acad_session_master.pk
-        WHERE
-            acad_student_warning_ap.wap IN (6)
-            AND acad_session_master.pk = :session_pk
-            AND acad_student_warning_ap.acad_semester_pk = :semester_pk
-            AND programme_master.pk = :programme_pk
-            AND acad_student_warning_ap.flag = 1
-            AND acad_course_grade_cpi.flag = 1
-            AND employee_master.identifier_master_pk = 2
-    """)
-    
-    results = db.session.execute(sql, {
-        'session_pk': session_pk,
-        'semester_pk': semester_pk,
-        'programme_pk': programme_pk
-    }).fetchall()
-    
-    # Convert SQLAlchemy Row objects into dictionaries for passing to the template.
-    records = [dict(r._mapping) for r in results]
-    return render_template('dashboard.html', records=records)
+    snapshot = degree_snapshot(session_pk, programme_pk, semester_pk)
+    filters = dashboard_filters(request.args)
+    page = dashboard_page(session_pk, programme_pk, semester_pk, filters, snapshot.refreshed_at,
+                          after=request.args.get('after'), before=request.args.get('before'))
+    # Thumbnails only for degrees already made; the rows hold the whole
+    # record, so finding them takes no queries.
+    thumbnails = {}
+    for record in page['records']:
+        key = existing_preview_key(record)
+        if key:
+            thumbnails[record['entryno']] = key
+    return render_template('dashboard.html', filters=filters, snapshot=snapshot, thumbnails=thumbnails, **page)
+
+@app.route('/dashboard/refresh', methods=['POST'])
+@login_required
+def refresh_dashboard():
+    session_pk = session.get('session_pk')
+    programme_pk = session.get('programme_pk')
+    semester_pk = session.get('semester_pk')
+    if not (session_pk and programme_pk and semester_pk):
+        return redirect(url_for('select_details'))
+    counts = refresh_degrees(session_pk, programme_pk, semester_pk)
+    flash(f"Data refreshed: {counts['inserted']} added, {counts['updated']} changed, "
+          f"{counts['deleted']} removed.", "info")
+    return redirect(url_for('dashboard', **dashboard_filters(request.form)))
+
+def dashboard_filters(args):
+    return {field: args[field].strip() for field in DASHBOARD_FILTERS if args.get(field, '').strip()}
 
 # Generation Route: Re-fetch records for each selected entry for document generation.
 @app.route('/generate', methods=['POST'])
 @login_required
 def generate():
     selected = request.form.getlist('entries')
-    if not selected:
+    all_matching = request.form.get('all_matching') == '1'
+    if not selected and not all_matching:
         flash("Select at least one record to generate degrees.", "warning")
         return redirect(url_for('dashboard'))
     
@@ -307,140 +891,916 @@ def generate():
     programme_pk = session.get('programme_pk')
     semester_pk = session.get('semester_pk')
     
-    # Fetch full details for each selected entry.
-    records = []
-    for entry in selected:
-        sql = text("""
-            SELECT DISTINCT
-                employee_master.pf_number AS entryno,
-                employee_master.first_name AS name,
-                employee_master.name_hindi,
-                IFNULL(dgpa.dgpa, acad_course_grade_cpi.cpi) AS degree_gpa,
-                acad_degree_name_print.english_prog_name AS degree_name,
-                acad_degree_name_print.engish_spec_name AS spec_name,
-                acad_degree_name_print.hindi_prog_name AS degree_name_hindi,
-                acad_degree_name_print.hindi_spec_name AS spec_name_hindi,
-                acad_session_master.given_year,
-                acad_session_master.given_month,
-                acad_session_master.given_day,
-                acad_session_master.convo_year,
-                acad_session_master.convo_day,
-                acad_session_master.completion_year,
-                acad_session_master.convo_month_hindi
-            FROM
-                employee_master
-                INNER JOIN student_master_programme_details 
-                    ON student_master_programme_details.employee_master_pk = employee_master.pk
-                INNER JOIN programme_master 
-                    ON programme_master.pk = student_master_programme_details.acad_programme_master_pk
-                INNER JOIN acad_degree_name_print 
-                    ON acad_degree_name_print.acad_branch_master_pk = student_master_programme_details.acad_branch_master_pk
-                    AND acad_degree_name_print.programme_pk = student_master_programme_details.acad_programme_master_pk
-                    AND acad_degree_name_print.batch = student_master_programme_details.batch
-                    AND acad_degree_name_print.specialization_pk = student_master_programme_details.specialization_master_pk
-                INNER JOIN acad_course_grade_cpi 
-                    ON acad_course_grade_cpi.student_pk = student_master_programme_details.employee_master_pk
-                   AND acad_course_grade_cpi.flag = 1
-                LEFT JOIN dgpa 
-                    ON dgpa.employee_master_pk = student_master_programme_details.employee_master_pk
-                   AND dgpa.flag = student_master_programme_details.pg_status
-                INNER JOIN acad_student_warning_ap 
-                    ON acad_student_warning_ap.employee_master_pk = student_master_programme_details.employee_master_pk
-                   AND acad_student_warning_ap.flag = 1
-                INNER JOIN acad_session_master
-                    ON acad_student_warning_ap.acad_session_master_pk = acad_session_master.pk
-            WHERE
-                acad_student_warning_ap.wap IN (6)
-                AND acad_session_master.pk = :session_pk
-                AND acad_student_warning_ap.acad_semester_pk = :semester_pk
-                AND programme_master.pk = :programme_pk
-                AND employee_master.pf_number = :entryno
-                AND acad_student_warning_ap.flag = 1
-                AND acad_course_grade_cpi.flag = 1
-                AND employee_master.identifier_master_pk = 2
-        """)
-        result = db.session.execute(sql, {
-            'session_pk': session_pk,
-            'semester_pk': semester_pk,
-            'programme_pk': programme_pk,
-            'entryno': entry
-        }).fetchone()
-        if result:
-            records.append(dict(result._mapping))
+    fetch_start = time.perf_counter()
+    if all_matching:
+        # Every record matching the dashboard filters, not just the visible page.
+        sql, params = filtered_query(dashboard_filters(request.form))
+        params.update({'session_pk': session_pk, 'semester_pk': semester_pk, 'programme_pk': programme_pk})
+        rows = db.session.execute(sql, params, execution_options={'yield_per': FETCH_CHUNK_SIZE})
+        records = (dict(r._mapping) for r in rows)
+    else:
+        # Fetch full details for the selected entries in set-based chunks.
+        # Merged documents are printed, so their pages go in entryno order,
+        # as "all matching" rows already come.
+        if request.form.get('output_format') == 'merged':
+            selected = sorted(selected)
+        records = fetch_records(session_pk, programme_pk, semester_pk, selected)
     
-    # At this point, records is a list of dictionaries containing the data for each selected entry.
-    # Proceed to generate documents (e.g. DOCX/PDF) using these records.
+    # records is a lazy stream of dictionaries, one per selected entry. They
+    # are queued as they are read; a worker process picks the job up and does
+    # the generation.
     task_id = uuid.uuid4().hex
-    thread = threading.Thread(target=generate_task, args=(records, task_id, request.form.get('output_format', 'pdf')))
-    thread.start()
+    job_store.enqueue(task_id, records, request.form.get('output_format', 'pdf'),
+                      os.path.join(app.config['OUTPUT_DIR'], task_id))
+    fetch_seconds = time.perf_counter() - fetch_start
+    job_store.record_timings(task_id, [(None, 'fetch', fetch_seconds, 1)])
+    ensure_progress_relay()
     return render_template('progress.html', task_id=task_id)
 
-def generate_task(records, task_id, output_format):
+def render_records(items, out_dir):
+    # items are (seq, record) pairs; yields (seq, docx_path, timings, error)
+    # as each is rendered, like RenderPool.render.
+    if app.config['RENDER_WORKERS'] > 0:
+        # The pool lives for one job so idle workers never outlast it.
+        with RenderPool(app.config['RENDER_WORKERS'], app.config['TEMPLATE_PATH'],
+                        app.config['RENDER_CHUNK_SIZE'], app.config['RENDER_NICENESS']) as pool:
+            yield from pool.render(items, out_dir)
+        return
+    for seq, record in items:
+        try:
+            start = time.perf_counter()
+            context = convert_record_to_context(record)
+            built = time.perf_counter()
+            docx_path = os.path.join(out_dir, docx_filename(record, seq))
+            render_docx(context, docx_path)
+        except Exception as e:
+            yield seq, None, {}, f"{type(e).__name__}: {e}"
+            continue
+        timings = {'context': built - start, 'render': time.perf_counter() - built}
+        # Let other green threads run between documents.
+        eventlet.sleep(0)
+        yield seq, docx_path, timings, None
+
+def stamp_records(items, out_dir, template):
+    # The stamping fast path: PDFs straight from the record with no DOCX or
+    # LibreOffice in between. Yields like render_records; a record that
+    # cannot be stamped is rendered to DOCX instead, for the converters.
+    for seq, record in items:
+        try:
+            start = time.perf_counter()
+            context = convert_record_to_context(record)
+            built = time.perf_counter()
+            docx_path = os.path.join(out_dir, docx_filename(record, seq))
+            try:
+                path = docx_path[:-len('.docx')] + '.pdf'
+                template.render_to(path, context)
+                timings = {'context': built - start, 'stamp': time.perf_counter() - built}
+            except StampingUnsupported as e:
+                app.logger.info(f"Converting {record.get('entryno')} with LibreOffice: {e}")
+                render_docx(context, docx_path)
+                path = docx_path
+                timings = {'context': built - start, 'render': time.perf_counter() - built}
+        except Exception as e:
+            yield seq, None, {}, f"{type(e).__name__}: {e}"
+            continue
+        eventlet.sleep(0)
+        yield seq, path, timings, None
+
+def stamp_template_for(items):
+    # The stamping template, built and checked against LibreOffice on the
+    # first items if this template version has not been seen yet. Returns
+    # (template or None, items).
+    items = iter(items)
+    first = list(itertools.islice(items, max(1, app.config['STAMP_VERIFY_RECORDS'])))
+    if not first:
+        return None, items
+    items = itertools.chain(first, items)
+    try:
+        samples = [convert_record_to_context(item['record']) for item in first]
+        template = get_stamp_template(app.config['TEMPLATE_PATH'], app.config['STAMP_CACHE_DIR'],
+                                      lambda docx_path: convert_worker(docx_path)[0], samples,
+                                      app.config['STAMP_DEVANAGARI_FONT'] or DEVANAGARI_FONT,
+                                      max_diff=app.config['STAMP_MAX_DIFF'])
+    except Exception as e:
+        app.logger.error(f"Stamping unavailable, converting with LibreOffice instead: {e}")
+        return None, items
+    return template, items
+
+# Marks the end of a stage's input queue.
+_STAGE_DONE = object()
+
+def generate_task(task_id):
+    # Runs in a worker process. Only items not yet finished are processed, so
+    # a job picked up again after a crash resumes where it stopped.
     with app.app_context():
-        total = len(records)
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            docx_paths = []
-            # Stage 1: Generate DOCX files.
-            for i, record in enumerate(records):
-                context = convert_record_to_context(record)
-                docx_buf = render_docx(context)
-                entry = record.get('entryno', f"doc_{i}")
-                docx_path = os.path.join(tmpdirname, f'{entry}.docx')
-                with open(docx_path, 'wb') as f:
-                    f.write(docx_buf.read())
-                docx_paths.append(docx_path)
-                progress = int((i + 1) / total * 30)
-                socketio.emit('progress_update', {'task_id': task_id, 'progress': progress})
-            
-            if output_format == 'pdf':
-                pdf_paths = []
-                with ThreadPoolExecutor(max_workers=4) as executor:
-                    future_to_docx = {executor.submit(convert_worker, docx): docx for docx in docx_paths}
-                    for i, future in enumerate(as_completed(future_to_docx)):
-                        try:
-                            pdf_path = future.result()
-                            pdf_paths.append(pdf_path)
-                        except Exception as e:
-                            app.logger.error(f"Conversion failed for {future_to_docx[future]}: {e}")
-                        progress = 30 + int((i + 1) / total * 50)
-                        socketio.emit('progress_update', {'task_id': task_id, 'progress': progress})
-                output_paths = pdf_paths
+        job = job_store.get_job(task_id)
+        output_format = job['output_format']
+        os.makedirs(job['output_dir'], exist_ok=True)
+        if output_format == 'merged':
+            generate_merged(task_id, job)
+            return
+        # Items are streamed from the store page by page. Cache keys are only
+        # kept for items in flight, so memory stays bounded by the queues and
+        # the render pool rather than the size of the job.
+        items = job_store.unfinished_items(task_id)
+        stamp_template = None
+        if output_format == 'pdf' and app.config['PDF_ENGINE'] == 'stamp':
+            stamp_template, items = stamp_template_for(items)
+        # Stamped PDFs are cached apart from LibreOffice's, and need no DOCX.
+        # A record the stamper hands to LibreOffice is cached under the same
+        # key: it would be handed over again on every run.
+        cache_formats = {'pdf': 'pdf-stamped'} if stamp_template else {'docx': 'docx', 'pdf': 'pdf'}
+        cache_keys = {}
+        if artifact_cache is not None:
+            template_hash = file_sha256(app.config['TEMPLATE_PATH'])
+        queue_size = app.config['PIPELINE_QUEUE_SIZE']
+        archive_queue = queue.Queue(maxsize=queue_size)
+
+        # Stage 3: Publish each output as soon as it is produced; /download
+        # zips them on the fly.
+        def archive_stage():
+            while True:
+                item = archive_queue.get()
+                if item is _STAGE_DONE:
+                    break
+                seq, file_path = item
+                if os.path.exists(file_path):
+                    job_store.mark_item(task_id, seq, DONE, output_path=file_path)
+                else:
+                    app.logger.warning(f"File {file_path} not found. Skipping.")
+                    job_store.mark_item(task_id, seq, FAILED, error="archive: output file not produced",
+                                        error_kind=TRANSIENT)
+
+        # Stage 2: Convert DOCX files to PDF as they are rendered.
+        def convert_stage():
+            while True:
+                item = convert_queue.get()
+                if item is _STAGE_DONE:
+                    break
+                pipeline_gauges.dec('convert_queue_depth')
+                seq, docx_path = item
+                keys = cache_keys.pop(seq, None)
+                pipeline_gauges.inc('converters_busy')
+                start = time.perf_counter()
+                try:
+                    pdf_path, attempts = convert_worker(docx_path)
+                except Exception as e:
+                    app.logger.error(f"Conversion failed for {docx_path}: {e}")
+                    attempts = getattr(e, 'attempts', 1)
+                    job_store.record_timings(task_id, [(seq, 'convert', time.perf_counter() - start, attempts)])
+                    job_store.mark_item(task_id, seq, FAILED, error=f"convert: {e}",
+                                        error_kind=TRANSIENT if getattr(e, 'transient', False) else PERMANENT,
+                                        attempts=attempts)
+                    continue
+                finally:
+                    pipeline_gauges.dec('converters_busy')
+                job_store.record_timings(task_id, [(seq, 'convert', time.perf_counter() - start, attempts)])
+                job_store.mark_item(task_id, seq, CONVERTED, output_path=pdf_path, attempts=attempts)
+                if keys is not None and os.path.exists(pdf_path):
+                    artifact_cache.put(keys['pdf'], 'pdf', pdf_path)
+                archive_queue.put((seq, pdf_path))
+
+        archiver = threading.Thread(target=archive_stage)
+        archiver.start()
+        converters = []
+        if output_format == 'pdf':
+            convert_queue = queue.Queue(maxsize=queue_size)
+            converters = [threading.Thread(target=convert_stage) for _ in range(converter_pool.size)]
+            for t in converters:
+                t.start()
+
+        def forward(seq, docx_path):
+            if converters:
+                pipeline_gauges.inc('convert_queue_depth')
+                convert_queue.put((seq, docx_path))
+            else:
+                cache_keys.pop(seq, None)
+                archive_queue.put((seq, docx_path))
+
+        cache_counts = {'hits': 0, 'misses': 0}
+
+        def count_cache(hit):
+            cache_counts['hits' if hit else 'misses'] += 1
+            if sum(cache_counts.values()) >= 100:
+                flush_cache_counts()
+
+        def flush_cache_counts():
+            job_store.count_cache(task_id, cache_counts['hits'], cache_counts['misses'])
+            cache_counts.update(hits=0, misses=0)
+
+        def to_render():
+            # Forwards items that are already (partly) done and yields the rest
+            # as (seq, record) for rendering. Pulled lazily by the renderer.
+            for item in items:
+                seq = item['seq']
+                if item['status'] == CONVERTED and os.path.exists(item['output_path'] or ''):
+                    archive_queue.put((seq, item['output_path']))
+                    continue
+                if artifact_cache is not None:
+                    context = convert_record_to_context(item['record'])
+                    cache_keys[seq] = {fmt: ArtifactCache.key(context, template_hash, key_format)
+                                       for fmt, key_format in cache_formats.items()}
+                if item['status'] in (RENDERED, CONVERTED) and os.path.exists(item['docx_path'] or ''):
+                    forward(seq, item['docx_path'])
+                    continue
+                if artifact_cache is not None:
+                    # One lookup per item in the counts: a hit on either
+                    # tier is a hit, a miss on both a miss.
+                    docx_path = os.path.join(job['output_dir'], docx_filename(item['record'], seq))
+                    if output_format == 'pdf':
+                        pdf_path = docx_path[:-len('.docx')] + '.pdf'
+                        if artifact_cache.get(cache_keys[seq]['pdf'], 'pdf', pdf_path):
+                            count_cache(True)
+                            del cache_keys[seq]
+                            job_store.mark_item(task_id, seq, CONVERTED, output_path=pdf_path)
+                            archive_queue.put((seq, pdf_path))
+                            continue
+                    if stamp_template is not None:
+                        count_cache(False)
+                        yield seq, item['record']
+                        continue
+                    hit = artifact_cache.get(cache_keys[seq]['docx'], 'docx', docx_path)
+                    count_cache(hit)
+                    if hit:
+                        job_store.mark_item(task_id, seq, RENDERED, docx_path=docx_path)
+                        forward(seq, docx_path)
+                        continue
+                yield seq, item['record']
+
+        # Stage 1: Generate DOCX files (or stamp PDFs); the bounded queues
+        # hold rendering back whenever conversion or archiving falls behind.
+        if stamp_template is not None:
+            produced = stamp_records(to_render(), job['output_dir'], stamp_template)
+        else:
+            produced = render_records(to_render(), job['output_dir'])
+        try:
+            for seq, docx_path, timings, error in produced:
+                if error:
+                    # Rendering is deterministic, so the same record would fail again.
+                    app.logger.error(f"Rendering failed for item {seq} of job {task_id}: {error}")
+                    job_store.mark_item(task_id, seq, FAILED, error=f"render: {error}", error_kind=PERMANENT,
+                                        attempts=1)
+                    cache_keys.pop(seq, None)
+                    continue
+                if stamp_template is not None and docx_path.endswith('.pdf'):
+                    pdf_path = docx_path
+                    job_store.mark_item(task_id, seq, CONVERTED, output_path=pdf_path)
+                    job_store.record_timings(task_id, [(seq, stage, seconds, 1) for stage, seconds in timings.items()])
+                    keys = cache_keys.pop(seq, None)
+                    if keys is not None:
+                        artifact_cache.put(keys['pdf'], 'pdf', pdf_path)
+                    archive_queue.put((seq, pdf_path))
+                    continue
+                job_store.mark_item(task_id, seq, RENDERED, docx_path=docx_path)
+                job_store.record_timings(task_id, [(seq, stage, seconds, 1) for stage, seconds in timings.items()])
+                if artifact_cache is not None and 'docx' in cache_formats:
+                    artifact_cache.put(cache_keys[seq]['docx'], 'docx', docx_path)
+                forward(seq, docx_path)
+            flush_cache_counts()
+        finally:
+            for _ in converters:
+                convert_queue.put(_STAGE_DONE)
+            for t in converters:
+                t.join()
+            archive_queue.put(_STAGE_DONE)
+            archiver.join()
+
+def merged_chunks(items, size):
+    # Groups a merged job's unfinished items into documents, yielding
+    # (chunk, docx_path) with chunk a list of (seq, record). Items whose
+    # document was rendered and still exists come with its path, to be
+    # converted again as they are; the rest are batched up to `size` pages
+    # with a docx_path of None, to be rendered.
+    pending, rendered, rendered_path = [], [], None
+    for item in items:
+        pair = (item['seq'], item['record'])
+        if item['status'] == RENDERED and os.path.exists(item['docx_path'] or ''):
+            if rendered and item['docx_path'] != rendered_path:
+                yield rendered, rendered_path
+                rendered = []
+            rendered_path = item['docx_path']
+            rendered.append(pair)
+            continue
+        pending.append(pair)
+        if len(pending) == size:
+            yield pending, None
+            pending = []
+    if rendered:
+        yield rendered, rendered_path
+    if pending:
+        yield pending, None
+
+def generate_merged(task_id, job):
+    # Output format "merged": records are rendered into documents of
+    # MERGE_CHUNK_SIZE pages in seq (entryno) order, and each document is
+    # converted to PDF once. The items of a document share its files and
+    # finish or fail together.
+    convert_queue = queue.Queue(maxsize=converter_pool.size)
+
+    def convert_stage():
+        while True:
+            item = convert_queue.get()
+            if item is _STAGE_DONE:
+                break
+            pipeline_gauges.dec('convert_queue_depth')
+            seqs, docx_path = item
+            pipeline_gauges.inc('converters_busy')
+            start = time.perf_counter()
+            try:
+                pdf_path, attempts = convert_worker(docx_path)
+            except Exception as e:
+                app.logger.error(f"Conversion failed for {docx_path}: {e}")
+                attempts = getattr(e, 'attempts', 1)
+                job_store.record_timings(task_id, [(None, 'merge_convert', time.perf_counter() - start, attempts)])
+                job_store.mark_items(task_id, seqs, FAILED, error=f"convert: {e}",
+                                     error_kind=TRANSIENT if getattr(e, 'transient', False) else PERMANENT,
+                                     attempts=attempts)
+                continue
+            finally:
+                pipeline_gauges.dec('converters_busy')
+            job_store.record_timings(task_id, [(None, 'merge_convert', time.perf_counter() - start, attempts)])
+            if os.path.exists(pdf_path):
+                job_store.mark_items(task_id, seqs, DONE, output_path=pdf_path, attempts=attempts)
             else:
-                output_paths = docx_paths
-                socketio.emit('progress_update', {'task_id': task_id, 'progress': 80})
-            
-            # Stage 3: Zip the output files.
-            tmp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-            zip_path = tmp_zip.name
-            tmp_zip.close()
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for file_path in output_paths:
-                    if os.path.exists(file_path):
-                        zf.write(file_path, arcname=os.path.basename(file_path))
+                job_store.mark_items(task_id, seqs, FAILED, error="convert: output file not produced",
+                                     error_kind=TRANSIENT, attempts=attempts)
+
+    converters = [threading.Thread(target=convert_stage) for _ in range(converter_pool.size)]
+    for t in converters:
+        t.start()
+    pool = None
+    if app.config['RENDER_WORKERS'] > 0:
+        # Documents are rendered one at a time, so one process is enough.
+        pool = RenderPool(1, app.config['TEMPLATE_PATH'], niceness=app.config['RENDER_NICENESS'])
+    try:
+        for chunk, docx_path in merged_chunks(job_store.unfinished_items(task_id),
+                                              max(1, app.config['MERGE_CHUNK_SIZE'])):
+            seqs = [seq for seq, _ in chunk]
+            if docx_path is None:
+                docx_path = os.path.join(job['output_dir'], merged_filename(chunk))
+                start = time.perf_counter()
+                try:
+                    if pool is not None:
+                        seqs, failed = pool.render_merged(chunk, docx_path)
                     else:
-                        app.logger.warning(f"File {file_path} not found. Skipping.")
-            socketio.emit('progress_update', {'task_id': task_id, 'progress': 100})
-            socketio.emit('generation_complete', {'task_id': task_id, 'zip_path': zip_path})
+                        seqs, failed = render_merged(app.config['TEMPLATE_PATH'], chunk, docx_path)
+                except Exception as e:
+                    app.logger.error(f"Rendering {docx_path} failed: {e}")
+                    seqs, failed = [], [(seq, f"{type(e).__name__}: {e}") for seq in seqs]
+                job_store.record_timings(task_id, [(None, 'merge_render', time.perf_counter() - start, 1)])
+                for seq, error in failed:
+                    job_store.mark_item(task_id, seq, FAILED, error=f"render: {error}", error_kind=PERMANENT,
+                                        attempts=1)
+                if not seqs:
+                    continue
+                job_store.mark_items(task_id, seqs, RENDERED, docx_path=docx_path)
+            pipeline_gauges.inc('convert_queue_depth')
+            convert_queue.put((seqs, docx_path))
+    finally:
+        for _ in converters:
+            convert_queue.put(_STAGE_DONE)
+        for t in converters:
+            t.join()
+        if pool is not None:
+            pool.shutdown()
+
+def run_job(task_id):
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(app.config['JOB_HEARTBEAT_INTERVAL']):
+            job_store.heartbeat(task_id)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    start = time.perf_counter()
+    status = 'done'
+    try:
+        generate_task(task_id)
+    except Exception:
+        app.logger.exception(f"Generation job {task_id} failed")
+        status = 'failed'
+    finally:
+        stop.set()
+    try:
+        archive_job(task_id)
+    except Exception:
+        app.logger.exception(f"Archiving job {task_id} failed")
+    job_store.record_timings(task_id, [(None, 'job', time.perf_counter() - start, 1)])
+    job_store.finish(task_id, status)
+    # One structured line per job, so timings outlive the job's cleanup.
+    summary = summarize_timings(job_store.task_timings(task_id), slowest=3)
+    app.logger.info(f"Job {task_id} {status}: {json.dumps(summary)}")
+
+def archive_job(task_id):
+    # Zips the job's outputs into the archive store, on eventlet's pool of
+    # OS threads, then removes the output directory: the archive holds
+    # everything worth keeping, and a retry unpacks it again. Returns the
+    # archive's path, or None if there is nothing to archive.
+    paths = dict.fromkeys(row['path'] for row in job_store.outputs_after(task_id))
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths:
+        return None
+    start = time.perf_counter()
+    path = tpool.execute(archive_store.build, task_id, paths)
+    job_store.record_timings(task_id, [(None, 'zip', time.perf_counter() - start, 1)])
+    shutil.rmtree(job_store.get_job(task_id)['output_dir'], ignore_errors=True)
+    return path
+
+def remove_job(task_id, output_dir):
+    archive_store.discard(task_id)
+    job_store.delete_job(task_id)
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+def prune_jobs():
+    # A finished job is kept for ARCHIVE_TTL_HOURS after it finished, with
+    # or without an archive, then removed with whatever files it has left.
+    # An archive evicted sooner to make room takes its job with it, since
+    # the job's output files went once the archive was built.
+    for job in job_store.finished_before(time.time() - archive_store.ttl):
+        remove_job(job['task_id'], job['output_dir'])
+    for task_id in archive_store.prune():
+        job = job_store.get_job(task_id)
+        if job is not None and job['status'] not in ('queued', 'running'):
+            remove_job(task_id, job['output_dir'])
+
+def run_worker():
+    # Claims queued (or abandoned) jobs and runs up to JOB_CONCURRENCY at once.
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    # Without the UNO bindings every conversion would fail; refuse to start.
+    app.logger.info(f"Generation worker {worker_id} started, UNO: {converter_pool.uno_route()}")
+    job_store.set_gauges(worker_id, {'ready': 0})
+    pipeline_gauges.inc('ready', 1 if warm_up(convert=True) else 0)
+    active = []
+    published = 0
+    while True:
+        active = [t for t in active if t.is_alive()]
+        if time.monotonic() - published >= app.config['JOB_HEARTBEAT_INTERVAL']:
+            job_store.set_gauges(worker_id, dict(pipeline_gauges.snapshot(), jobs_active=len(active)))
+            prune_jobs()
+            published = time.monotonic()
+        if len(active) < app.config['JOB_CONCURRENCY']:
+            task_id = job_store.claim_next(worker_id, app.config['JOB_STALE_AFTER'])
+            if task_id:
+                app.logger.info(f"Worker {worker_id} picked up job {task_id}")
+                t = threading.Thread(target=run_job, args=(task_id,))
+                t.start()
+                active.append(t)
+                continue
+        time.sleep(app.config['JOB_POLL_INTERVAL'])
+
+# ------------------------------
+# Warm-up
+# ------------------------------
+
+# This process's warm-up: when it ran, and seconds or error per step.
+warm_up_state = {'started': None, 'finished': None, 'steps': {}, 'errors': {}}
+
+def open_pool(engine):
+    # Checks out as many connections as the pool keeps, so none is opened
+    # on the first request.
+    size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+    conns = [engine.connect() for _ in range(size)]
+    try:
+        for conn in conns:
+            conn.execute(text('SELECT 1'))
+    finally:
+        for conn in conns:
+            conn.close()
+
+def warm_up_conversion():
+    # A blank degree through every LibreOffice instance.
+    work_dir = tempfile.mkdtemp(prefix='warm_up_')
+    try:
+        docx_path = os.path.join(work_dir, 'warm_up.docx')
+        render_docx(convert_record_to_context({}), docx_path)
+        converter_pool.warm_up(docx_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def warm_up(convert=False):
+    # Does ahead of time what the first job would otherwise pay for. A step
+    # that fails is logged and the rest still run. Returns True if all did.
+    steps = [('fonts', lambda: register_fonts(app.config['FONT_DIR'], app.config['FONTCONFIG_DIR'])),
+             ('template', lambda: (get_compiled_template(app.config['TEMPLATE_PATH']),
+                                   file_sha256(app.config['TEMPLATE_PATH']))),
+             ('database', lambda: open_pool(db.engine)),
+             ('job_store', lambda: open_pool(job_store.engine))]
+    if convert:
+        steps.append(('conversion', warm_up_conversion))
+    warm_up_state.update(started=time.time(), finished=None, steps={}, errors={})
+    with app.app_context():
+        for name, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                app.logger.exception(f"Warm-up step {name} failed")
+                warm_up_state['errors'][name] = f"{type(e).__name__}: {e}"
+                continue
+            warm_up_state['steps'][name] = round(time.perf_counter() - start, 3)
+    warm_up_state['finished'] = time.time()
+    app.logger.info(f"Warm-up finished: {json.dumps(warm_up_state)}")
+    return not warm_up_state['errors']
+
+@app.route('/ready')
+def ready():
+    # For deploy health checks: 200 once this process has warmed up without
+    # errors and at least one live generation worker reports the same. The
+    # first probe starts the warm-up if WARM_UP_ON_START did not.
+    if warm_up_state['started'] is None:
+        warm_up_state['started'] = time.time()
+        socketio.start_background_task(warm_up)
+    workers = job_store.live_gauges(app.config['JOB_STALE_AFTER'])
+    ready_workers = sorted(w for w, values in workers.items() if values.get('ready'))
+    is_ready = bool(warm_up_state['finished'] and not warm_up_state['errors'] and ready_workers)
+    return jsonify(ready=is_ready, process=warm_up_state, workers=ready_workers), 200 if is_ready else 503
+
+# ------------------------------
+# Progress relay
+# ------------------------------
+
+def job_progress(job):
+    counts = job_store.item_counts(job['task_id'])
+    total = sum(counts.values())
+    finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+    # Share of the overall progress bar owned by each pipeline stage.
+    if job['output_format'] in ('pdf', 'merged'):
+        weights = {'render': 30, 'convert': 50, 'archive': 20}
+        stages = {'render': total - counts.get(PENDING, 0),
+                  'convert': finished + counts.get(CONVERTED, 0),
+                  'archive': finished}
+    else:
+        weights = {'render': 80, 'archive': 20}
+        stages = {'render': total - counts.get(PENDING, 0), 'archive': finished}
+    progress = sum(int(stages[s] / total * w) for s, w in weights.items()) if total else 0
+    return {'task_id': job['task_id'], 'progress': progress, 'stages': stages, 'total': total,
+            'outputs': counts.get(DONE, 0), 'failed': counts.get(FAILED, 0),
+            'cache': {'hits': job['cache_hits'], 'misses': job['cache_misses']}}
+
+def job_state(job):
+    # (progress payload, finished) for a job as it stands in the store.
+    update = job_progress(job)
+    finished = job['status'] not in ('queued', 'running')
+    if finished:
+        update['progress'] = 100
+    return update, finished
+
+_relay_started = False
+
+def ensure_progress_relay():
+    global _relay_started
+    if not _relay_started:
+        _relay_started = True
+        socketio.start_background_task(relay_progress)
+
+def relay_progress():
+    # Workers run in other processes, so the web process polls the job store
+    # and forwards progress to each task's room. Updates for a task are sent
+    # at most once per PROGRESS_UPDATE_INTERVAL and only when they changed;
+    # completion is always sent straight away.
+    # With a message queue any process can reach every browser, so a lease
+    # in the job store makes one process the relay and the rest stand by.
+    relay_id = f"{socket.gethostname()}:{os.getpid()}"
+    lease_ttl = max(5.0, app.config['JOB_POLL_INTERVAL'] * 10)
+    watching = {}
+    while True:
+        if app.config['SOCKETIO_MESSAGE_QUEUE'] and not job_store.acquire_lease('progress_relay', relay_id, lease_ttl):
+            watching.clear()
+            socketio.sleep(app.config['JOB_POLL_INTERVAL'])
+            continue
+        active = {job['task_id']: job for job in job_store.active_jobs()}
+        for task_id in active:
+            watching.setdefault(task_id, {'update': None, 'sent_at': 0, 'ready_sent': False})
+        now = time.monotonic()
+        for task_id, sent in list(watching.items()):
+            job = active.get(task_id)
+            if job is not None and now - sent['sent_at'] < app.config['PROGRESS_UPDATE_INTERVAL']:
+                continue  # Throttled, and still running: nothing to look up.
+            if job is None:
+                # No longer active: finished, or already removed.
+                job = job_store.get_job(task_id)
+                if job is None:
+                    del watching[task_id]
+                    continue
+            update, finished = job_state(job)
+            if update != sent['update']:
+                socketio.emit('progress_update', update, to=task_id)
+                sent.update(update=update, sent_at=now)
+            if update['outputs'] and not sent['ready_sent']:
+                socketio.emit('download_ready', {'task_id': task_id}, to=task_id)
+                sent['ready_sent'] = True
+            if finished:
+                socketio.emit('generation_complete', {'task_id': task_id, 'status': job['status'],
+                                                      'failed': update['failed']}, to=task_id)
+                del watching[task_id]
+        socketio.sleep(app.config['JOB_POLL_INTERVAL'])
+
+@socketio.on('connect')
+def on_connect():
+    ensure_progress_relay()
+
+@socketio.on('join_task')
+def on_join_task(data):
+    # The progress page joins its task's room on every (re)connect and is
+    # sent the current state at once rather than waiting for the relay.
+    if not current_user.is_authenticated:
+        return
+    task_id = str((data or {}).get('task_id', ''))
+    job = job_store.get_job(task_id)
+    if job is None:
+        return
+    join_room(task_id)
+    update, finished = job_state(job)
+    emit('progress_update', update)
+    if update['outputs']:
+        emit('download_ready', {'task_id': task_id})
+    if finished:
+        emit('generation_complete', {'task_id': task_id, 'status': job['status'], 'failed': update['failed']})
+
+# ------------------------------
+# Download
+# ------------------------------
+
+def iter_job_outputs(task_id):
+    # Follows the job's outputs until it finishes, so the archive can be
+    # streamed while the worker is still producing files.
+    last_id = 0
+    while True:
+        job = job_store.get_job(task_id)
+        running = job is not None and job['status'] in ('queued', 'running')
+        rows = job_store.outputs_after(task_id, last_id)
+        for row in rows:
+            last_id = row['id']
+            yield row['path']
+        if not running:
+            return
+        if not rows:
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
 
 @app.route('/download')
 @login_required
 def download():
-    zip_path = request.args.get('zip')
-    if not zip_path or not os.path.exists(zip_path):
-        flash('File not found', 'danger')
-        return redirect(url_for('dashboard'))
-    response = send_file(zip_path, as_attachment=True, download_name='degrees.zip')
-    
-    @response.call_on_close
-    def cleanup_tempfile():
+    task_id = request.args.get('task', '')
+    path = archive_store.get(task_id)
+    if path is None:
+        job = job_store.get_job(task_id)
+        if job is None:
+            flash('File not found', 'danger')
+            return redirect(url_for('dashboard'))
+        if job['status'] in ('queued', 'running'):
+            return stream_job_archive(task_id)
+        # Finished, but archiving failed at the time.
+        path = archive_job(task_id)
+        if path is None:
+            if job_store.outputs_after(task_id):
+                flash('The files for this task are no longer available', 'warning')
+            else:
+                flash('This task produced no files', 'warning')
+            return redirect(url_for('task_summary', task_id=task_id))
+    # Served from the store with Range and conditional request support, so
+    # an interrupted transfer resumes where it stopped.
+    return send_file(path, mimetype='application/zip', as_attachment=True, download_name='degrees.zip',
+                     conditional=True, max_age=0)
+
+def stream_job_archive(task_id):
+    # While the job runs, the archive is streamed as its outputs appear. It
+    # has no known length yet, so this transfer cannot be resumed; the
+    # stored archive replaces it once the job finishes.
+    def generate_archive():
+        # Each file is read and compressed on eventlet's pool of OS threads
+        # so the hub keeps serving requests.
+        archive = ZipStream()
+        work_dir = None
         try:
-            os.remove(zip_path)
-        except Exception as e:
-            app.logger.error(f"Error deleting temp file: {e}")
-    
-    return response
+            for path in iter_job_outputs(task_id):
+                if not os.path.exists(path):
+                    # The job finished meanwhile and its outputs were moved
+                    # into the stored archive.
+                    work_dir = work_dir or tempfile.mkdtemp(prefix='stream_')
+                    extracted = tpool.execute(archive_store.extract, task_id, work_dir, [os.path.basename(path)])
+                    if not extracted:
+                        app.logger.warning(f"File {path} not found. Skipping.")
+                        continue
+                    path = extracted[0]
+                yield tpool.execute(archive.add, path)
+                if work_dir and path.startswith(work_dir):
+                    os.remove(path)
+            yield tpool.execute(archive.close)
+        finally:
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    return Response(generate_archive(), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=degrees.zip', 'Accept-Ranges': 'none'})
+
+# ------------------------------
+# Preview
+# ------------------------------
+
+# Stands in for a thumbnail whose degree has not been converted yet; sent
+# uncached, so the dashboard picks up the real one once it exists.
+PREVIEW_PLACEHOLDER = ('<svg xmlns="http://www.w3.org/2000/svg" width="160" height="113" viewBox="0 0 160 113">'
+                       '<rect x="0.5" y="0.5" width="159" height="112" fill="#f8f9fa" stroke="#ced4da"/>'
+                       '<text x="80" y="61" font-family="sans-serif" font-size="12" fill="#868e96"'
+                       ' text-anchor="middle">No preview yet</text></svg>')
+
+def render_png(pdf_path, png_path, width):
+    # First page of the PDF, scaled to `width` pixels wide.
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        page = pdf[0]
+        page.render(scale=width / page.get_width()).to_pil().save(png_path)
+    finally:
+        pdf.close()
+
+def preview_keys(record):
+    # The record's preview PDF key, and the artifact cache keys its PDF may
+    # already be under: converted by LibreOffice, or stamped.
+    context = convert_record_to_context(record)
+    template_hash = file_sha256(app.config['TEMPLATE_PATH'])
+    pdf_key = ArtifactCache.key(context, template_hash, 'pdf')
+    return pdf_key, [pdf_key, ArtifactCache.key(context, template_hash, 'pdf-stamped')]
+
+def find_preview_pdf(key):
+    # Path of a PDF cached under key, in the preview or the artifact cache.
+    path = preview_cache.find(key, 'pdf')
+    if path is None and artifact_cache is not None:
+        path = artifact_cache.find(key, 'pdf')
+    return path
+
+def existing_preview_key(record):
+    # The key a PDF of the record is already cached under, or None. Only
+    # looks, so the dashboard can ask for each of its rows.
+    _, artifact_keys = preview_keys(record)
+    return next((key for key in artifact_keys if find_preview_pdf(key)), None)
+
+def preview_png(key, width):
+    # Path of the PNG of the PDF cached under key, rasterised on first use.
+    # None if there is no such PDF: thumbnails never render or convert
+    # anything in the web process.
+    png_key = ArtifactCache.key(key, None, f'png-{width}')
+    path = preview_cache.find(png_key, 'png')
+    if path:
+        return path
+    pdf_path = find_preview_pdf(key)
+    if pdf_path is None:
+        return None
+    work_dir = tempfile.mkdtemp(prefix='preview_')
+    try:
+        png_path = os.path.join(work_dir, 'preview.png')
+        tpool.execute(render_png, pdf_path, png_path, width)
+        preview_cache.put(png_key, 'png', png_path)
+        return preview_cache.find(png_key, 'png')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def preview_pdf(record):
+    # Path of the record's PDF in the preview cache, or None while it is
+    # being made. On a miss the record goes to the generation workers as a
+    # one-record job, like any batch; the first request after it finishes
+    # collects the PDF and removes the job. The task id comes from the cache
+    # key, so repeated requests for the same preview share the job.
+    pdf_key, artifact_keys = preview_keys(record)
+    path = preview_cache.find(pdf_key, 'pdf')
+    if path:
+        return path
+    task_id = pdf_key[:32]
+    output_dir = os.path.join(app.config['OUTPUT_DIR'], task_id)
+    job = job_store.get_job(task_id)
+    if job is not None:
+        if job['status'] in ('queued', 'running'):
+            return None
+        errors = [item['error'] for item in job_store.failed_items(task_id)]
+        work_dir = tempfile.mkdtemp(prefix='preview_')
+        try:
+            pdfs = [p for p in tpool.execute(archive_store.extract, task_id, work_dir) if p.endswith('.pdf')]
+            if pdfs:
+                preview_cache.put(pdf_key, 'pdf', pdfs[0])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            remove_job(task_id, output_dir)
+        # A request collecting the same job at the same time may have got it.
+        path = preview_cache.find(pdf_key, 'pdf')
+        if path:
+            return path
+    for key in artifact_keys:
+        path = artifact_cache.find(key, 'pdf') if artifact_cache is not None else None
+        if path:
+            preview_cache.put(pdf_key, 'pdf', path)
+            return preview_cache.find(pdf_key, 'pdf')
+    if job is not None:
+        raise RuntimeError(f"Preview job {task_id} {job['status']} without a PDF: {'; '.join(map(str, errors))}")
+    try:
+        job_store.enqueue(task_id, [record], 'pdf', output_dir)
+    except IntegrityError:
+        pass  # Enqueued meanwhile by another request.
+    return None
+
+def preview_width():
+    try:
+        return min(max(int(request.args.get('width', app.config['PREVIEW_WIDTH'])), 64), 2400)
+    except ValueError:
+        abort(400)
+
+def send_preview_png(path, download_name):
+    if path is None:
+        return Response(PREVIEW_PLACEHOLDER, mimetype='image/svg+xml', headers={'Cache-Control': 'no-store'})
+    # Cache files are named by content key; their mtime is the LRU clock, so
+    # it cannot serve as the validator.
+    return send_file(path, mimetype='image/png', download_name=download_name, conditional=True, max_age=0,
+                     etag=os.path.basename(path))
+
+@app.route('/preview/<entryno>')
+@login_required
+def preview(entryno):
+    # One degree of the selected cohort as an inline PNG (default) or PDF.
+    session_pk = session.get('session_pk')
+    programme_pk = session.get('programme_pk')
+    semester_pk = session.get('semester_pk')
+    output_format = request.args.get('format', 'png')
+    if not (session_pk and programme_pk and semester_pk) or output_format not in ('png', 'pdf'):
+        abort(400)
+    width = preview_width()
+    record = next(fetch_records(session_pk, programme_pk, semester_pk, [entryno]), None)
+    if record is None:
+        abort(404)
+    if output_format == 'png':
+        key = existing_preview_key(record)
+        return send_preview_png(key and preview_png(key, width), f"{entryno}.png")
+    try:
+        path = preview_pdf(record)
+    except Exception:
+        app.logger.exception(f"Preview of {entryno} failed")
+        abort(500)
+    if path is None:
+        return Response('The preview is being generated; this page reloads until it is ready.', status=202,
+                        mimetype='text/plain', headers={'Retry-After': '5', 'Refresh': '5'})
+    return send_file(path, mimetype='application/pdf', download_name=f"{entryno}.pdf", conditional=True,
+                     max_age=0, etag=os.path.basename(path))
+
+@app.route('/preview/thumbnail/<key>')
+@login_required
+def preview_thumbnail(key):
+    # A dashboard thumbnail, by the cache key the row's PDF was found under
+    # when the page was rendered, so serving it needs no database lookup.
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        abort(404)
+    return send_preview_png(preview_png(key, preview_width()), 'preview.png')
+
+# ------------------------------
+# Metrics
+# ------------------------------
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    totals = job_store.metric_totals(gauge_max_age=app.config['JOB_STALE_AFTER'])
+    return Response(render_prometheus(*totals), mimetype='text/plain; version=0.0.4')
+
+@app.route('/tasks/<task_id>/summary')
+@login_required
+def task_summary(task_id):
+    job = job_store.get_job(task_id)
+    if job is None:
+        abort(404)
+    summary = summarize_timings(job_store.task_timings(task_id))
+    failed = [dict(item) for item in job_store.failed_items(task_id)]
+    if request.args.get('format') == 'json':
+        return jsonify(job=job, progress=job_progress(job), failed=failed, **summary)
+    return render_template('task_summary.html', job=job, progress=job_progress(job), failed=failed, **summary)
+
+@app.route('/tasks/<task_id>/retry', methods=['POST'])
+@login_required
+def retry_failed(task_id):
+    # Runs the job again for its failed items only; the download then has
+    # the earlier outputs as well as the new ones.
+    job = job_store.get_job(task_id)
+    if job is None:
+        abort(404)
+    if job['status'] in ('queued', 'running'):
+        flash("This task is still running.", "warning")
+        return redirect(url_for('task_summary', task_id=task_id))
+    # The earlier outputs only remain in the archive; they go back into the
+    # output directory so the archive rebuilt afterwards still has them.
+    tpool.execute(archive_store.extract, task_id, job['output_dir'])
+    requeued = job_store.retry_failed(task_id)
+    if requeued is None:
+        flash("This task is still running.", "warning")
+        return redirect(url_for('task_summary', task_id=task_id))
+    archive_store.discard(task_id)
+    ensure_progress_relay()
+    return render_template('progress.html', task_id=task_id)
+
+# Web processes warm up in the background as the server loads the app.
+if app.config['WARM_UP_ON_START']:
+    socketio.start_background_task(warm_up)
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+    # For local development the worker runs inside the web process; deploy
+    # it separately with worker.py.
+    socketio.start_background_task(run_worker)
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,115 @@
+import os
+import re
+import time
+import uuid
+import zipfile
+from zipstream import ZipStream
+
+_TASK_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class ArchiveStore:
+    # Finished ZIP archives, one per task, kept so a batch can be downloaded
+    # again (or an interrupted download resumed) without regenerating it.
+    # An archive expires ttl seconds after it was built; past max_bytes the
+    # oldest go first.
+    def __init__(self, root, ttl, max_bytes):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, task_id):
+        # Task ids come from the query string; anything but a uuid4 hex
+        # would otherwise be a path into the filesystem.
+        if not _TASK_ID.fullmatch(task_id):
+            raise ValueError(f"Invalid task id: {task_id!r}")
+        return os.path.join(self.root, f'{task_id}.zip')
+
+    def get(self, task_id):
+        # Path of the task's archive, or None if it is missing or expired.
+        try:
+            path = self._path(task_id)
+            if os.stat(path).st_mtime + self.ttl < time.time():
+                return None
+        except (ValueError, FileNotFoundError):
+            return None
+        return path
+
+    def build(self, task_id, paths):
+        # Writes the archive of `paths` under a temporary name, so a reader
+        # never sees it half-written.
+        path = self._path(task_id)
+        tmp_path = os.path.join(self.root, f'.{uuid.uuid4().hex}.tmp')
+        archive = ZipStream()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for src in paths:
+                    for chunk in archive.add_chunks(src):
+                        f.write(chunk)
+                f.write(archive.close())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+
+    def extract(self, task_id, dest_dir, names=None):
+        # Writes the archive's files, or those of them named, back into
+        # dest_dir. Returns their paths; none if there is no archive.
+        path = self.get(task_id)
+        if path is None:
+            return []
+        os.makedirs(dest_dir, exist_ok=True)
+        with zipfile.ZipFile(path) as zf:
+            members = zf.namelist()
+            if names is not None:
+                available = set(members)
+                members = [name for name in names if name in available]
+            return [zf.extract(name, dest_dir) for name in members]
+
+    def discard(self, task_id):
+        try:
+            os.remove(self._path(task_id))
+        except (ValueError, FileNotFoundError):
+            pass
+
+    def prune(self):
+        # Removes expired archives, then the oldest until the store fits in
+        # max_bytes. Returns the task ids whose archives were removed.
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith('.'):
+                # Left behind by a build that was killed.
+                if st.st_mtime + self.ttl < now:
+                    self._remove(entry.path)
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+        entries.sort(key=lambda e: e[0])
+        size = sum(e[1] for e in entries)
+        removed = []
+        for mtime, entry_size, entry in entries:
+            if mtime + self.ttl >= now and size <= self.max_bytes:
+                break
+            if self._remove(entry.path):
+                removed.append(entry.name[:-len('.zip')])
+            size -= entry_size
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
@@ -0,0 +1,102 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import uuid
+
+_template_hashes = {}
+
+
+def file_sha256(path):
+    # Memoised on (path, mtime) so the template is hashed once per version.
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _template_hashes.get(key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(key, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    _template_hashes[key] = (mtime, h.hexdigest())
+    return h.hexdigest()
+
+
+class ArtifactCache:
+    # Content-addressed store of rendered DOCX and converted PDF files. The
+    # key covers the template context, the template file and the format, so
+    # a rerun only rebuilds degrees whose data or template changed. Files
+    # are evicted least-recently-used first once max_bytes is exceeded; a
+    # hit refreshes the file's mtime, which serves as the LRU clock. Files
+    # are copied in and out rather than hard-linked, so rewriting a job
+    # output in place can never reach the cached copy.
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(e.stat().st_size for e in self._entries())
+
+    @staticmethod
+    def key(context, template_hash, output_format):
+        payload = json.dumps([context, template_hash, output_format], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], f'{key}.{ext}')
+
+    def _entries(self):
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                yield from (e for e in os.scandir(sub.path) if e.is_file() and not e.name.startswith('.'))
+
+    def get(self, key, ext, dest_path):
+        path = self._path(key, ext)
+        try:
+            os.utime(path)
+            shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def find(self, key, ext):
+        # Path of a cached file for serving in place, or None. Refreshes
+        # the LRU clock like get().
+        path = self._path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, ext, src_path):
+        path = self._path(key, ext)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f'.{uuid.uuid4().hex}.tmp')
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Rescan rather than trust the running total: other worker
+        # processes share the directory.
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        size = sum(e.stat().st_size for e in entries)
+        # Trim to 90% so a full cache does not rescan on every insert.
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if size <= target:
+                break
+            entry_size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                size -= entry_size
+            except FileNotFoundError:
+                pass
+        self._size = size
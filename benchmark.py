@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+# Throughput benchmarks for the degree generation pipeline.
+#
+#   python benchmark.py pipeline --sizes 100,1000,10000 --converter stub --output bench.json
+#   python benchmark.py render-scaling --records 1000 --max-workers 8
+#   python benchmark.py memory --records 10000 --max-rss-mb 32
+#   python benchmark.py dashboard-latency --records 1000 --clients 4
+#   python benchmark.py stamp --records 1000 --diff-records 10 --max-diff 0.1
+#
+# Results are written as JSON so runs from different versions can be diffed.
+#
+# app.py monkey-patches on import, and most benchmarks import it. Patch here
+# first: concurrent.futures, rendering and query_plans imported before the
+# patch keep the unpatched selector, and the render pool's management thread
+# then blocks the hub forever.
+import eventlet
+eventlet.monkey_patch()
+import argparse
+import http.client
+import json
+import re
+import socket
+import threading
+import urllib.parse
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from rendering import RenderPool
+from query_plans import create_indexes
+
+load_dotenv()
+
+TEMPLATE_PATH = os.getenv('TEMPLATE', 'AIB Degree - Copy.docx')
+
+# Cohort every synthetic student belongs to.
+SESSION_PK, PROGRAMME_PK, SEMESTER_PK = 1, 1, 1
+
+
+def synthetic_records(n):
+    # Same shape as the rows returned by the convocation query.
+    return [{
+        'entryno': f"E{str(i).zfill(6)}",
+        'name': f"John{i}",
+        'name_hindi': f"जॉन{i}",
+        'degree_gpa': "8.50",
+        'degree_name': "B.Tech",
+        'spec_name': "Computer Science",
+        'degree_name_hindi': "बी.टेक",
+        'spec_name_hindi': "कंप्यूटर विज्ञान",
+        'given_year': "2020",
+        'given_month': "October",
+        'given_day': "15",
+        'convo_year': "2020",
+        'convo_day': "16",
+        'completion_year': "2020",
+        'convo_month_hindi': "अक्टूबर",
+    } for i in range(1, n + 1)]
+
+
+def build_cohort(db_uri, n, seed=0):
+    # helper.py's ERP tables holding one cohort of n students, every one of
+    # them on the convocation list.
+    import helper
+    engine = create_engine(db_uri)
+    helper.reset_database(engine)
+    helper.generate(engine, n, seed, programmes={PROGRAMME_PK: 1}, sessions={SESSION_PK: 1},
+                    semesters={SEMESTER_PK: 1}, ineligible=0, staff=0)
+    create_indexes(engine)
+    engine.dispose()
+
+
+class StubConverterPool:
+    # Stands in for LibreOffice on machines without it: "converts" by copying.
+    size = 4
+
+    def convert(self, docx_path, pdf_path):
+        shutil.copyfile(docx_path, pdf_path)
+        return pdf_path
+
+
+def timed(fn):
+    # fn returns the number of items it processed.
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    return {'seconds': round(elapsed, 4), 'items': count,
+            'per_second': round(count / elapsed, 1) if elapsed and count else None}
+
+
+def bench_pipeline(sizes, converter, seed):
+    workdir = tempfile.mkdtemp(prefix='degree_bench_')
+    db_uri = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # app reads its configuration at import time.
+    os.environ['DB_URI'] = db_uri
+    os.environ['JOB_DB_PATH'] = os.path.join(workdir, 'jobs.db')
+    os.environ['ARTIFACT_CACHE_DIR'] = ''
+    os.environ['DASHBOARD_CACHE_TTL'] = '0'
+    import app as webapp
+    from zipstream import stream_zip
+    if converter == 'stub':
+        webapp.converter_pool = StubConverterPool()
+
+    results = []
+    try:
+        for n in sizes:
+            build_cohort(db_uri, n, seed)
+            out_dir = os.path.join(workdir, f'out_{n}')
+            os.makedirs(out_dir)
+            cohort = (SESSION_PK, PROGRAMME_PK, SEMESTER_PK)
+            entrynos = [f"E{str(i).zfill(6)}" for i in range(1, n + 1)]
+            records, docx_paths, pdf_paths, zip_bytes = [], [], [], []
+
+            def dashboard_full_query():
+                sql, params = webapp.filtered_query({})
+                params.update({'session_pk': SESSION_PK, 'semester_pk': SEMESTER_PK,
+                               'programme_pk': PROGRAMME_PK})
+                return len(webapp.db.session.execute(sql, params).fetchall())
+
+            def generate_fetch():
+                records.extend(webapp.fetch_records(*cohort, entrynos))
+                return len(records)
+
+            def render_all():
+                for seq, docx_path, timings, error in webapp.render_records(list(enumerate(records)), out_dir):
+                    docx_paths.append(docx_path)
+                return len(docx_paths)
+
+            def convert_all():
+                with ThreadPoolExecutor(max_workers=webapp.converter_pool.size) as executor:
+                    pdf_paths.extend(pdf_path for pdf_path, _ in executor.map(webapp.convert_worker, docx_paths))
+                return len(pdf_paths)
+
+            def zip_all():
+                zip_bytes.append(sum(len(chunk) for chunk in
+                                     stream_zip(p for p in pdf_paths if os.path.exists(p))))
+                return len(pdf_paths)
+
+            stages = {}
+            with webapp.app.app_context():
+                webapp.ensure_snapshot_tables()
+                webapp.db.session.execute(webapp.Degree.__table__.delete())
+                webapp.db.session.commit()
+                # A full build, then a refresh with nothing changed.
+                stages['snapshot_build'] = timed(lambda: sum(webapp.refresh_degrees(*cohort).values()))
+                stages['snapshot_refresh_unchanged'] = timed(lambda: sum(webapp.refresh_degrees(*cohort).values()))
+                stages['dashboard_full_query'] = timed(dashboard_full_query)
+                stages['dashboard_first_page'] = timed(
+                    lambda: len(webapp.dashboard_page(*cohort, {}, webapp.degree_snapshot(*cohort).refreshed_at)['records']))
+                stages['generate_fetch'] = timed(generate_fetch)
+                stages['render_docx'] = timed(render_all)
+                stages['convert'] = timed(convert_all)
+                stages['zip'] = timed(zip_all)
+                stages['zip']['bytes'] = zip_bytes[0]
+            shutil.rmtree(out_dir, ignore_errors=True)
+            results.append({'cohort_size': n, 'stages': stages})
+            print(f"cohort={n}: " + ', '.join(f"{k}={v['seconds']}s" for k, v in stages.items()),
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def bench_render_scaling(n, max_workers, chunk_size):
+    items = list(enumerate(synthetic_records(n)))
+    results = []
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        pool = RenderPool(workers, TEMPLATE_PATH, chunk_size)
+        with tempfile.TemporaryDirectory() as out_dir:
+            # Warm up so process start and template compilation are not timed.
+            list(pool.render(items[:workers * chunk_size], out_dir))
+            start = time.perf_counter()
+            count = sum(1 for _ in pool.render(items, out_dir))
+            elapsed = time.perf_counter() - start
+        pool.shutdown()
+        baseline = baseline or elapsed
+        results.append({'workers': workers, 'docs': count, 'seconds': round(elapsed, 4),
+                        'docs_per_second': round(count / elapsed, 1), 'speedup': round(baseline / elapsed, 2)})
+        print(f"workers={workers:<3} docs={count:<6} {elapsed:8.2f}s "
+              f"{count / elapsed:8.1f} docs/s  speedup x{baseline / elapsed:.2f}", file=sys.stderr)
+    return results
+
+
+def _prepare_cohort(db_uri, n, seed):
+    # Runs in a child process so building the cohort and its snapshot does
+    # not count towards the parent's peak RSS.
+    build_cohort(db_uri, n, seed)
+    import app as webapp
+    with webapp.app.app_context():
+        webapp.ensure_snapshot_tables()
+        webapp.refresh_degrees(SESSION_PK, PROGRAMME_PK, SEMESTER_PK)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def bench_memory(n, seed, max_rss_mb):
+    # Peak RSS growth over a whole generation of n records: enqueue from
+    # /generate, render, convert (stubbed) and stream the ZIP. It should
+    # stay flat as n grows.
+    workdir = tempfile.mkdtemp(prefix='degree_memory_')
+    db_uri = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.update(DB_URI=db_uri, JOB_DB_PATH=os.path.join(workdir, 'jobs.db'),
+                      OUTPUT_DIR=os.path.join(workdir, 'output'), ARTIFACT_CACHE_DIR='')
+    try:
+        child = multiprocessing.get_context('spawn').Process(target=_prepare_cohort,
+                                                             args=(db_uri, n, seed))
+        child.start()
+        child.join()
+        if child.exitcode != 0:
+            raise SystemExit(f"building the cohort failed with exit code {child.exitcode}")
+
+        import app as webapp
+        webapp.converter_pool = StubConverterPool()
+        client = webapp.app.test_client()
+        client.post('/login', data={'username': webapp.User.username, 'password': webapp.User.password})
+        with client.session_transaction() as sess:
+            sess.update(session_pk=SESSION_PK, programme_pk=PROGRAMME_PK, semester_pk=SEMESTER_PK)
+        # Warm up imports, template compilation and connection pools.
+        webapp.render_records([(0, synthetic_records(1)[0])], workdir).__next__()
+        baseline = peak_rss_mb()
+
+        start = time.perf_counter()
+        client.post('/generate', data={'all_matching': '1', 'output_format': 'pdf'})
+        task_id = webapp.job_store.claim_next('memory-benchmark', 3600)
+        webapp.run_job(task_id)
+        zip_bytes = 0
+        response = client.get(f'/download?task={task_id}', buffered=False)
+        for chunk in response.response:
+            zip_bytes += len(chunk)
+        response.close()
+        elapsed = time.perf_counter() - start
+        peak = peak_rss_mb()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {'records': n, 'seconds': round(elapsed, 2), 'zip_bytes': zip_bytes,
+              'baseline_rss_mb': round(baseline, 1), 'peak_rss_mb': round(peak, 1),
+              'growth_mb': round(peak - baseline, 1), 'max_growth_mb': max_rss_mb}
+    print(f"records={n} peak RSS {peak:.1f} MB, {peak - baseline:.1f} MB over baseline", file=sys.stderr)
+    return result
+
+
+# Started in its own process for dashboard-latency: the web app with the
+# generation worker on the same hub, as `python app.py` runs it.
+LATENCY_SERVER = """
+import sys
+import app, benchmark
+if sys.argv[1] == 'stub':
+    app.converter_pool = benchmark.StubConverterPool()
+app.socketio.start_background_task(app.run_worker)
+app.socketio.run(app.app, host='127.0.0.1', port=int(sys.argv[2]), log_output=False)
+"""
+
+
+class DashboardClient:
+    # A logged-in browser session against the server under test.
+    def __init__(self, port):
+        self.port = port
+        self.cookie = ''
+
+    def request(self, method, path, form=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        headers = {'Cookie': self.cookie}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, data
+
+    def login(self):
+        self.request('POST', '/login', {'username': os.getenv('ADMIN_USER', 'admin'),
+                                        'password': os.getenv('ADMIN_PASS', 'admin123')})
+        self.request('POST', '/select_details', {'session_pk': SESSION_PK, 'programme_pk': PROGRAMME_PK,
+                                                 'semester_pk': SEMESTER_PK})
+
+
+def latency_stats(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    if not n:
+        return {'requests': 0}
+
+    def pct(p):
+        return round(samples[min(n - 1, int(p * n))] * 1000, 1)
+    return {'requests': n, 'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'p99_ms': pct(0.99),
+            'max_ms': round(samples[-1] * 1000, 1)}
+
+
+def measure_dashboard(port, clients, until):
+    # Each client requests /dashboard back to back until until() is true.
+    samples = []
+    lock = threading.Lock()
+
+    def run():
+        client = DashboardClient(port)
+        client.login()
+        while not until():
+            start = time.perf_counter()
+            status, _ = client.request('GET', '/dashboard')
+            elapsed = time.perf_counter() - start
+            if status == 200:
+                with lock:
+                    samples.append(elapsed)
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latency_stats(samples)
+
+
+def bench_dashboard_latency(n, clients, idle_seconds, converter, seed):
+    # /dashboard latency with the server idle, then while it generates n
+    # degrees. Blocking work on the eventlet hub shows up as a long tail.
+    workdir = tempfile.mkdtemp(prefix='degree_latency_')
+    db_uri = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env = dict(os.environ, DB_URI=db_uri, JOB_DB_PATH=os.path.join(workdir, 'jobs.db'),
+               OUTPUT_DIR=os.path.join(workdir, 'output'), ARTIFACT_CACHE_DIR='', DASHBOARD_CACHE_TTL='0')
+    os.environ.update(env)
+    server = None
+    try:
+        child = multiprocessing.get_context('spawn').Process(target=_prepare_cohort, args=(db_uri, n, seed))
+        child.start()
+        child.join()
+        if child.exitcode != 0:
+            raise SystemExit(f"building the cohort failed with exit code {child.exitcode}")
+
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        server = subprocess.Popen([sys.executable, '-c', LATENCY_SERVER, converter, str(port)], env=env,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        client = DashboardClient(port)
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                client.login()
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise SystemExit("the server did not start")
+                time.sleep(0.2)
+
+        idle_until = time.monotonic() + idle_seconds
+        idle = measure_dashboard(port, clients, lambda: time.monotonic() > idle_until)
+
+        _, page = client.request('POST', '/generate', {'all_matching': '1', 'output_format': 'pdf'})
+        task_id = re.search(rb'taskId = "(\w+)"', page).group(1).decode()
+        done = threading.Event()
+
+        def watch_job():
+            while not done.is_set():
+                _, body = client.request('GET', f'/tasks/{task_id}/summary?format=json')
+                if json.loads(body)['job']['status'] not in ('queued', 'running'):
+                    done.set()
+                done.wait(0.5)
+
+        watcher = threading.Thread(target=watch_job)
+        start = time.perf_counter()
+        watcher.start()
+        busy = measure_dashboard(port, clients, done.is_set)
+        job_seconds = time.perf_counter() - start
+        watcher.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"idle: {idle}\nduring a {n}-record job ({job_seconds:.1f}s): {busy}", file=sys.stderr)
+    return {'records': n, 'clients': clients, 'job_seconds': round(job_seconds, 2),
+            'idle': idle, 'during_job': busy}
+
+
+def libreoffice_version(soffice_cmd):
+    # The `--version` line of a real LibreOffice, or None.
+    try:
+        out = subprocess.run([soffice_cmd, '--version'], capture_output=True, text=True, timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.strip() if out.startswith('LibreOffice') else None
+
+
+def bench_stamp(n, diff_records, max_diff, dpi, diff_dir):
+    # Stamping throughput, and how far stamped pages stray from LibreOffice
+    # converting the same records. The outcome is recorded in
+    # STAMP_CACHE_DIR, where the app looks before checking on its own.
+    from converter import ConverterPool
+    from rendering import convert_record_to_context
+    from stamping import DEVANAGARI_FONT, StampingUnsupported, get_stamp_template, mark_verified, verify
+    soffice_cmd = os.getenv('LIBREOFFICE_PATH', 'libreoffice')
+    version = libreoffice_version(soffice_cmd)
+    if version is None:
+        sys.exit(f"{soffice_cmd} is not LibreOffice; stamped pages can only be verified against it")
+    devanagari_font = os.getenv('STAMP_DEVANAGARI_FONT') or DEVANAGARI_FONT
+    workdir = tempfile.mkdtemp(prefix='degree_bench_')
+    pool = ConverterPool(1, soffice_cmd, uno_python=os.getenv('UNO_PYTHON'))
+
+    def convert(docx_path):
+        return pool.convert(docx_path, docx_path[:-len('.docx')] + '.pdf')
+
+    try:
+        contexts = [convert_record_to_context(r) for r in synthetic_records(n)]
+        start = time.perf_counter()
+        template = get_stamp_template(TEMPLATE_PATH, os.path.join(workdir, 'stamp_cache'), convert, contexts[:1],
+                                      devanagari_font, require_verified=False)
+        build_seconds = time.perf_counter() - start
+        out_dir = os.path.join(workdir, 'stamped')
+        os.makedirs(out_dir)
+        stamped = []
+
+        def stamp_all():
+            for i, context in enumerate(contexts):
+                try:
+                    template.render_to(os.path.join(out_dir, f'{i}.pdf'), context)
+                except StampingUnsupported:
+                    continue
+                stamped.append(i)
+            return len(stamped)
+
+        to_disk = timed(stamp_all)
+        fallbacks = n - len(stamped)
+        if stamped:
+            to_disk['bytes_per_pdf'] = os.path.getsize(os.path.join(out_dir, f'{stamped[0]}.pdf'))
+        print(f"build={build_seconds:.2f}s to_disk={to_disk['per_second']}/s "
+              f"left to LibreOffice={fallbacks}", file=sys.stderr)
+
+        if diff_dir:
+            os.makedirs(diff_dir, exist_ok=True)
+        compared = verify(TEMPLATE_PATH, template, convert, [contexts[i] for i in stamped[:diff_records]], dpi,
+                          diff_dir)
+        diffs = [compared[i] for i in sorted(compared)]
+        for i in sorted(compared):
+            print(f"record {stamped[i]}: {compared[i]:.2%} of the inked area differs", file=sys.stderr)
+    finally:
+        pool.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {'records': n, 'libreoffice': version, 'build_seconds': round(build_seconds, 2),
+              'to_disk': to_disk, 'fallbacks': fallbacks,
+              'diff': {'dpi': dpi, 'max_diff': max_diff, 'per_record': diffs,
+                       'worst': max(diffs) if diffs else None}}
+    result['verified'] = bool(diffs) and max(diffs) <= max_diff
+    if diffs:
+        mark_verified(TEMPLATE_PATH, os.getenv('STAMP_CACHE_DIR', 'stamp_cache'), devanagari_font,
+                      {'max_diff': max_diff, 'per_record': diffs, 'worst': max(diffs),
+                       'verified': result['verified']})
+    return result
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'timestamp': datetime.now(timezone.utc).isoformat(), 'commit': commit,
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the degree generation pipeline.")
+    parser.add_argument('--output', help="Write JSON results here instead of stdout.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('pipeline', help="Time each generation stage on synthetic cohorts.")
+    p.add_argument('--sizes', default='100,1000,10000', help="Comma-separated cohort sizes.")
+    p.add_argument('--converter', choices=['stub', 'libreoffice'], default='stub')
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('render-scaling', help="DOCX rendering throughput across worker processes.")
+    p.add_argument('--records', type=int, default=1000)
+    p.add_argument('--max-workers', type=int, default=os.cpu_count())
+    p.add_argument('--chunk-size', type=int, default=25)
+
+    p = sub.add_parser('memory', help="Peak RSS of one generation job; fails above --max-rss-mb growth.")
+    p.add_argument('--records', type=int, default=10000)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--max-rss-mb', type=float, default=32)
+
+    p = sub.add_parser('dashboard-latency', help="/dashboard latency with and without a generation job running.")
+    p.add_argument('--records', type=int, default=1000)
+    p.add_argument('--clients', type=int, default=4)
+    p.add_argument('--idle-seconds', type=float, default=10)
+    p.add_argument('--converter', choices=['stub', 'libreoffice'], default='stub')
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('stamp', help="Stamping throughput; fails if pages differ from LibreOffice's by over --max-diff. "
+                                     "Either way the outcome is what PDF_ENGINE=stamp goes by for the template.")
+    p.add_argument('--records', type=int, default=1000)
+    p.add_argument('--diff-records', type=int, default=10, help="Records to compare against LibreOffice.")
+    p.add_argument('--max-diff', type=float, default=0.1, help="Largest share of the inked area allowed to differ.")
+    p.add_argument('--dpi', type=int, default=100)
+    p.add_argument('--diff-dir', help="Save difference images here.")
+
+    args = parser.parse_args()
+    report = {'benchmark': args.command, 'environment': environment_info()}
+    if args.command == 'pipeline':
+        report['converter'] = args.converter
+        report['results'] = bench_pipeline([int(s) for s in args.sizes.split(',')], args.converter, args.seed)
+    elif args.command == 'dashboard-latency':
+        report['results'] = bench_dashboard_latency(args.records, args.clients, args.idle_seconds,
+                                                    args.converter, args.seed)
+    elif args.command == 'memory':
+        report['results'] = bench_memory(args.records, args.seed, args.max_rss_mb)
+    elif args.command == 'stamp':
+        report['results'] = bench_stamp(args.records, args.diff_records, args.max_diff, args.dpi, args.diff_dir)
+    else:
+        report['results'] = bench_render_scaling(args.records, args.max_workers, args.chunk_size)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.command == 'memory' and report['results']['growth_mb'] > args.max_rss_mb:
+        sys.exit(f"Peak RSS grew {report['results']['growth_mb']} MB, over the {args.max_rss_mb} MB ceiling")
+    if args.command == 'stamp' and not report['results']['diff']['per_record']:
+        sys.exit("No record could be stamped, so nothing was compared")
+    if args.command == 'stamp' and not report['results']['verified']:
+        sys.exit(f"Stamped pages differ from LibreOffice's by up to {report['results']['diff']['worst']:.2%}, "
+                 f"over {args.max_diff:.2%}")
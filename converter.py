@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import atexit
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+# The UNO bindings ship with LibreOffice rather than on PyPI. Each pool slot
+# keeps a long-lived soffice listening on a socket. When the bindings are
+# importable here, conversions talk to it directly; otherwise (a virtualenv,
+# say) each slot also keeps a helper process, this file run under a Python
+# that has them (UNO_PYTHON, or found by find_uno_python), and sends it one
+# conversion per line.
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+log = logging.getLogger(__name__)
+
+
+class ConversionError(Exception):
+    # transient: worth retrying (timeout, crashed or unreachable soffice).
+    # Otherwise the document itself could not be converted and retrying the
+    # same file would fail the same way.
+    def __init__(self, message, transient=True):
+        super().__init__(message)
+        self.transient = transient
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _prop(name, value):
+    p = PropertyValue()
+    p.Name = name
+    p.Value = value
+    return p
+
+
+def find_uno_python(soffice_cmd):
+    # An interpreter that can import uno: LibreOffice's bundled one if it
+    # has one, else the system python3 with the distribution's python3-uno.
+    # None if neither can.
+    candidates = []
+    soffice = shutil.which(soffice_cmd)
+    if soffice:
+        candidates.append(os.path.join(os.path.dirname(os.path.realpath(soffice)), 'python'))
+    candidates += [shutil.which('python3'), '/usr/bin/python3']
+    for python in dict.fromkeys(c for c in candidates if c and os.access(c, os.X_OK)):
+        try:
+            subprocess.run([python, '-c', 'import uno'], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        except (OSError, subprocess.SubprocessError):
+            continue
+        return python
+    return None
+
+
+def _connect(port, timeout, exit_code=lambda: None):
+    # The Desktop of the soffice listening on port, polled with backoff
+    # until it accepts connections. exit_code() returning non-None means
+    # soffice has died, so there is no point waiting.
+    local_ctx = uno.getComponentContext()
+    resolver = local_ctx.ServiceManager.createInstanceWithContext(
+        'com.sun.star.bridge.UnoUrlResolver', local_ctx)
+    url = f'uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext'
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        code = exit_code()
+        if code is not None:
+            raise ConversionError(f"soffice exited with code {code} during startup")
+        try:
+            ctx = resolver.resolve(url)
+            return ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+        except NoConnectException:
+            if time.monotonic() > deadline:
+                raise ConversionError(f"soffice on port {port} did not accept connections in time")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+
+def _store_pdf(desktop, docx_path, pdf_path):
+    doc = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(os.path.abspath(docx_path)), '_blank', 0, (_prop('Hidden', True),))
+    if doc is None:
+        raise ConversionError(f"LibreOffice could not open {docx_path}", transient=False)
+    try:
+        doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                       (_prop('FilterName', 'writer_pdf_Export'),))
+    finally:
+        doc.close(True)
+
+
+def register_fonts(font_dir, config_dir):
+    # Adds font_dir to the fontconfig setup soffice sees, on top of the
+    # system's, and builds its font cache now rather than during the first
+    # conversion. soffice inherits FONTCONFIG_FILE from this process, so
+    # call this before the pool starts. Returns the config file's path.
+    cache_dir = os.path.join(config_dir, 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    conf = os.path.abspath(os.path.join(config_dir, 'fonts.conf'))
+    with open(conf, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0"?>\n<!DOCTYPE fontconfig SYSTEM "fonts.dtd">\n<fontconfig>\n'
+                f'  <cachedir>{escape(os.path.abspath(cache_dir))}</cachedir>\n'
+                '  <include ignore_missing="yes">/etc/fonts/fonts.conf</include>\n'
+                f'  <dir>{escape(os.path.abspath(font_dir))}</dir>\n'
+                '</fontconfig>\n')
+    os.environ['FONTCONFIG_FILE'] = conf
+    fc_cache = shutil.which('fc-cache')
+    if fc_cache is None:
+        log.warning("fc-cache not found; soffice will build the font cache on first use")
+    else:
+        subprocess.run([fc_cache, os.path.abspath(font_dir)], check=False,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300)
+    return conf
+
+
+# ------------------------------
+# A single headless LibreOffice instance
+# ------------------------------
+
+class SofficeInstance:
+    # uno_python is the helper's interpreter, used only when uno cannot be
+    # imported here.
+    def __init__(self, index, soffice_cmd, base_dir, startup_timeout=60, convert_timeout=300, uno_python=None):
+        self.index = index
+        self.soffice_cmd = soffice_cmd
+        self.profile_dir = os.path.join(base_dir, f'profile_{index}')
+        self.startup_timeout = startup_timeout
+        self.convert_timeout = convert_timeout
+        self.uno_python = uno_python
+        self.port = None
+        self.process = None
+        self.desktop = None
+        self.helper = None
+
+    @property
+    def profile_url(self):
+        return Path(self.profile_dir).resolve().as_uri()
+
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.port = _free_port()
+        self.process = subprocess.Popen([
+            self.soffice_cmd, '--headless', '--invisible', '--nologo', '--norestore',
+            '--nodefault', '--nolockcheck',
+            f'-env:UserInstallation={self.profile_url}',
+            f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext',
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if uno is not None:
+            with self._watchdog(self.startup_timeout):
+                self.desktop = _connect(self.port, self.startup_timeout, self.process.poll)
+        else:
+            self.helper = subprocess.Popen(
+                [self.uno_python, os.path.abspath(__file__), str(self.port), str(self.startup_timeout)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding='utf-8')
+            # The helper answers once it has connected.
+            self._exchange(None, self.startup_timeout)
+        log.info(f"soffice instance {self.index} listening on port {self.port}")
+
+    @contextmanager
+    def _watchdog(self, timeout):
+        # A hung soffice never answers. Past timeout its processes are
+        # killed, which fails the pending call, and the pool restarts the
+        # instance before handing it out again.
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self._kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        except Exception as e:
+            if expired.is_set():
+                raise ConversionError(f"soffice instance {self.index} did not answer within {timeout}s") from e
+            raise
+        finally:
+            timer.cancel()
+
+    def _kill(self):
+        for process in (self.process, self.helper):
+            if process is not None and process.poll() is None:
+                process.kill()
+
+    def _exchange(self, request, timeout):
+        # Sends the helper one request line (none: just read its greeting)
+        # and raises the error its reply carries, if any.
+        with self._watchdog(timeout):
+            if request is not None:
+                self.helper.stdin.write(json.dumps(request) + '\n')
+                self.helper.stdin.flush()
+            line = self.helper.stdout.readline()
+            if not line:
+                raise ConversionError(f"UNO helper of soffice instance {self.index} exited")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ConversionError(reply['error'], reply['transient'])
+
+    def is_alive(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        if self.helper is not None:
+            return self.helper.poll() is None
+        try:
+            self.desktop.getFrames()
+            return True
+        except Exception:
+            return False
+
+    def convert(self, docx_path, pdf_path, run_blocking=None):
+        if self.helper is not None:
+            self._exchange([docx_path, pdf_path], self.convert_timeout)
+            return
+        # The watchdog starts here, not in run_blocking's thread.
+        with self._watchdog(self.convert_timeout):
+            if run_blocking is not None:
+                run_blocking(_store_pdf, self.desktop, docx_path, pdf_path)
+            else:
+                _store_pdf(self.desktop, docx_path, pdf_path)
+
+    def stop(self):
+        if self.helper is not None:
+            try:
+                self.helper.stdin.close()
+            except OSError:
+                pass
+            if self.helper.poll() is None:
+                self.helper.kill()
+            self.helper.wait()
+            self.helper = None
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+# ------------------------------
+# Pool of instances; conversions go to whichever instance is idle
+# ------------------------------
+
+class ConverterPool:
+    # run_blocking(fn, *args) runs a UNO call that blocks until soffice
+    # answers, e.g. eventlet's tpool.execute to keep it off the hub. The
+    # helper process needs none: waiting on its pipe is cooperative. A
+    # conversion taking over convert_timeout seconds kills the instance.
+    def __init__(self, size, soffice_cmd='libreoffice', base_dir=None, run_blocking=None,
+                 uno_python=None, convert_timeout=300):
+        self.size = max(1, int(size))
+        self.soffice_cmd = soffice_cmd
+        self.run_blocking = run_blocking
+        self.uno_python = uno_python
+        self.convert_timeout = convert_timeout
+        self._owns_base_dir = base_dir is None
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix='soffice_pool_')
+        self._instances = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        atexit.register(self.shutdown)
+
+    def uno_route(self):
+        # How conversions reach soffice: 'in-process', or the interpreter
+        # the helper processes run under. Raises if there is neither, since
+        # then nothing can be converted.
+        if uno is not None:
+            return 'in-process'
+        if self.uno_python is None:
+            self.uno_python = find_uno_python(self.soffice_cmd)
+        if self.uno_python is None:
+            raise ConversionError("LibreOffice's UNO bindings cannot be imported here and no Python with them "
+                                  "was found; install python3-uno or set UNO_PYTHON", transient=False)
+        return self.uno_python
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            uno_python = None if uno is not None else self.uno_route()
+            for i in range(self.size):
+                inst = SofficeInstance(i, self.soffice_cmd, self.base_dir,
+                                       convert_timeout=self.convert_timeout, uno_python=uno_python)
+                try:
+                    inst.start()
+                except Exception as e:
+                    # Left in the pool; the health check restarts it on first use.
+                    log.error(f"Failed to start soffice instance {i}: {e}")
+                self._instances.append(inst)
+                self._idle.put(inst)
+            self._started = True
+
+    def convert(self, docx_path, pdf_path):
+        self._ensure_started()
+        inst = self._idle.get()
+        try:
+            if not inst.is_alive():
+                log.warning(f"soffice instance {inst.index} is unhealthy, restarting")
+                inst.restart()
+            inst.convert(docx_path, pdf_path, self.run_blocking)
+        except Exception as e:
+            # A failed conversion may have left the instance wedged (or the
+            # watchdog killed it); recycle it so the next conversion
+            # dispatched to this slot starts clean.
+            try:
+                inst.restart()
+            except Exception as restart_error:
+                log.error(f"Failed to restart soffice instance {inst.index}: {restart_error}")
+            raise ConversionError(f"instance {inst.index}: {e}", getattr(e, 'transient', True)) from e
+        finally:
+            self._idle.put(inst)
+        return pdf_path
+
+    def warm_up(self, docx_path):
+        # Starts every instance and converts docx_path once on each, so each
+        # has created its profile and loaded fonts and filters before real
+        # work arrives. Idle instances are handed out in turn, so `size`
+        # conversions reach all of them.
+        self._ensure_started()
+        out_dir = tempfile.mkdtemp(prefix='warm_up_', dir=self.base_dir)
+        try:
+            for i in range(self.size):
+                self.convert(docx_path, os.path.join(out_dir, f'warm_up_{i}.pdf'))
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    def shutdown(self):
+        with self._lock:
+            for inst in self._instances:
+                inst.stop()
+            self._instances = []
+            self._idle = queue.Queue()
+            self._started = False
+        if self._owns_base_dir:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+
+
+# ------------------------------
+# Helper process: `python converter.py PORT STARTUP_TIMEOUT`
+# ------------------------------
+
+def _reply(**reply):
+    sys.stdout.write(json.dumps(reply) + '\n')
+    sys.stdout.flush()
+
+
+def _serve(port, startup_timeout):
+    # Runs under a Python that has the UNO bindings. Connects to the soffice
+    # on port, says so, then converts one ["docx", "pdf"] line from stdin at
+    # a time and answers each with {} or {"error": ..., "transient": ...}.
+    try:
+        desktop = _connect(port, startup_timeout)
+    except Exception as e:
+        _reply(error=str(e), transient=True)
+        return
+    _reply()
+    for line in sys.stdin:
+        docx_path, pdf_path = json.loads(line)
+        try:
+            _store_pdf(desktop, docx_path, pdf_path)
+        except ConversionError as e:
+            _reply(error=str(e), transient=e.transient)
+        except Exception as e:
+            _reply(error=f"{type(e).__name__}: {e}", transient=True)
+        else:
+            _reply()
+
+
+if __name__ == '__main__':
+    _serve(int(sys.argv[1]), float(sys.argv[2]))
@@ -0,0 +1,135 @@
+import os
+import io
+import re
+import threading
+import zipfile
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+
+DOCUMENT_PART = 'word/document.xml'
+# Parts of the package that may carry template tags. Everything else is
+# copied verbatim from the pre-built package.
+TEMPLATED_PARTS = re.compile(r'^(word/(document|header\d*|footer\d*|footnotes)\.xml|docProps/core\.xml)$')
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CompiledDocxTemplate:
+    # Mirrors what DocxTemplate.render() does for a plain-placeholder template,
+    # but the zip is read and the Jinja source compiled once per file version.
+    def __init__(self, path):
+        self.path = path
+        self._tpl = DocxTemplate(path)
+        self._env = Environment()
+        self._templates = {}
+        static = []
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                data = zf.read(info.filename)
+                if TEMPLATED_PARTS.match(info.filename):
+                    src = self._tpl.patch_xml(data.decode('utf-8'))
+                    if '{{' in src or '{%' in src:
+                        src = re.sub(r'<w:p([ >])', r'\n<w:p\1', src)
+                        self._templates[info.filename] = self._env.from_string(src)
+                        continue
+                static.append((info, data))
+        base = io.BytesIO()
+        with zipfile.ZipFile(base, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for info, data in static:
+                zf.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+        self._base = base.getvalue()
+
+    def _render_part(self, template, context):
+        xml = template.render(context)
+        xml = re.sub(r'\n<w:p([ >])', r'<w:p\1', xml)
+        xml = (xml.replace('{_{', '{{').replace('}_}', '}}')
+                  .replace('{_%', '{%').replace('%_}', '%}'))
+        return self._tpl.resolve_listing(xml)
+
+    def render_to(self, fileobj, context):
+        # Start from a copy of the pre-built package and append the rendered parts.
+        fileobj.write(self._base)
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj, 'a', zipfile.ZIP_DEFLATED) as zf:
+            for name, template in self._templates.items():
+                zf.writestr(name, self._render_part(template, context).encode('utf-8'))
+
+    def render_merged_to(self, fileobj, contexts):
+        # One document with every context in turn, each starting on a new
+        # page. Headers, footers and properties are rendered for the first
+        # context that renders. The document body is written as it is
+        # rendered rather than built up in memory. Returns (index, error)
+        # for contexts that failed to render; they are left out.
+        failed = []
+        document = self._templates.get(DOCUMENT_PART)
+        if document is None:
+            raise ValueError(f"{self.path} has no placeholders in {DOCUMENT_PART}")
+        fileobj.write(self._base)
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj, 'a', zipfile.ZIP_DEFLATED) as zf:
+            first = None
+            with zf.open(DOCUMENT_PART, 'w', force_zip64=True) as out:
+                pending = None
+                for i, context in enumerate(contexts):
+                    try:
+                        head, body, sect_pr, foot = _split_body(self._render_part(document, context))
+                    except Exception as e:
+                        failed.append((i, f"{type(e).__name__}: {e}"))
+                        continue
+                    if pending is None:
+                        first = context
+                        out.write(head.encode('utf-8'))
+                    else:
+                        out.write(_with_section_break(pending, sect_pr).encode('utf-8'))
+                    pending = body
+                if pending is None:
+                    raise ValueError("none of the documents could be rendered")
+                out.write((pending + sect_pr + foot).encode('utf-8'))
+            for name, template in self._templates.items():
+                if name != DOCUMENT_PART:
+                    zf.writestr(name, self._render_part(template, first).encode('utf-8'))
+        return failed
+
+
+def _split_body(xml):
+    # (everything up to <w:body>, the body content, the body's closing
+    # sectPr, the rest). The body-level sectPr is always the body's last child.
+    start = xml.index('<w:body>') + len('<w:body>')
+    end = xml.rindex('</w:body>')
+    sect = xml.rindex('<w:sectPr', start, end)
+    return xml[:start], xml[start:sect], xml[sect:end], xml[end:]
+
+
+def _with_section_break(body, sect_pr):
+    # Ends a page's body with a section break carrying the template's page
+    # setup, so the next record starts on a fresh page laid out the same way.
+    # The break goes in the last paragraph's properties, as Word puts it,
+    # rather than in an extra paragraph that could spill onto a blank page.
+    last = max(body.rfind('<w:p>'), body.rfind('<w:p '), body.rfind('<w:p/>'))
+    if last < 0 or '<w:tbl' in body[last:]:
+        return body + f'<w:p><w:pPr>{sect_pr}</w:pPr></w:p>'
+    head, tail = body[:last], body[last:]
+    end = tail.index('>') + 1
+    if tail[end - 2] == '/':
+        tail = tail[:end - 2] + f'><w:pPr>{sect_pr}</w:pPr></w:p>' + tail[end:]
+    elif tail[end:].startswith('<w:pPr/>'):
+        tail = tail[:end] + f'<w:pPr>{sect_pr}</w:pPr>' + tail[end + len('<w:pPr/>'):]
+    elif tail[end:].startswith('<w:pPr>') or tail[end:].startswith('<w:pPr '):
+        tail = tail.replace('</w:pPr>', sect_pr + '</w:pPr>', 1)
+    else:
+        tail = tail[:end] + f'<w:pPr>{sect_pr}</w:pPr>' + tail[end:]
+    return head + tail
+
+
+def get_compiled_template(path):
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    compiled = CompiledDocxTemplate(key)
+    with _cache_lock:
+        _cache[key] = (mtime, compiled)
+    return compiled
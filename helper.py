@@ -1,8 +1,15 @@
 #!/usr/bin/env python
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
-from sqlalchemy.orm import sessionmaker, declarative_base
+# Synthetic ERP tables for development and load testing.
+#
+#   python helper.py --students 50000 --seed 1
+#   python helper.py --students 50000 --programmes 1:40,4:15,5:10 --sessions 17:1,18:2 --missing-dgpa 0.4
+#
+# The same arguments and seed always produce the same rows.
+from sqlalchemy import create_engine, insert, Column, Integer, String, ForeignKey
+from sqlalchemy.orm import declarative_base
 from dotenv import load_dotenv
-import os, random
+from query_plans import create_indexes
+import argparse, os, random, time
 
 # Load environment variables from .env if available.
 load_dotenv()
@@ -10,9 +17,6 @@ load_dotenv()
 # Use the DB_URI from the .env file or default to SQLite.
 DATABASE_URL = os.getenv("DB_URI", "sqlite:///dummy.db")
 
-# Create the database engine.
-engine = create_engine(DATABASE_URL, echo=True)
-
 # Declarative base (SQLAlchemy 2.0 style)
 Base = declarative_base()
 
@@ -92,123 +96,202 @@ class AcadSessionMaster(Base):
     # Optionally, you could add more columns like session_name, etc.
 
 # ---------------------------
-# Function to Reset Database and Insert Dummy Data
+# Distributions
+# ---------------------------
+
+# Programme pk -> (name, english, hindi, years of study). The pks match the
+# programme dropdown.
+PROGRAMMES = {
+    1: ("BACHELOR OF TECHNOLOGY", "Bachelor of Technology", "प्रौद्योगिकी स्नातक", 4),
+    3: ("MASTER OF SCIENCE", "Master of Science", "विज्ञान निष्णात", 2),
+    4: ("MASTER OF TECHNOLOGY (MTECH)", "Master of Technology", "प्रौद्योगिकी निष्णात", 2),
+    5: ("DOCTOR OF PHILOSOPHY (PHD)", "Doctor of Philosophy", "विद्या वाचस्पति", 5),
+    7: ("B.TECH-M.TECH (DUAL)", "Bachelor and Master of Technology", "प्रौद्योगिकी स्नातक एवं निष्णात", 5),
+    9: ("M.B.A.", "Master of Business Administration", "व्यवसाय प्रशासन निष्णात", 2),
+    10: ("MS-RESEARCH", "Master of Science (Research)", "विज्ञान निष्णात (शोध)", 3),
+    13: ("BACHELOR OF DESIGN", "Bachelor of Design", "अभिकल्प स्नातक", 4),
+}
+DEFAULT_PROGRAMMES = "1:40,3:8,4:15,5:12,7:6,9:8,10:5,13:6"
+# Sessions 17-19 are 2021-22 to 2023-24 in the session dropdown.
+DEFAULT_SESSIONS = "17:3,18:4,19:5"
+SESSION_YEARS = {1: 2018, 14: 2020, 16: 2021, 17: 2022, 18: 2023, 19: 2024, 20: 2025, 21: 2026}
+DEFAULT_SEMESTERS = "1:6,2:3,3:1"
+
+SPECIALIZATIONS = [
+    ("Computer Science and Engineering", "संगणक विज्ञान एवं अभियांत्रिकी"),
+    ("Electrical Engineering", "विद्युत अभियांत्रिकी"),
+    ("Mechanical Engineering", "यांत्रिक अभियांत्रिकी"),
+    ("Civil Engineering", "सिविल अभियांत्रिकी"),
+    ("Chemical Engineering", "रासायनिक अभियांत्रिकी"),
+    ("Mathematics and Computing", "गणित एवं अभिकलन"),
+    ("Engineering Physics", "अभियांत्रिकी भौतिकी"),
+    ("Textile Technology", "वस्त्र प्रौद्योगिकी"),
+]
+FIRST_NAMES = [
+    ("Aarav", "आरव"), ("Ananya", "अनन्या"), ("Rohan", "रोहन"), ("Priya", "प्रिया"), ("Vikram", "विक्रम"),
+    ("Sneha", "स्नेहा"), ("Arjun", "अर्जुन"), ("Kavya", "काव्या"), ("Rahul", "राहुल"), ("Meera", "मीरा"),
+    ("Siddharth", "सिद्धार्थ"), ("Ishita", "इशिता"), ("Aditya", "आदित्य"), ("Pooja", "पूजा"), ("Karan", "करण"),
+    ("Neha", "नेहा"),
+]
+LAST_NAMES = [
+    ("Sharma", "शर्मा"), ("Verma", "वर्मा"), ("Gupta", "गुप्ता"), ("Singh", "सिंह"), ("Iyer", "अय्यर"),
+    ("Reddy", "रेड्डी"), ("Agarwal", "अग्रवाल"), ("Chatterjee", "चटर्जी"), ("Nair", "नायर"), ("Mehta", "मेहता"),
+    ("Kulkarni", "कुलकर्णी"), ("Bose", "बोस"),
+]
+MONTHS = [("October", "अक्टूबर"), ("November", "नवंबर"), ("August", "अगस्त")]
+BRANCHES = range(101, 106)
+
+
+def parse_weights(spec):
+    # "pk:weight,pk:weight" -> {pk: weight}. A bare pk weighs 1.
+    weights = {}
+    for part in spec.split(','):
+        pk, _, weight = part.strip().partition(':')
+        weights[int(pk)] = float(weight or 1)
+    return weights
+
+
+# ---------------------------
+# Bulk generator
 # ---------------------------
-def reset_database():
+
+def reset_database(engine):
     # Drop all tables and recreate them to avoid duplicates.
-    print("Resetting the database (dropping and recreating tables)...")
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
-    print("Database reset complete.")
-
-def insert_dummy_data():
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    
-    # Number of dummy employee records to create:
-    n = 100
-
-    # Insert one AcadSessionMaster record (dummy session details).
-    session_master = AcadSessionMaster(
-        pk=1,
-        given_year="2020",
-        given_month="October",
-        given_day="15",
-        convo_year="2020",
-        convo_day="16",
-        completion_year="2020",
-        convo_month_hindi="अक्टूबर"
-    )
-    session.add(session_master)
-    
-    # Insert ProgrammeMaster records.
-    programme1 = ProgrammeMaster(pk=1, programme_name="Bachelor of Technology")
-    programme2 = ProgrammeMaster(pk=2, programme_name="Master of Science")
-    session.add_all([programme1, programme2])
-    session.commit()
-    
-    # For each employee, create unique records and associated related records.
-    for i in range(1, n + 1):
-        # Create an employee.
-        employee = EmployeeMaster(
-            pk=i,
-            pf_number=f"E{str(i).zfill(3)}",   # e.g., E001, E002, ...
-            first_name=f"John{i}",
-            name_hindi=f"जॉन{i}",
-            identifier_master_pk=2  # For query filtering.
-        )
-        session.add(employee)
-        session.flush()
-        
-        # Randomly assign a programme (1 or 2) and other attributes.
-        prog_pk = random.choice([1, 2])
-        branch = random.randint(101, 105)
-        batch = "2020" if prog_pk == 1 else "2021"
-        specialization = random.randint(200, 205)
-        
-        # Create StudentMasterProgrammeDetails record.
-        student = StudentMasterProgrammeDetails(
-            pk=i,  # Use same pk as employee.
-            employee_master_pk=employee.pk,
-            acad_programme_master_pk=prog_pk,
-            acad_branch_master_pk=branch,
-            batch=batch,
-            specialization_master_pk=specialization,
-            pg_status=1
-        )
-        session.add(student)
-        
-        # Create AcadDegreeNamePrint record.
-        degree_print = AcadDegreeNamePrint(
-            pk=i,
-            acad_branch_master_pk=branch,
-            programme_pk=prog_pk,
-            batch=batch,
-            specialization_pk=specialization,
-            english_prog_name="B.Tech" if prog_pk == 1 else "M.Sc",
-            engish_spec_name="Computer Science" if prog_pk == 1 else "Physics",
-            hindi_prog_name="बी.टेक" if prog_pk == 1 else "एम.एससी",
-            hindi_spec_name="कंप्यूटर विज्ञान" if prog_pk == 1 else "भौतिकी"
-        )
-        session.add(degree_print)
-        
-        # Create AcadCourseGradeCPI record with a random CPI.
-        cpi_val = f"{random.uniform(6.0, 10.0):.2f}"
-        course_grade = AcadCourseGradeCPI(
-            pk=i,
-            student_pk=employee.pk,
-            flag=1,
-            cpi=cpi_val
-        )
-        session.add(course_grade)
-        
-        # Create DGPA record with a random DGPA.
-        dgpa_val = f"{random.uniform(6.0, 10.0):.2f}"
-        dgpa_record = DGPA(
-            pk=i,
-            employee_master_pk=employee.pk,
-            flag=1,
-            dgpa=dgpa_val
-        )
-        session.add(dgpa_record)
-        
-        # Create AcadStudentWarningAP record.
-        warning = AcadStudentWarningAP(
-            pk=i,
-            employee_master_pk=employee.pk,
-            flag=1,
-            wap=6,
-            acad_session_master_pk=1,  # Linking to the dummy session record.
-            acad_semester_pk=random.choice([1, 2])
-        )
-        session.add(warning)
-    
-    session.commit()
-    print(f"Inserted dummy data for {n} employees and associated records.")
+
+
+def generate(engine, students=100, seed=0, programmes=None, sessions=None, semesters=None,
+             missing_dgpa=0.3, ineligible=0.05, staff=0.02, history=2, batch_size=5000):
+    # Fills the ERP tables with `students` students spread over the
+    # weighted programmes, sessions and semesters ({pk: weight}). Skew the
+    # convocation join has to cope with:
+    #   missing_dgpa  share of students without a DGPA row (CPI is used)
+    #   ineligible    share whose latest warning row is not wap 6
+    #   staff         share of employee_master rows that are not students
+    #   history       older flag-0 CPI and warning rows per student
+    # Rows go in with executemany, batch_size students at a time. Returns
+    # {table: rows inserted}.
+    rng = random.Random(seed)
+    programmes = programmes or parse_weights(DEFAULT_PROGRAMMES)
+    sessions = sessions or parse_weights(DEFAULT_SESSIONS)
+    semesters = semesters or parse_weights(DEFAULT_SEMESTERS)
+    programme_pks, programme_weights = list(programmes), list(programmes.values())
+    session_pks, session_weights = list(sessions), list(sessions.values())
+    semester_pks, semester_weights = list(semesters), list(semesters.values())
+    years = {pk: SESSION_YEARS.get(pk, 2000 + pk) for pk in session_pks}
+    counts = {}
+
+    def put(conn, model, rows):
+        if rows:
+            conn.execute(insert(model), rows)
+            counts[model.__tablename__] = counts.get(model.__tablename__, 0) + len(rows)
+
+    with engine.begin() as conn:
+        put(conn, AcadSessionMaster, [{
+            'pk': pk, 'given_year': str(years[pk]), 'given_month': MONTHS[pk % len(MONTHS)][0],
+            'given_day': str(10 + pk % 15), 'convo_year': str(years[pk]), 'convo_day': str(11 + pk % 15),
+            'completion_year': str(years[pk]), 'convo_month_hindi': MONTHS[pk % len(MONTHS)][1],
+        } for pk in session_pks])
+        put(conn, ProgrammeMaster, [{'pk': pk, 'programme_name': PROGRAMMES.get(pk, (f"PROGRAMME {pk}",))[0]}
+                                    for pk in programme_pks])
+
+        # One name-print row per (branch, programme, batch, specialization) a
+        # student can land on.
+        prints = []
+        for programme_pk in programme_pks:
+            _, english, hindi, duration = PROGRAMMES.get(programme_pk, (None, f"Programme {programme_pk}",
+                                                                        f"कार्यक्रम {programme_pk}", 4))
+            for batch in sorted({str(years[pk] - duration) for pk in session_pks}):
+                for branch in BRANCHES:
+                    for spec_pk, (spec, spec_hindi) in enumerate(SPECIALIZATIONS, start=200):
+                        prints.append({'pk': len(prints) + 1, 'acad_branch_master_pk': branch,
+                                       'programme_pk': programme_pk, 'batch': batch,
+                                       'specialization_pk': spec_pk, 'english_prog_name': english,
+                                       'engish_spec_name': spec, 'hindi_prog_name': hindi,
+                                       'hindi_spec_name': spec_hindi})
+        put(conn, AcadDegreeNamePrint, prints)
+
+        cpi_pk = dgpa_pk = warning_pk = 0
+        employee_pk = 0
+        for start in range(0, students, batch_size):
+            employees, details, cpis, dgpas, warnings = [], [], [], [], []
+            for i in range(start + 1, min(students, start + batch_size) + 1):
+                # Staff share employee_master with students but are never
+                # on a convocation list.
+                while rng.random() < staff:
+                    employee_pk += 1
+                    first, first_hindi = rng.choice(FIRST_NAMES)
+                    employees.append({'pk': employee_pk, 'pf_number': f"S{employee_pk:06d}",
+                                      'first_name': first, 'name_hindi': first_hindi, 'identifier_master_pk': 1})
+                employee_pk += 1
+                (first, first_hindi), (last, last_hindi) = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                employees.append({'pk': employee_pk, 'pf_number': f"E{i:06d}", 'first_name': f"{first} {last}",
+                                  'name_hindi': f"{first_hindi} {last_hindi}", 'identifier_master_pk': 2})
+                programme_pk = rng.choices(programme_pks, programme_weights)[0]
+                session_pk = rng.choices(session_pks, session_weights)[0]
+                duration = PROGRAMMES.get(programme_pk, (None, None, None, 4))[3]
+                pg_status = 1 if duration <= 4 else 2
+                details.append({'pk': i, 'employee_master_pk': employee_pk, 'acad_programme_master_pk': programme_pk,
+                                'acad_branch_master_pk': rng.choice(BRANCHES),
+                                'batch': str(years[session_pk] - duration),
+                                'specialization_master_pk': 200 + rng.randrange(len(SPECIALIZATIONS)),
+                                'pg_status': pg_status})
+                cpi = rng.uniform(5.0, 10.0)
+                for h in range(history, -1, -1):
+                    cpi_pk += 1
+                    cpis.append({'pk': cpi_pk, 'student_pk': employee_pk, 'flag': 0 if h else 1,
+                                 'cpi': f"{max(4.0, cpi - 0.2 * h):.2f}"})
+                if rng.random() >= missing_dgpa:
+                    dgpa_pk += 1
+                    dgpas.append({'pk': dgpa_pk, 'employee_master_pk': employee_pk, 'flag': pg_status,
+                                  'dgpa': f"{min(10.0, cpi + rng.uniform(-0.3, 0.3)):.2f}"})
+                semester_pk = rng.choices(semester_pks, semester_weights)[0]
+                wap = 3 if rng.random() < ineligible else 6
+                for h in range(history, -1, -1):
+                    warning_pk += 1
+                    warnings.append({'pk': warning_pk, 'employee_master_pk': employee_pk, 'flag': 0 if h else 1,
+                                     'wap': wap if not h else 1,
+                                     'acad_session_master_pk': session_pk if not h else session_pk - 1,
+                                     'acad_semester_pk': semester_pk})
+            put(conn, EmployeeMaster, employees)
+            put(conn, StudentMasterProgrammeDetails, details)
+            put(conn, AcadCourseGradeCPI, cpis)
+            put(conn, DGPA, dgpas)
+            put(conn, AcadStudentWarningAP, warnings)
+    return counts
+
 
 # ---------------------------
 # Main Execution
 # ---------------------------
 if __name__ == '__main__':
-    reset_database()
-    insert_dummy_data()
+    parser = argparse.ArgumentParser(description="Reset the ERP tables and fill them with synthetic students.")
+    parser.add_argument('--db-uri', default=DATABASE_URL)
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--programmes', default=DEFAULT_PROGRAMMES, help="pk:weight,... (default %(default)s)")
+    parser.add_argument('--sessions', default=DEFAULT_SESSIONS, help="pk:weight,... (default %(default)s)")
+    parser.add_argument('--semesters', default=DEFAULT_SEMESTERS, help="pk:weight,... (default %(default)s)")
+    parser.add_argument('--missing-dgpa', type=float, default=0.3, help="share of students without a DGPA row")
+    parser.add_argument('--ineligible', type=float, default=0.05, help="share not on the convocation list")
+    parser.add_argument('--staff', type=float, default=0.02, help="share of non-student employee rows")
+    parser.add_argument('--history', type=int, default=2, help="older CPI and warning rows per student")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--no-indexes', action='store_true', help="skip the indexes `flask create-indexes` adds")
+    parser.add_argument('--echo', action='store_true', help="log every SQL statement")
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_uri, echo=args.echo)
+    start = time.perf_counter()
+    print("Resetting the database (dropping and recreating tables)...")
+    reset_database(engine)
+    counts = generate(engine, args.students, args.seed, parse_weights(args.programmes),
+                      parse_weights(args.sessions), parse_weights(args.semesters),
+                      missing_dgpa=args.missing_dgpa, ineligible=args.ineligible, staff=args.staff,
+                      history=args.history, batch_size=args.batch_size)
+    if not args.no_indexes:
+        create_indexes(engine)
+    for table, n in counts.items():
+        print(f"{table}: {n} rows")
+    print(f"Generated {args.students} students in {time.perf_counter() - start:.1f}s.")
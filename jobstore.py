@@ -0,0 +1,415 @@
+import os
+import json
+import time
+from sqlalchemy import (MetaData, Table, Column, Index, Integer, String, Text, Double, PrimaryKeyConstraint,
+                        create_engine, event, inspect, select, insert, update, delete, func, or_, and_, text)
+from sqlalchemy.dialects import mysql, sqlite
+from metrics import bucket_label
+
+# Item lifecycle: pending -> rendered -> (converted ->) done, or failed.
+PENDING, RENDERED, CONVERTED, DONE, FAILED = 'pending', 'rendered', 'converted', 'done', 'failed'
+# Why a failed item failed: worth another try, or bound to fail again.
+TRANSIENT, PERMANENT = 'transient', 'permanent'
+
+metadata = MetaData()
+
+jobs = Table(
+    'jobs', metadata,
+    Column('task_id', String(64), primary_key=True),
+    Column('output_format', String(16), nullable=False),
+    Column('output_dir', String(1024), nullable=False),
+    Column('status', String(16), nullable=False, server_default='queued'),
+    Column('worker_id', String(255)),
+    Column('heartbeat', Double),
+    Column('created_at', Double, nullable=False),
+    Column('finished_at', Double),
+    Column('cache_hits', Integer, nullable=False, server_default='0'),
+    Column('cache_misses', Integer, nullable=False, server_default='0'),
+    Index('ix_jobs_status', 'status', 'created_at'),
+)
+
+job_items = Table(
+    'job_items', metadata,
+    Column('task_id', String(64), nullable=False),
+    Column('seq', Integer, nullable=False, autoincrement=False),
+    Column('entryno', String(50)),
+    Column('record', Text, nullable=False),
+    Column('status', String(16), nullable=False, server_default='pending'),
+    Column('docx_path', String(1024)),
+    Column('output_path', String(1024)),
+    Column('error', Text),
+    Column('error_kind', String(16)),
+    Column('attempts', Integer, nullable=False, server_default='0'),
+    PrimaryKeyConstraint('task_id', 'seq'),
+)
+
+job_outputs = Table(
+    'job_outputs', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('task_id', String(64), nullable=False),
+    Column('path', String(1024), nullable=False),
+    Index('ix_job_outputs_task', 'task_id', 'id'),
+    sqlite_autoincrement=True,
+)
+
+job_timings = Table(
+    'job_timings', metadata,
+    Column('task_id', String(64), nullable=False),
+    Column('seq', Integer),
+    Column('stage', String(32), nullable=False),
+    Column('seconds', Double, nullable=False),
+    Column('attempts', Integer, nullable=False, server_default='1'),
+    Index('ix_job_timings_task', 'task_id', 'stage'),
+)
+
+stage_histogram = Table(
+    'stage_histogram', metadata,
+    Column('stage', String(32), nullable=False),
+    Column('le', String(16), nullable=False),
+    Column('count', Integer, nullable=False, server_default='0'),
+    PrimaryKeyConstraint('stage', 'le'),
+)
+
+stage_totals = Table(
+    'stage_totals', metadata,
+    Column('stage', String(32), primary_key=True),
+    Column('count', Integer, nullable=False, server_default='0'),
+    Column('seconds', Double, nullable=False, server_default='0'),
+    Column('retries', Integer, nullable=False, server_default='0'),
+)
+
+counters = Table(
+    'counters', metadata,
+    Column('name', String(64), primary_key=True),
+    Column('value', Integer, nullable=False, server_default='0'),
+)
+
+worker_gauges = Table(
+    'worker_gauges', metadata,
+    Column('worker_id', String(255), nullable=False),
+    Column('name', String(64), nullable=False),
+    Column('value', Double, nullable=False),
+    Column('updated_at', Double, nullable=False),
+    PrimaryKeyConstraint('worker_id', 'name'),
+)
+
+# Named leases, e.g. which web process relays progress.
+leases = Table(
+    'leases', metadata,
+    Column('name', String(64), primary_key=True),
+    Column('holder', String(255), nullable=False),
+    Column('expires_at', Double, nullable=False),
+)
+
+# Columns added after the first release; added in place to existing stores.
+MIGRATIONS = {
+    'jobs': [
+        ('cache_hits', 'INTEGER NOT NULL DEFAULT 0'),
+        ('cache_misses', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+    'job_items': [
+        ('error_kind', 'VARCHAR(16)'),
+        ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+}
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+class JobStore:
+    # Durable job queue and task state shared by the web processes and the
+    # workers. `url` is an SQLAlchemy URL; a bare path means SQLite, which
+    # serves every process on one machine. Point every machine at one MySQL
+    # database to spread web processes and workers across hosts.
+    def __init__(self, url):
+        if '://' not in url:
+            url = f'sqlite:///{url}'
+        if url.startswith('sqlite'):
+            self.engine = create_engine(url, connect_args={'timeout': 30})
+            event.listen(self.engine, 'connect', _sqlite_pragmas)
+        else:
+            self.engine = create_engine(url, pool_pre_ping=True, pool_recycle=3600)
+        metadata.create_all(self.engine)
+        insp = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table, columns in MIGRATIONS.items():
+                existing = {c['name'] for c in insp.get_columns(table)}
+                for name, ddl in columns:
+                    if name not in existing:
+                        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+    def _upsert(self, table, keys, add=(), replace=()):
+        # INSERT, or when the key exists, add to or overwrite the given columns.
+        if self.engine.dialect.name == 'mysql':
+            stmt = mysql.insert(table)
+            new = stmt.inserted
+            return stmt.on_duplicate_key_update(
+                {**{c: table.c[c] + new[c] for c in add}, **{c: new[c] for c in replace}})
+        stmt = sqlite.insert(table)
+        new = stmt.excluded
+        return stmt.on_conflict_do_update(
+            index_elements=keys, set_={**{c: table.c[c] + new[c] for c in add}, **{c: new[c] for c in replace}})
+
+    def _insert_ignore(self, table):
+        if self.engine.dialect.name == 'mysql':
+            return mysql.insert(table).prefix_with('IGNORE')
+        return sqlite.insert(table).on_conflict_do_nothing()
+
+    # ------------------------------
+    # Web process side
+    # ------------------------------
+
+    def enqueue(self, task_id, records, output_format, output_dir, batch_size=500):
+        # records may be any iterable, e.g. rows streamed from a cursor; they
+        # are written batch_size at a time and never held all at once.
+        # Returns the number of items queued.
+        count = 0
+        with self.engine.begin() as conn:
+            conn.execute(insert(jobs).values(task_id=task_id, output_format=output_format, output_dir=output_dir,
+                                             created_at=time.time()))
+            batch = []
+            for seq, r in enumerate(records):
+                batch.append({'task_id': task_id, 'seq': seq, 'entryno': r.get('entryno'), 'record': json.dumps(r)})
+                if len(batch) == batch_size:
+                    conn.execute(insert(job_items), batch)
+                    batch = []
+                count = seq + 1
+            if batch:
+                conn.execute(insert(job_items), batch)
+        return count
+
+    def get_job(self, task_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(jobs).where(jobs.c.task_id == task_id)).mappings().first()
+        return dict(row) if row else None
+
+    def active_jobs(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(jobs).where(jobs.c.status.in_(('queued', 'running')))).mappings().all()
+        return [dict(r) for r in rows]
+
+    def finished_before(self, cutoff):
+        # Jobs that finished before `cutoff` (a time.time() value).
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(jobs.c.task_id, jobs.c.output_dir)
+                                .where(jobs.c.status.not_in(('queued', 'running')), jobs.c.finished_at < cutoff))
+            return [dict(r) for r in rows.mappings()]
+
+    def item_counts(self, task_id):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(job_items.c.status, func.count().label('n'))
+                                .where(job_items.c.task_id == task_id).group_by(job_items.c.status))
+            return {r.status: r.n for r in rows}
+
+    def outputs_after(self, task_id, last_id=0):
+        with self.engine.connect() as conn:
+            return conn.execute(select(job_outputs.c.id, job_outputs.c.path)
+                                .where(job_outputs.c.task_id == task_id, job_outputs.c.id > last_id)
+                                .order_by(job_outputs.c.id)).mappings().all()
+
+    def failed_items(self, task_id):
+        with self.engine.connect() as conn:
+            return conn.execute(select(job_items.c.seq, job_items.c.entryno, job_items.c.error,
+                                       job_items.c.error_kind, job_items.c.attempts)
+                                .where(job_items.c.task_id == task_id, job_items.c.status == FAILED)
+                                .order_by(job_items.c.seq)).mappings().all()
+
+    def retry_failed(self, task_id):
+        # Requeues a finished job with only its failed items reset. Finished
+        # outputs stay as they are, and an item whose DOCX was rendered before
+        # its conversion failed is only converted again. Returns the number
+        # of items requeued, or None if the job is still running.
+        with self.engine.begin() as conn:
+            requeued = conn.execute(update(jobs).where(jobs.c.task_id == task_id,
+                                                       jobs.c.status.not_in(('queued', 'running')))
+                                    .values(status='queued', worker_id=None, heartbeat=None, finished_at=None))
+            if requeued.rowcount != 1:
+                return None
+            failed = conn.execute(select(job_items.c.seq, job_items.c.docx_path)
+                                  .where(job_items.c.task_id == task_id, job_items.c.status == FAILED)).all()
+            for seq, docx_path in failed:
+                status = RENDERED if docx_path and os.path.exists(docx_path) else PENDING
+                conn.execute(update(job_items).where(job_items.c.task_id == task_id, job_items.c.seq == seq)
+                             .values(status=status, error=None, error_kind=None, attempts=0))
+        return len(failed)
+
+    def delete_job(self, task_id):
+        with self.engine.begin() as conn:
+            # Only the per-task rows go; the metric totals are kept.
+            for table in (job_timings, job_outputs, job_items, jobs):
+                conn.execute(delete(table).where(table.c.task_id == task_id))
+
+    def acquire_lease(self, name, holder, ttl):
+        # True if `holder` now holds the lease: it was free, had expired, or
+        # was already held by `holder`, which renews it.
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(self._insert_ignore(leases).values(name=name, holder='', expires_at=0))
+            result = conn.execute(update(leases)
+                                  .where(leases.c.name == name,
+                                         or_(leases.c.holder == holder, leases.c.expires_at < now))
+                                  .values(holder=holder, expires_at=now + ttl))
+        return result.rowcount == 1
+
+    # ------------------------------
+    # Worker side
+    # ------------------------------
+
+    def claim_next(self, worker_id, stale_after):
+        # Takes the oldest queued job, or a running job whose worker stopped
+        # heartbeating (crashed or was restarted). The update re-checks that
+        # the job is still claimable, so two workers never get the same job.
+        while True:
+            now = time.time()
+            claimable = or_(jobs.c.status == 'queued',
+                            and_(jobs.c.status == 'running', jobs.c.heartbeat < now - stale_after))
+            with self.engine.begin() as conn:
+                task_id = conn.execute(select(jobs.c.task_id).where(claimable)
+                                       .order_by(jobs.c.created_at).limit(1)).scalar()
+                if task_id is None:
+                    return None
+                result = conn.execute(update(jobs).where(jobs.c.task_id == task_id, claimable)
+                                      .values(status='running', worker_id=worker_id, heartbeat=now))
+            if result.rowcount == 1:
+                return task_id
+
+    def heartbeat(self, task_id):
+        with self.engine.begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.task_id == task_id).values(heartbeat=time.time()))
+
+    def unfinished_items(self, task_id, page_size=100):
+        # Yields the items still to do in seq order, reading page_size rows at
+        # a time so a large job is never loaded whole.
+        last_seq = -1
+        while True:
+            with self.engine.connect() as conn:
+                rows = conn.execute(select(job_items.c.seq, job_items.c.record, job_items.c.status,
+                                           job_items.c.docx_path, job_items.c.output_path)
+                                    .where(job_items.c.task_id == task_id, job_items.c.seq > last_seq,
+                                           job_items.c.status.not_in((DONE, FAILED)))
+                                    .order_by(job_items.c.seq).limit(page_size)).all()
+            for r in rows:
+                yield {'seq': r.seq, 'record': json.loads(r.record), 'status': r.status,
+                       'docx_path': r.docx_path, 'output_path': r.output_path}
+            if len(rows) < page_size:
+                return
+            last_seq = rows[-1].seq
+
+    def mark_item(self, task_id, seq, status, docx_path=None, output_path=None, error=None,
+                  error_kind=None, attempts=None):
+        values = {'status': status, 'error': error, 'error_kind': error_kind}
+        if attempts is not None:
+            values['attempts'] = attempts
+        if docx_path is not None:
+            values['docx_path'] = docx_path
+        if output_path is not None:
+            values['output_path'] = output_path
+        with self.engine.begin() as conn:
+            conn.execute(update(job_items).where(job_items.c.task_id == task_id, job_items.c.seq == seq)
+                         .values(values))
+            if status == DONE:
+                conn.execute(insert(job_outputs).values(task_id=task_id, path=output_path))
+            elif status == FAILED:
+                self._bump(conn, 'items_failed')
+
+    def mark_items(self, task_id, seqs, status, docx_path=None, output_path=None, error=None,
+                   error_kind=None, attempts=None):
+        # mark_item for items that share one file, as merged documents do;
+        # a finished file is published once rather than per item.
+        seqs = list(seqs)
+        if not seqs:
+            return
+        values = {'status': status, 'error': error, 'error_kind': error_kind}
+        if attempts is not None:
+            values['attempts'] = attempts
+        if docx_path is not None:
+            values['docx_path'] = docx_path
+        if output_path is not None:
+            values['output_path'] = output_path
+        with self.engine.begin() as conn:
+            conn.execute(update(job_items).where(job_items.c.task_id == task_id, job_items.c.seq.in_(seqs))
+                         .values(values))
+            if status == DONE:
+                conn.execute(insert(job_outputs).values(task_id=task_id, path=output_path))
+            elif status == FAILED:
+                self._bump(conn, 'items_failed', len(seqs))
+
+    def count_cache(self, task_id, hits=0, misses=0):
+        with self.engine.begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.task_id == task_id)
+                         .values(cache_hits=jobs.c.cache_hits + hits, cache_misses=jobs.c.cache_misses + misses))
+
+    def finish(self, task_id, status='done'):
+        with self.engine.begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.task_id == task_id)
+                         .values(status=status, finished_at=time.time()))
+            self._bump(conn, f'jobs_{status}')
+
+    def set_gauges(self, worker_id, values):
+        if not values:
+            return
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(self._upsert(worker_gauges, ['worker_id', 'name'], replace=('value', 'updated_at')),
+                         [{'worker_id': worker_id, 'name': name, 'value': value, 'updated_at': now}
+                          for name, value in values.items()])
+
+    # ------------------------------
+    # Timings and metrics
+    # ------------------------------
+
+    def record_timings(self, task_id, timings):
+        # timings are (seq, stage, seconds, attempts); seq is None for stages
+        # timed once per task. Each also feeds the running /metrics totals.
+        timings = list(timings)
+        if not timings:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(insert(job_timings), [
+                {'task_id': task_id, 'seq': seq, 'stage': stage, 'seconds': seconds, 'attempts': attempts}
+                for seq, stage, seconds, attempts in timings])
+            conn.execute(self._upsert(stage_histogram, ['stage', 'le'], add=('count',)), [
+                {'stage': stage, 'le': bucket_label(seconds), 'count': 1} for _, stage, seconds, _ in timings])
+            conn.execute(self._upsert(stage_totals, ['stage'], add=('count', 'seconds', 'retries')), [
+                {'stage': stage, 'count': 1, 'seconds': seconds, 'retries': attempts - 1}
+                for _, stage, seconds, attempts in timings])
+
+    def task_timings(self, task_id):
+        t, i = job_timings, job_items
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(t.c.seq, i.c.entryno, t.c.stage, t.c.seconds, t.c.attempts)
+                .select_from(t.outerjoin(i, and_(i.c.task_id == t.c.task_id, i.c.seq == t.c.seq)))
+                .where(t.c.task_id == task_id)).mappings().all()
+
+    def metric_totals(self, gauge_max_age):
+        with self.engine.connect() as conn:
+            histograms = {}
+            for r in conn.execute(select(stage_histogram)):
+                histograms.setdefault(r.stage, {})[r.le] = r.count
+            totals = {r['stage']: dict(r) for r in conn.execute(select(stage_totals)).mappings()}
+            counts = {r.name: r.value for r in conn.execute(select(counters))}
+            job_counts = {r.status: r.n for r in conn.execute(
+                select(jobs.c.status, func.count().label('n'))
+                .where(jobs.c.status.in_(('queued', 'running'))).group_by(jobs.c.status))}
+            gauges = self._live_gauges(conn, gauge_max_age)
+        return histograms, totals, counts, job_counts, gauges
+
+    def live_gauges(self, max_age):
+        # {worker_id: {name: value}} for workers heard from within max_age.
+        with self.engine.connect() as conn:
+            return self._live_gauges(conn, max_age)
+
+    def _live_gauges(self, conn, max_age):
+        gauges = {}
+        for r in conn.execute(select(worker_gauges).where(worker_gauges.c.updated_at >= time.time() - max_age)):
+            gauges.setdefault(r.worker_id, {})[r.name] = r.value
+        return gauges
+
+    def _bump(self, conn, name, n=1):
+        conn.execute(self._upsert(counters, ['name'], add=('value',)).values(name=name, value=n))
@@ -0,0 +1,111 @@
+import threading
+
+# Upper bounds, in seconds, of the stage duration histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Pipeline stages in the order they run. fetch, zip and job are timed once
+# per task, merge_* once per merged document, and the rest once per item.
+# stamp replaces render and convert when PDFs are stamped.
+STAGES = ('fetch', 'context', 'render', 'convert', 'stamp', 'merge_render', 'merge_convert', 'zip', 'job')
+
+
+def bucket_label(seconds):
+    for le in BUCKETS:
+        if seconds <= le:
+            return str(le)
+    return '+Inf'
+
+
+class Gauges:
+    # Point-in-time values for one process (queue depth, busy converters),
+    # published to the job store so /metrics can read them from elsewhere.
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + n
+
+    def dec(self, name, n=1):
+        self.inc(name, -n)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+# ------------------------------
+# Prometheus text exposition
+# ------------------------------
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}' if labels else ''
+
+
+def render_prometheus(histograms, totals, counters, job_counts, worker_gauges):
+    # histograms: {stage: {le: count}}, non-cumulative as stored.
+    # totals: {stage: {'count', 'seconds', 'retries'}}.
+    # worker_gauges: {worker_id: {name: value}} for live workers only.
+    lines = ['# HELP degree_stage_seconds Time spent in each generation stage.',
+             '# TYPE degree_stage_seconds histogram']
+    for stage in sorted(totals, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        cumulative = 0
+        for le in [str(b) for b in BUCKETS] + ['+Inf']:
+            cumulative += histograms.get(stage, {}).get(le, 0)
+            lines.append(f'degree_stage_seconds_bucket{_labels(stage=stage, le=le)} {cumulative}')
+        lines.append(f'degree_stage_seconds_sum{_labels(stage=stage)} {totals[stage]["seconds"]:.6f}')
+        lines.append(f'degree_stage_seconds_count{_labels(stage=stage)} {totals[stage]["count"]}')
+
+    lines += ['# HELP degree_stage_retries_total Attempts beyond the first, per stage.',
+              '# TYPE degree_stage_retries_total counter']
+    lines += [f'degree_stage_retries_total{_labels(stage=s)} {t["retries"]}' for s, t in sorted(totals.items())]
+
+    lines += ['# HELP degree_jobs_finished_total Generation jobs finished, by outcome.',
+              '# TYPE degree_jobs_finished_total counter']
+    for status in ('done', 'failed'):
+        lines.append(f'degree_jobs_finished_total{_labels(status=status)} {counters.get(f"jobs_{status}", 0)}')
+    lines += ['# HELP degree_items_failed_total Degrees that could not be produced.',
+              '# TYPE degree_items_failed_total counter',
+              f'degree_items_failed_total {counters.get("items_failed", 0)}']
+
+    lines += ['# HELP degree_jobs Generation jobs waiting or in progress.',
+              '# TYPE degree_jobs gauge']
+    for status in ('queued', 'running'):
+        lines.append(f'degree_jobs{_labels(status=status)} {job_counts.get(status, 0)}')
+
+    lines += ['# HELP degree_workers Generation worker processes with a recent heartbeat.',
+              '# TYPE degree_workers gauge',
+              f'degree_workers {len(worker_gauges)}']
+    for name, help_text in (('jobs_active', 'Jobs being run by the worker.'),
+                            ('convert_queue_depth', 'Rendered DOCX files waiting for conversion.'),
+                            ('converters_busy', 'Conversions in progress.'),
+                            ('ready', 'Whether the worker has finished warming up.')):
+        lines += [f'# HELP degree_worker_{name} {help_text}', f'# TYPE degree_worker_{name} gauge']
+        for worker_id, values in sorted(worker_gauges.items()):
+            lines.append(f'degree_worker_{name}{_labels(worker=worker_id)} {values.get(name, 0):g}')
+    return '\n'.join(lines) + '\n'
+
+
+# ------------------------------
+# Per-task summary
+# ------------------------------
+
+def summarize_timings(rows, slowest=10):
+    # rows: (seq, entryno, stage, seconds, attempts) for one task.
+    by_stage = {}
+    for row in rows:
+        by_stage.setdefault(row['stage'], []).append(row)
+    stages = []
+    for stage in sorted(by_stage, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        durations = sorted(r['seconds'] for r in by_stage[stage])
+        n = len(durations)
+        stages.append({'stage': stage, 'count': n, 'seconds': round(sum(durations), 4),
+                       'mean': round(sum(durations) / n, 4),
+                       'p95': round(durations[min(n - 1, int(n * 0.95))], 4),
+                       'max': round(durations[-1], 4),
+                       'retries': sum(r['attempts'] - 1 for r in by_stage[stage])})
+    items = sorted((r for r in rows if r['seq'] is not None), key=lambda r: r['seconds'], reverse=True)
+    return {'stages': stages,
+            'slowest': [{'entryno': r['entryno'], 'stage': r['stage'], 'seconds': round(r['seconds'], 4),
+                         'attempts': r['attempts']} for r in items[:slowest]]}
@@ -1,48 +1,27 @@
-from app import app, db, Degree  # Import your app, db, and model from your main application
-from faker import Faker
-import random
+#!/usr/bin/env python
+# Builds the degrees snapshot for every cohort in the ERP tables, e.g. after
+# `python helper.py --students 50000`. Each cohort goes through
+# refresh_degrees(), the same bulk path as `flask refresh-degrees`.
+import time
+from app import app, db, text, refresh_degrees
 
-fake = Faker()
+COHORTS_SQL = """
+    SELECT DISTINCT acad_student_warning_ap.acad_session_master_pk AS session_pk,
+        student_master_programme_details.acad_programme_master_pk AS programme_pk,
+        acad_student_warning_ap.acad_semester_pk AS semester_pk
+    FROM acad_student_warning_ap
+        INNER JOIN student_master_programme_details
+            ON student_master_programme_details.employee_master_pk = acad_student_warning_ap.employee_master_pk
+    WHERE acad_student_warning_ap.wap IN (6) AND acad_student_warning_ap.flag = 1
+    ORDER BY session_pk, programme_pk, semester_pk
+"""
 
 with app.app_context():
-    # Optional: Uncomment the following lines if you want to drop existing tables and start fresh.
-    # db.drop_all()
-    # db.create_all()
-
-    for _ in range(700):
-        entryno = fake.unique.bothify(text='??####')
-        name = fake.name()
-        name_hindi = fake.name()  # Placeholder; you might want to provide actual Hindi names
-        spec_name = fake.word()
-        spec_name_hindi = fake.word()
-        degree_name = fake.word()
-        degree_name_hindi = fake.word()
-        completion_year = str(fake.year())
-        convo_day = str(random.randint(1, 28))  # Keeping it within a safe range for days
-        convo_month_hindi = fake.month_name()
-        convo_year = str(fake.year())
-        degree_gpa = str(round(random.uniform(6.0, 10.0), 2))
-        given_day = str(random.randint(1, 28))
-        given_month = fake.month_name()
-        given_year = str(fake.year())
-
-        degree = Degree(
-            entryno=entryno,
-            name=name,
-            name_hindi=name_hindi,
-            spec_name=spec_name,
-            spec_name_hindi=spec_name_hindi,
-            degree_name=degree_name,
-            degree_name_hindi=degree_name_hindi,
-            completion_year=completion_year,
-            convo_day=convo_day,
-            convo_month_hindi=convo_month_hindi,
-            convo_year=convo_year,
-            degree_gpa=degree_gpa,
-            given_day=given_day,
-            given_month=given_month,
-            given_year=given_year
-        )
-        db.session.add(degree)
-    db.session.commit()
-    print("Database populated with 100 dummy entries.")
+    start = time.perf_counter()
+    total = 0
+    for cohort in db.session.execute(text(COHORTS_SQL)).all():
+        counts = refresh_degrees(*cohort)
+        total += counts['inserted'] + counts['updated'] + counts['unchanged']
+        print(f"session {cohort.session_pk}, programme {cohort.programme_pk}, semester {cohort.semester_pk}: "
+              + ', '.join(f"{k}={v}" for k, v in counts.items()))
+    print(f"Snapshot holds {total} degrees ({time.perf_counter() - start:.1f}s).")
@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    # In-process TTL cache for query results, grouped so every entry for one
+    # (session, programme, semester) cohort can be dropped at once.
+    def __init__(self, ttl, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group, key):
+        with self._lock:
+            entry = self._entries.get((group, key))
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[(group, key)]
+                return None
+            self._entries.move_to_end((group, key))
+            return value
+
+    def set(self, group, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(group, key)] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((group, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, group=None):
+        with self._lock:
+            if group is None:
+                self._entries.clear()
+                return
+            for k in [k for k in self._entries if k[0] == group]:
+                del self._entries[k]
@@ -0,0 +1,59 @@
+from sqlalchemy import bindparam, inspect, text
+
+# Composite indexes the convocation join needs on the ERP tables:
+# (name, table, columns). Each leads with the columns the join filters or
+# joins on, most selective first.
+ERP_INDEXES = [
+    ('ix_warning_ap_session_semester', 'acad_student_warning_ap',
+     ('acad_session_master_pk', 'acad_semester_pk', 'wap', 'flag', 'employee_master_pk')),
+    ('ix_smpd_employee_programme', 'student_master_programme_details',
+     ('employee_master_pk', 'acad_programme_master_pk')),
+    ('ix_degree_name_print_key', 'acad_degree_name_print',
+     ('acad_branch_master_pk', 'programme_pk', 'batch', 'specialization_pk')),
+    ('ix_course_grade_cpi_student_flag', 'acad_course_grade_cpi', ('student_pk', 'flag')),
+    ('ix_dgpa_employee_flag', 'dgpa', ('employee_master_pk', 'flag')),
+    ('ix_employee_master_pf_number', 'employee_master', ('pf_number',)),
+]
+
+
+def create_indexes(engine):
+    # Idempotent: indexes that already exist (by name) are left alone.
+    # Returns the names of the indexes created.
+    insp = inspect(engine)
+    created = []
+    with engine.begin() as conn:
+        for name, table, columns in ERP_INDEXES:
+            if name in {ix['name'] for ix in insp.get_indexes(table)}:
+                continue
+            conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+            created.append(name)
+    return created
+
+
+def explain(conn, stmt, params):
+    # Returns the plan as (table, access, detail) rows for SQLite or MySQL.
+    # stmt is a text() query; list values are bound as expanding IN lists.
+    def run(prefix):
+        query = text(prefix + stmt.text)
+        lists = [bindparam(k, expanding=True) for k, v in params.items() if isinstance(v, (list, tuple))]
+        return conn.execute(query.bindparams(*lists) if lists else query, params)
+
+    if conn.dialect.name == 'sqlite':
+        return [(None, None, row.detail) for row in run('EXPLAIN QUERY PLAN ')]
+    if conn.dialect.name == 'mysql':
+        return [(row.table, row.type, f"{row.table}: type={row.type} key={row.key} rows={row.rows}")
+                for row in run('EXPLAIN ')]
+    raise ValueError(f"EXPLAIN is not supported for {conn.dialect.name}")
+
+
+def full_scans(plan):
+    # Plan rows that read a whole table rather than seeking an index.
+    scans = []
+    for table, access, detail in plan:
+        if table is not None:
+            # MySQL; <derivedN>/<subqueryN> are temporary results, not tables.
+            if access == 'ALL' and not table.startswith('<'):
+                scans.append(detail)
+        elif detail.startswith('SCAN ') and ' USING ' not in detail and 'CONSTANT ROW' not in detail:
+            scans.append(detail)
+    return scans
@@ -0,0 +1,157 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from docx_cache import get_compiled_template
+
+# Kept free of Flask/eventlet imports so render worker processes can load it
+# without pulling in the web app. Spawned children also re-run the parent's
+# main script, so that must not import app at module level either (see
+# worker.py).
+
+def convert_record_to_context(record: dict) -> dict:
+    mapping = {
+        'entryno': 'entryNumber',
+        'name': 'name',
+        'name_hindi': 'name_hindi',
+        'spec_name': 'spec_name',
+        'spec_name_hindi': 'spec_name_hindi',
+        'degree_name': 'degree_name',
+        'degree_name_hindi': 'degree_name_hindi',
+        'completion_year': 'completionYear',
+        'convo_day': 'convo_day',
+        'convo_month_hindi': 'convo_month_hindi',
+        'convo_year': 'convo_year',
+        'degree_gpa': 'degreeGPA',
+        'given_day': 'givenDay',
+        'given_month': 'givenMonth',
+        'given_year': 'givenYear'
+    }
+    return {new_key: record.get(old_key, '') for old_key, new_key in mapping.items()}
+
+def docx_filename(record: dict, index: int) -> str:
+    return f"{record.get('entryno', f'doc_{index}')}.docx"
+
+def merged_filename(chunk) -> str:
+    # Named after the entry numbers of the chunk's first and last records.
+    def entryno(index, record):
+        return record.get('entryno', f'doc_{index}') if isinstance(record, dict) else f'doc_{index}'
+    return f"degrees_{entryno(*chunk[0])}-{entryno(*chunk[-1])}.docx"
+
+def render_merged(template_path, chunk, docx_path):
+    # Renders the (index, record) pairs of chunk into one document, a page
+    # per record, in chunk order. Returns (indexes rendered, [(index, error)]).
+    contexts, failed = [], []
+    for index, record in chunk:
+        try:
+            contexts.append((index, convert_record_to_context(record)))
+        except Exception as e:
+            failed.append((index, f"{type(e).__name__}: {e}"))
+    if not contexts:
+        return [], failed
+    tpl = get_compiled_template(template_path)
+    with open(docx_path, 'w+b') as f:
+        errors = tpl.render_merged_to(f, [context for _, context in contexts])
+    bad = {i for i, _ in errors}
+    failed += [(contexts[i][0], error) for i, error in errors]
+    return [index for i, (index, _) in enumerate(contexts) if i not in bad], failed
+
+# ------------------------------
+# Process-pool rendering
+# ------------------------------
+
+_worker_template_path = None
+
+def _init_worker(template_path, niceness):
+    global _worker_template_path
+    _worker_template_path = template_path
+    # Lower priority, so on a small machine the web process still gets the
+    # CPU when it needs it.
+    if niceness:
+        os.nice(niceness)
+    # Parse and compile the template once, up front, in every worker.
+    get_compiled_template(template_path)
+
+def _render_chunk(chunk, out_dir):
+    tpl = get_compiled_template(_worker_template_path)
+    rendered = []
+    for index, record in chunk:
+        # One bad record fails on its own rather than taking the chunk down.
+        try:
+            start = time.perf_counter()
+            context = convert_record_to_context(record)
+            built = time.perf_counter()
+            docx_path = os.path.join(out_dir, docx_filename(record, index))
+            with open(docx_path, 'w+b') as f:
+                tpl.render_to(f, context)
+        except Exception as e:
+            rendered.append((index, None, {}, f"{type(e).__name__}: {e}"))
+            continue
+        timings = {'context': built - start, 'render': time.perf_counter() - built}
+        rendered.append((index, docx_path, timings, None))
+    return rendered
+
+class RenderPool:
+    def __init__(self, workers, template_path, chunk_size=25, niceness=0):
+        self.workers = max(1, int(workers))
+        self.template_path = template_path
+        self.chunk_size = max(1, int(chunk_size))
+        self.niceness = niceness
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn rather than fork: the parent runs an eventlet hub.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(os.path.abspath(self.template_path), self.niceness))
+        return self._executor
+
+    def render(self, items, out_dir):
+        # items are (index, record) pairs. Yields (index, docx_path, timings,
+        # error) in completion order, timings holding seconds per step; a
+        # record that failed to render has no docx_path and an error message. At most two
+        # chunks per worker are in flight, so the caller's consumers apply
+        # backpressure.
+        executor = self._get_executor()
+        chunks = self._chunks(items)
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(_render_chunk, chunk, out_dir))
+            if len(pending) >= self.workers * 2:
+                break
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for chunk in chunks:
+                    pending.add(executor.submit(_render_chunk, chunk, out_dir))
+                    break
+                yield from future.result()
+
+    def render_merged(self, chunk, docx_path):
+        # render_merged() in a worker process.
+        future = self._get_executor().submit(render_merged, os.path.abspath(self.template_path), chunk, docx_path)
+        return future.result()
+
+    def _chunks(self, items):
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+import time
+from socketio import PubSubManager
+
+
+class SQLiteManager(PubSubManager):
+    # Socket.IO message queue backed by a SQLite table, for running several
+    # web processes on one machine without Redis. Each process appends the
+    # messages it publishes and polls for everyone else's.
+    name = 'sqlite'
+
+    def __init__(self, url='sqlite:///socketio.db', channel='socketio', write_only=False, logger=None,
+                 json=None, poll_interval=0.05, retention=60):
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self._conn().execute('CREATE TABLE IF NOT EXISTS socketio_messages ('
+                             'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+                             'payload TEXT NOT NULL, created_at REAL NOT NULL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _publish(self, data):
+        self._conn().execute('INSERT INTO socketio_messages (channel, payload, created_at) VALUES (?, ?, ?)',
+                             (self.channel, self.json.dumps(data), time.time()))
+
+    def _listen(self):
+        conn = self._conn()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_messages').fetchone()[0]
+        pruned = time.monotonic()
+        while True:
+            rows = conn.execute('SELECT id, payload FROM socketio_messages WHERE channel = ? AND id > ? ORDER BY id',
+                                (self.channel, last_id)).fetchall()
+            for last_id, payload in rows:
+                yield payload
+            if time.monotonic() - pruned > self.retention:
+                conn.execute('DELETE FROM socketio_messages WHERE created_at < ?', (time.time() - self.retention,))
+                pruned = time.monotonic()
+            time.sleep(self.poll_interval)
@@ -0,0 +1,836 @@
+import os
+import io
+import re
+import json
+import shutil
+import tempfile
+import threading
+import uuid
+import zipfile
+import zlib
+from html import unescape
+import pypdfium2
+import uharfbuzz
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+from PIL import ImageChops, ImageFilter
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject,
+                           NameObject, StreamObject)
+from reportlab.pdfbase.ttfonts import TTFontFace
+from artifact_cache import file_sha256
+from docx_cache import get_compiled_template
+
+# The PDF fast path: the template is converted by LibreOffice once, with
+# every paragraph that holds a placeholder colour-coded. That one PDF gives
+# the baseline of each of those paragraphs' lines and, with them cut out,
+# the background. Each degree is then written directly: the background as
+# a form serialised once per template, the bundled fonts embedded whole
+# (also serialised once), and per record only a content stream setting
+# those paragraphs by glyph id. Records it cannot reproduce raise
+# StampingUnsupported and are left to LibreOffice. Before a template is
+# stamped for real, sample records are stamped and converted both ways and
+# the pages compared (verify). Kept free of Flask/eventlet imports, like
+# rendering.py.
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts')
+# Template font family -> (regular, bold) file in static/fonts. Families
+# without a bold file are emboldened by stroking the outline, as
+# LibreOffice does for fonts that lack one.
+FONT_FILES = {
+    'DV-TTSurekh': ('DV-TTSurekh.ttf', 'DV-TTSurekh Bold.ttf'),
+    'DV-TTSurekhEN': ('DV-TTSurekhEN Bold.ttf', 'DV-TTSurekhEN Bold.ttf'),
+    'Helvetica-Normal': ('Helvetica-Normal.ttf', None),
+    'Marriage': ('marriage.TTF', None),
+    'Times New Roman': ('times new roman.ttf', None),
+}
+# Used for families not listed above, and for characters a run's font
+# lacks other than Unicode Devanagari.
+FALLBACK_FAMILY = 'Times New Roman'
+# Unicode Devanagari a run's font lacks is set in this, shaped with
+# HarfBuzz as LibreOffice does. The template's complex-script font (Times
+# New Roman) has no Devanagari, so LibreOffice falls back to a font that
+# has it; register_fonts makes this one available to it.
+DEVANAGARI_FONT = os.path.join(FONT_DIR, 'HindiFont.ttf')
+# Bumped whenever the layout format or how pages are written changes, so
+# layouts cached on disk are rebuilt and stamping is verified again.
+LAYOUT_VERSION = 3
+
+DOCUMENT_PART = 'word/document.xml'
+_PARAGRAPH = re.compile(r'<w:p(?: [^>]*)?>.*?</w:p>', re.S)
+_RUN = re.compile(r'<w:r(?: [^>]*)?>.*?</w:r>', re.S)
+_RUN_CONTENT = re.compile(r'<w:t(?: [^>]*)?>([^<]*)</w:t>|<w:(tab|br|cr)/>')
+_PLACEHOLDER = re.compile(r'\{\{(.*?)\}\}', re.S)
+
+_SHOW_TEXT = {b'Tj', b'TJ', b"'", b'"'}
+_FILL_PATH = {b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*'}
+
+
+# ------------------------------
+# Reading the template
+# ------------------------------
+
+def _props(xml):
+    # The paragraph and run properties text is laid out with, from a pPr,
+    # rPr or style fragment.
+    props = {}
+    m = re.search(r'<w:rFonts ([^>]*?)/?>', xml)
+    if m:
+        fonts = dict(re.findall(r'w:(\w+)="([^"]*)"', m.group(1)))
+        if fonts.get('ascii') or fonts.get('hAnsi'):
+            props['font'] = fonts.get('ascii') or fonts.get('hAnsi')
+    m = re.search(r'<w:b(?: w:val="(\w+)")?/>', xml)
+    if m:
+        props['bold'] = m.group(1) not in ('0', 'false', 'off')
+    m = re.search(r'<w:sz w:val="(\d+)"/>', xml)
+    if m:
+        props['size'] = int(m.group(1)) / 2
+    m = re.search(r'<w:color w:val="([0-9A-Fa-f]{6})"', xml)
+    if m:
+        props['color'] = m.group(1).upper()
+    m = re.search(r'<w:jc w:val="(\w+)"/>', xml)
+    if m:
+        props['align'] = m.group(1)
+    m = re.search(r'<w:ind ([^>]*)/>', xml)
+    if m:
+        for name, value in re.findall(r'w:(\w+)="(-?\d+)"', m.group(1)):
+            name = {'start': 'left', 'end': 'right'}.get(name, name)
+            if name in ('left', 'right', 'firstLine', 'hanging'):
+                props[name] = int(value) / 20
+    return props
+
+
+def _styles(styles_xml):
+    # (document defaults, {styleId: (basedOn, props)} for paragraph styles,
+    # the default paragraph style).
+    m = re.search(r'<w:docDefaults>(.*?)</w:docDefaults>', styles_xml, re.S)
+    defaults = _props(m.group(1)) if m else {}
+    styles, default_style = {}, None
+    for m in re.finditer(r'<w:style ([^>]*)>(.*?)</w:style>', styles_xml, re.S):
+        attrs = dict(re.findall(r'w:(\w+)="([^"]*)"', m.group(1)))
+        if attrs.get('type') != 'paragraph':
+            continue
+        based_on = re.search(r'<w:basedOn w:val="([^"]*)"/>', m.group(2))
+        styles[attrs['styleId']] = (based_on and based_on.group(1), _props(m.group(2)))
+        if attrs.get('default') in ('1', 'true'):
+            default_style = attrs['styleId']
+    return defaults, styles, default_style
+
+
+def _style_props(styles, style_id):
+    chain = []
+    while style_id in styles and style_id not in chain:
+        chain.append(style_id)
+        style_id = styles[style_id][0]
+    props = {}
+    for style_id in reversed(chain):
+        props.update(styles[style_id][1])
+    return props
+
+
+def _props_attrs(xml, tag):
+    m = re.search(rf'<w:{tag} ([^>]*)/>', xml)
+    return {k: int(v) for k, v in re.findall(r'w:(\w+)="(-?\d+)"', m.group(1))} if m else {}
+
+
+def _runs(paragraph_xml):
+    # (text, rPr fragment) for each run; tabs and breaks become \t and \n.
+    for run in _RUN.finditer(paragraph_xml):
+        rpr = re.search(r'<w:rPr>(.*?)</w:rPr>', run.group(0), re.S)
+        text = ''.join('\t' if m.group(2) == 'tab' else '\n' if m.group(2) else unescape(m.group(1))
+                       for m in _RUN_CONTENT.finditer(run.group(0)))
+        yield text, rpr.group(1) if rpr else ''
+
+
+def _font_file(family, bold):
+    # (file, whether to embolden it by stroking).
+    regular, bold_file = FONT_FILES.get(family) or FONT_FILES[FALLBACK_FAMILY]
+    if bold:
+        return (bold_file, False) if bold_file else (regular, True)
+    return regular, False
+
+
+def _parse_paragraph(paragraph_xml, base_props, styles, default_style):
+    ppr = re.search(r'<w:pPr>(.*?)</w:pPr>', paragraph_xml, re.S)
+    # The paragraph mark's own run properties do not apply to its text.
+    ppr = re.sub(r'<w:rPr>.*?</w:rPr>', '', ppr.group(1), flags=re.S) if ppr else ''
+    style = re.search(r'<w:pStyle w:val="([^"]*)"/>', ppr)
+    props = dict(base_props)
+    props.update(_style_props(styles, style.group(1) if style else default_style))
+    props.update(_props(ppr))
+
+    text, styles_at = '', []
+    for run_text, rpr in _runs(paragraph_xml):
+        run_props = dict(props)
+        run_props.update(_props(rpr))
+        filename, fake_bold = _font_file(run_props.get('font'), run_props.get('bold', False))
+        style = [filename, fake_bold, run_props.get('size', 11), run_props.get('color', '000000')]
+        text += run_text
+        styles_at += [style] * len(run_text)
+    if '{%' in text:
+        raise ValueError("stamping supports {{ }} placeholders only, not {% %} blocks")
+
+    # Static text keeps the style of each of its runs; a placeholder takes the
+    # style of the run it starts in, as docxtpl does once it merges the runs.
+    segments, pos = [], 0
+
+    def static(end):
+        start = pos
+        for i in range(pos + 1, end + 1):
+            if i == end or styles_at[i] != styles_at[start]:
+                segments.append(['text', text[start:i]] + styles_at[start])
+                start = i
+
+    for m in _PLACEHOLDER.finditer(text):
+        static(m.start())
+        segments.append(['field', m.group(1).strip()] + styles_at[m.start()])
+        pos = m.end()
+    static(len(text))
+    return {'align': props.get('align', 'left'), 'left': props.get('left', 0), 'right': props.get('right', 0),
+            'first': props.get('firstLine', 0) - props.get('hanging', 0), 'segments': segments}
+
+
+def _marker_color(index):
+    # Probe colours are pure red with the paragraph index in the blue channel.
+    return f'FF00{(index + 1) * 8:02X}'
+
+
+def _marker_index(fill):
+    if len(fill) != 3 or fill[0] < 0.99 or fill[1] > 0.01:
+        return None
+    step = fill[2] * 255 / 8
+    index = round(step) - 1
+    return index if index >= 0 and abs(step - index - 1) < 0.25 else None
+
+
+def _colored(paragraph_xml, color):
+    def color_run(m):
+        run = re.sub(r'<w:color [^>]*/>', '', m.group(0))
+        if '<w:rPr>' in run:
+            return run.replace('<w:rPr>', f'<w:rPr><w:color w:val="{color}"/>', 1)
+        return re.sub(r'^(<w:r(?: [^>]*)?>)', rf'\1<w:rPr><w:color w:val="{color}"/></w:rPr>', run)
+    return _RUN.sub(color_run, paragraph_xml)
+
+
+# ------------------------------
+# Reading the converted probe
+# ------------------------------
+
+class _FillColor:
+    # Tracks the non-stroking colour through a content stream.
+    def __init__(self):
+        self.fill = (0.0,)
+        self._stack = []
+
+    def update(self, op, args):
+        if op == b'q':
+            self._stack.append(self.fill)
+        elif op == b'Q':
+            self.fill = self._stack.pop() if self._stack else (0.0,)
+        elif op in (b'g', b'rg', b'k', b'sc', b'scn'):
+            self.fill = tuple(float(a) for a in args if isinstance(a, (int, float)))
+        elif op == b'cs':
+            self.fill = (0.0,)
+
+
+def _baselines(page, count):
+    # Baselines, top to bottom, of the lines of each colour-coded paragraph.
+    found = [set() for _ in range(count)]
+    color = _FillColor()
+
+    def visit(op, args, cm, tm):
+        color.update(op, args)
+        index = _marker_index(color.fill)
+        if op in _SHOW_TEXT and index is not None and index < count:
+            found[index].add(tm[4] * cm[1] + tm[5] * cm[3] + cm[5])
+
+    page.extract_text(visitor_operand_before=visit)
+    baselines = []
+    for index, ys in enumerate(found):
+        if not ys:
+            raise ValueError(f"placeholder paragraph {index} is missing from the converted template")
+        lines = []
+        # Runs on one line can sit a little apart (sub/superscript, mixed fonts).
+        for y in sorted(ys, reverse=True):
+            if not lines or lines[-1] - y > 1:
+                lines.append(round(y, 2))
+        baselines.append(lines)
+    return baselines
+
+
+def _strip_marked(content):
+    # Drops whatever the colour-coded paragraphs painted, keeping the text
+    # state moves so the rest of the page is untouched.
+    color = _FillColor()
+    kept = []
+    for args, op in content.operations:
+        color.update(op, args)
+        if _marker_index(color.fill) is not None:
+            if op == b"'":
+                kept.append(([], b'T*'))
+                continue
+            if op == b'"':
+                kept += [([args[0]], b'Tw'), ([args[1]], b'Tc'), ([], b'T*')]
+                continue
+            if op in _SHOW_TEXT:
+                continue
+            if op in _FILL_PATH:
+                kept.append(([], b'n'))
+                continue
+        kept.append((args, op))
+    # Balanced so the overlay drawn after it starts from the default state.
+    content.operations = [([], b'q')] + kept + [([], b'Q')]
+    return content
+
+
+# ------------------------------
+# Fonts
+# ------------------------------
+
+class StampingUnsupported(Exception):
+    # Raised for a record that cannot be stamped faithfully; it is
+    # converted with LibreOffice instead.
+    pass
+
+
+def _is_devanagari(char):
+    return 'ऀ' <= char <= 'ॿ'
+
+
+def _stream(data, **entries):
+    # A compressed stream object's body.
+    data = zlib.compress(data)
+    extra = b''.join(b' /%s %d' % (k.encode(), v) for k, v in entries.items())
+    return b'<< /Length %d /Filter /FlateDecode%s >>\nstream\n%s\nendstream' % (len(data), extra, data)
+
+
+class _Font:
+    # A font file as stamped pages use it: embedded whole as a Type0 font
+    # addressed by glyph id, so no per-page subsetting. Its objects are
+    # serialised once; each page only fills in their numbers.
+    def __init__(self, path):
+        self.path = path
+        self.face = TTFontFace(path)
+        self.upem = self.face.unitsPerEm
+        self.advances = [aw for aw, _ in self.face.hmetrics]
+        self._hb = uharfbuzz.Font(uharfbuzz.Face(uharfbuzz.Blob.from_file_path(path)))
+        name = re.sub(rb'[^A-Za-z0-9+-]', b'_', self.face.name) or b'Font'
+        widths = b' '.join(b'%d' % round(aw * 1000 / self.upem) for aw in self.advances)
+        self._type0 = (b'<< /Type /Font /Subtype /Type0 /BaseFont /' + name
+                       + b' /Encoding /Identity-H /DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>')
+        self._cid = (b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /' + name
+                     + b' /CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >>'
+                     + b' /CIDToGIDMap /Identity /W [0 [' + widths + b']] /FontDescriptor %d 0 R >>')
+        bbox = b' '.join(b'%d' % v for v in self.face.bbox)
+        self._descriptor = (b'<< /Type /FontDescriptor /FontName /' + name
+                            + b' /Flags %d /FontBBox [%s] /ItalicAngle %s /Ascent %d /Descent %d'
+                            % (self.face.flags, bbox, repr(float(self.face.italicAngle)).encode(),
+                               self.face.ascent, self.face.descent)
+                            + b' /CapHeight %d /StemV %d' % (self.face.capHeight, self.face.stemV)
+                            + b' /FontFile2 %d 0 R >>')
+        with open(path, 'rb') as f:
+            data = f.read()
+        self._file = _stream(data, Length1=len(data))
+        self._to_unicode = _stream(self._cmap())
+
+    def _cmap(self):
+        # Text extraction: each glyph back to the character it is mapped from.
+        chars = {}
+        for code, gid in sorted(self.face.charToGlyph.items()):
+            if gid and code <= 0xffff:
+                chars.setdefault(gid, code)
+        entries = [b'<%04X> <%04X>' % item for item in sorted(chars.items())]
+        blocks = b''.join(b'%d beginbfchar\n%s\nendbfchar\n' % (len(entries[i:i + 100]), b'\n'.join(entries[i:i + 100]))
+                          for i in range(0, len(entries), 100))
+        return (b'/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+                b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+                b'/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+                b'1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n' + blocks
+                + b'endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n')
+
+    def has(self, char):
+        return ord(char) in self.face.charToGlyph
+
+    def glyphs(self, text, size, shaped):
+        # (width, [(dx, dy, glyph ids as hex)]) of text at size, offsets from
+        # its origin. Unshaped text is one string the viewer advances through
+        # by the /W widths; shaped text places each glyph where HarfBuzz puts
+        # it (reordered matras, marks, conjuncts).
+        scale = size / self.upem
+        if not shaped:
+            gids = [self.face.charToGlyph[ord(char)] for char in text]
+            width = sum(self.advances[gid] for gid in gids) * scale
+            return width, [(0.0, 0.0, b''.join(b'%04X' % gid for gid in gids))]
+        buf = uharfbuzz.Buffer()
+        buf.add_str(text)
+        buf.guess_segment_properties()
+        uharfbuzz.shape(self._hb, buf, {})
+        x, placed = 0, []
+        for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+            placed.append(((x + pos.x_offset) * scale, pos.y_offset * scale, b'%04X' % info.codepoint))
+            x += pos.x_advance
+        return x * scale, placed
+
+    def objects(self, first):
+        # Bodies of the font's five objects, numbered from first.
+        return [self._type0 % (first + 1, first + 4), self._cid % (first + 2), self._descriptor % (first + 3),
+                self._file, self._to_unicode]
+
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+def _font(path):
+    # Parsed once per process.
+    with _fonts_lock:
+        font = _fonts.get(path)
+        if font is None:
+            font = _fonts[path] = _Font(path)
+        return font
+
+
+# ------------------------------
+# Building the layout
+# ------------------------------
+
+def build_layout(template_path, convert, work_dir, sample):
+    # convert(docx_path) converts with LibreOffice and returns the PDF's
+    # path. sample is the context the probe is rendered with: each
+    # paragraph's line count in the probe is the only one stamping accepts,
+    # records that wrap differently go to LibreOffice. Returns (layout,
+    # base PDF bytes).
+    with zipfile.ZipFile(template_path) as zf:
+        names = zf.namelist()
+        document = zf.read(DOCUMENT_PART).decode('utf-8')
+        styles_xml = zf.read('word/styles.xml').decode('utf-8') if 'word/styles.xml' in names else ''
+        for name in names:
+            if re.match(r'^word/(header|footer)\d*\.xml$', name) and b'{{' in zf.read(name):
+                raise ValueError(f"stamping does not support placeholders in {name}")
+
+    defaults, styles, default_style = _styles(styles_xml)
+    sect = document[document.rindex('<w:sectPr'):]
+    page_size = _props_attrs(sect, 'pgSz')
+    margins = _props_attrs(sect, 'pgMar')
+    page_width = page_size.get('w', 12240) / 20
+    frame_left = margins.get('left', 1440) / 20
+    frame_right = page_width - margins.get('right', 1440) / 20
+
+    paragraphs = []
+
+    def mark(m):
+        text = ''.join(run_text for run_text, _ in _runs(m.group(0)))
+        if '{{' not in text:
+            return m.group(0)
+        paragraph = _parse_paragraph(m.group(0), defaults, styles, default_style)
+        paragraph['left'] = frame_left + paragraph['left']
+        paragraph['right'] = frame_right - paragraph['right']
+        paragraphs.append(paragraph)
+        return _colored(m.group(0), _marker_color(len(paragraphs) - 1))
+
+    probe = _PARAGRAPH.sub(mark, document)
+    if not paragraphs:
+        raise ValueError(f"{template_path} has no placeholders in {DOCUMENT_PART}")
+    if len(paragraphs) > 31:
+        raise ValueError("stamping supports at most 31 paragraphs with placeholders")
+
+    marked_path = os.path.join(work_dir, 'marked.docx')
+    with zipfile.ZipFile(template_path) as src, zipfile.ZipFile(marked_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            data = probe.encode('utf-8') if info.filename == DOCUMENT_PART else src.read(info.filename)
+            dst.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+    probe_path = os.path.join(work_dir, 'probe.docx')
+    tpl = DocxTemplate(marked_path)
+    tpl.render(sample)
+    tpl.save(probe_path)
+    reader = PdfReader(convert(probe_path))
+    if len(reader.pages) != 1:
+        raise ValueError(f"stamping needs a one-page template; {template_path} has {len(reader.pages)} pages")
+    page = reader.pages[0]
+    for paragraph, baselines in zip(paragraphs, _baselines(page, len(paragraphs))):
+        paragraph['baselines'] = baselines
+
+    page.replace_contents(_strip_marked(page.get_contents()))
+    writer = PdfWriter()
+    writer.add_page(page)
+    writer.pages[0].compress_content_streams()
+    buf = io.BytesIO()
+    writer.write(buf)
+    return {'version': LAYOUT_VERSION, 'paragraphs': paragraphs}, buf.getvalue()
+
+
+def _background(base, first):
+    # The base PDF's page as a form XObject: (media box, bodies of the form
+    # and every object it uses, numbered from first, the form first).
+    page = PdfReader(io.BytesIO(base)).pages[0]
+    numbers, pending = {}, []
+
+    def renumber(obj):
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in numbers:
+                numbers[key] = first + 1 + len(numbers)
+                pending.append(obj)
+            return IndirectObject(numbers[key], 0, None)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            copy.update({k: renumber(v) for k, v in obj.items()})
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({k: renumber(v) for k, v in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(renumber(v) for v in obj)
+        return obj
+
+    def serialise(obj):
+        buf = io.BytesIO()
+        obj.write_to_stream(buf)
+        return buf.getvalue()
+
+    box = [float(v) for v in page.mediabox]
+    form = DecodedStreamObject()
+    form.set_data(page.get_contents().get_data())
+    form = form.flate_encode()
+    form.update({NameObject('/Type'): NameObject('/XObject'), NameObject('/Subtype'): NameObject('/Form'),
+                 NameObject('/BBox'): ArrayObject(FloatObject(v) for v in box),
+                 NameObject('/Resources'): renumber(page.get('/Resources', DictionaryObject()))})
+    bodies = [serialise(form)]
+    while pending:
+        bodies.append(serialise(renumber(pending.pop(0).get_object())))
+    return box, bodies
+
+
+# ------------------------------
+# Stamping
+# ------------------------------
+
+class StampTemplate:
+    # Lays out a record's paragraphs and writes the page around them.
+    def __init__(self, layout, base, devanagari_font=DEVANAGARI_FONT):
+        self.base = base
+        # Objects 1-4 are each page's catalog, page tree, page and content.
+        self._box, background = _background(base, 5)
+        self._background = background
+        self._fallback = _font(os.path.join(FONT_DIR, _font_file(FALLBACK_FAMILY, False)[0]))
+        self._devanagari = _font(devanagari_font)
+        self._fonts = {}
+        self._pieces = {}
+        env = Environment()
+        self._paragraphs = []
+        for paragraph in layout['paragraphs']:
+            segments = []
+            for kind, text, filename, fake_bold, size, color in paragraph['segments']:
+                style = (filename, fake_bold, size, color)
+                if kind == 'field':
+                    segments.append((env.from_string('{{ ' + text + ' }}'), style))
+                    continue
+                try:
+                    self._piece(text, style)
+                except StampingUnsupported as e:
+                    raise ValueError(f"the template's own text cannot be stamped: {e}") from e
+                segments.append((text, style))
+            self._paragraphs.append(dict(paragraph, segments=segments))
+
+    @classmethod
+    def load(cls, layout_path, base_path, devanagari_font=DEVANAGARI_FONT):
+        with open(layout_path, encoding='utf-8') as f:
+            layout = json.load(f)
+        with open(base_path, 'rb') as f:
+            return cls(layout, f.read(), devanagari_font)
+
+    def _font_for(self, font, char):
+        # (font, whether to shape) for a character of a run set in `font`.
+        if _is_devanagari(char):
+            if font.has(char):
+                return font, True
+            if self._devanagari.has(char):
+                return self._devanagari, True
+            raise StampingUnsupported(f"{os.path.basename(self._devanagari.path)} has no {char!r}")
+        if font.has(char):
+            return font, False
+        if self._fallback.has(char):
+            return self._fallback, False
+        raise StampingUnsupported(f"none of the fonts has {char!r}")
+
+    def _piece(self, text, style):
+        # [(font, width, glyphs)] for a word, split where the font changes.
+        # Static text recurs on every page, so pieces are memoised.
+        key = (text, style)
+        cached = self._pieces.get(key)
+        if cached is not None:
+            return cached
+        filename, _, size, _ = style
+        base_font = _font(os.path.join(FONT_DIR, filename))
+        runs = []
+        for char in text:
+            if char in '‌‍':
+                # Joiners only mean something to the shaper.
+                if runs and runs[-1][2]:
+                    runs[-1][1] += char
+                continue
+            font, shaped = self._font_for(base_font, char)
+            if runs and runs[-1][0] is font and runs[-1][2] == shaped:
+                runs[-1][1] += char
+            else:
+                runs.append([font, char, shaped])
+        cached = [(font,) + font.glyphs(run_text, size, shaped) for font, run_text, shaped in runs]
+        if len(self._pieces) < 10000:
+            self._pieces[key] = cached
+        return cached
+
+    def _lines(self, paragraph, context):
+        # Greedy line filling within the paragraph's frame. Each line is
+        # ([(x, [(style, pieces, width)])], width, whether it is the last).
+        space, word = 0.0, []
+        lines = [[]]
+
+        def end_word():
+            nonlocal space, word
+            if word:
+                lines[-1].append((space, word))
+                space, word = 0.0, []
+
+        for source, style in paragraph['segments']:
+            text = source if isinstance(source, str) else source.render(context)
+            for token in re.split(r'([ \t\n])', text):
+                if token == '\n':
+                    end_word()
+                    lines.append([])
+                    space = 0.0
+                elif token in (' ', '\t'):
+                    end_word()
+                    pieces = self._piece(' ', style)
+                    space += 36.0 if token == '\t' else sum(p[1] for p in pieces)
+                elif token:
+                    pieces = self._piece(token, style)
+                    word.append((style, pieces, sum(p[1] for p in pieces)))
+        end_word()
+
+        wrapped = []
+        for line in lines:
+            current, width = [], 0.0
+            for space, word in line:
+                avail = paragraph['right'] - paragraph['left'] - (paragraph['first'] if not wrapped else 0)
+                word_width = sum(w for _, _, w in word)
+                if current and width + space + word_width > avail:
+                    wrapped.append((current, width, False))
+                    current, width = [], 0.0
+                if current:
+                    width += space
+                current.append((width, word))
+                width += word_width
+            wrapped.append((current, width, True))
+        return wrapped
+
+    def _content(self, context):
+        # (content stream, fonts it uses). Raises StampingUnsupported if any
+        # paragraph wraps to a different number of lines than in the probe:
+        # the static text around it would not move to make room, as it does
+        # in LibreOffice.
+        laid_out = []
+        for paragraph in self._paragraphs:
+            lines = self._lines(paragraph, context)
+            if len(lines) != len(paragraph['baselines']):
+                raise StampingUnsupported(f"a paragraph takes {len(lines)} lines instead of the template's "
+                                          f"{len(paragraph['baselines'])}")
+            laid_out.append((paragraph, lines))
+
+        ops, fonts = [b'q /BG Do Q\nBT'], {}
+        current_font = current_style = None
+        for paragraph, lines in laid_out:
+            for n, ((words, width, last), y) in enumerate(zip(lines, paragraph['baselines'])):
+                left = paragraph['left'] + (paragraph['first'] if n == 0 else 0)
+                avail = paragraph['right'] - left
+                align, gap = paragraph['align'], 0.0
+                if align == 'center':
+                    left += (avail - width) / 2
+                elif align in ('right', 'end'):
+                    left += avail - width
+                elif align in ('both', 'distribute') and not last and len(words) > 1:
+                    gap = (avail - width) / (len(words) - 1)
+                for i, (x, word) in enumerate(words):
+                    x = left + x + gap * i
+                    for style, pieces, _ in word:
+                        _, fake_bold, size, color = style
+                        if style != current_style:
+                            rgb = ' '.join(f'{int(color[i:i + 2], 16) / 255:.3f}' for i in (0, 2, 4))
+                            if fake_bold:
+                                # Emboldened by stroking the outline, as
+                                # LibreOffice does for fonts without a bold face.
+                                ops.append(f'{rgb} rg {rgb} RG {size / 50:.3f} w 2 Tr'.encode())
+                            else:
+                                ops.append(f'{rgb} rg 0 Tr'.encode())
+                            current_style = style
+                        for font, piece_width, glyphs in pieces:
+                            name = fonts.setdefault(font, len(fonts))
+                            if (font, size) != current_font:
+                                ops.append(b'/F%d %s Tf' % (name, repr(float(size)).encode()))
+                                current_font = (font, size)
+                            for dx, dy, gids in glyphs:
+                                ops.append(b'1 0 0 1 %.3f %.3f Tm <%s> Tj' % (x + dx, y + dy, gids))
+                            x += piece_width
+        ops.append(b'ET')
+        return b'\n'.join(ops), list(fonts)
+
+    def render(self, context):
+        # The finished PDF's bytes.
+        content, fonts = self._content(context)
+        first_font = 5 + len(self._background)
+        font_refs = b' '.join(b'/F%d %d 0 R' % (i, first_font + 5 * i) for i in range(len(fonts)))
+        box = b' '.join(repr(v).encode() for v in self._box)
+        bodies = [b'<< /Type /Catalog /Pages 2 0 R >>',
+                  b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+                  b'<< /Type /Page /Parent 2 0 R /MediaBox [' + box + b'] /Resources << /XObject << /BG 5 0 R >>'
+                  b' /Font << ' + font_refs + b' >> >> /Contents 4 0 R >>',
+                  _stream(content)]
+        bodies += self._background
+        for i, font in enumerate(fonts):
+            bodies += font.objects(first_font + 5 * i)
+        out = [b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n']
+        pos, offsets = len(out[0]), []
+        for number, body in enumerate(bodies, 1):
+            chunk = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+            offsets.append(pos)
+            out.append(chunk)
+            pos += len(chunk)
+        out.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(bodies) + 1))
+        out.append(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+        out.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(bodies) + 1, pos))
+        return b''.join(out)
+
+    def render_to(self, path, context):
+        data = self.render(context)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+# ------------------------------
+# Checking against LibreOffice
+# ------------------------------
+
+def page_difference(reference, candidate, dpi, diff_path=None):
+    # Share of the inked area of two one-page PDFs that differs visibly.
+    # Both are blurred slightly first so sub-pixel offsets do not count.
+    images = []
+    for path in (reference, candidate):
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            images.append(pdf[0].render(scale=dpi / 72).to_pil().convert('L').filter(ImageFilter.GaussianBlur(1)))
+        finally:
+            pdf.close()
+    if images[0].size != images[1].size:
+        return 1.0
+    diff = ImageChops.difference(*images).point(lambda v: 255 if v > 96 else 0)
+    ink = ImageChops.darker(*images).point(lambda v: 255 if v < 160 else 0)
+    if diff_path:
+        diff.save(diff_path)
+    return diff.histogram()[255] / max(1, ink.histogram()[255])
+
+
+def verify(template_path, template, convert, samples, dpi=100, diff_dir=None):
+    # Stamps each sample context, converts it with LibreOffice as well, and
+    # returns {sample index: page_difference}. Samples that cannot be
+    # stamped are skipped. diff_dir, if given, gets the difference images.
+    compiled = get_compiled_template(template_path)
+    work_dir = tempfile.mkdtemp(prefix='stamp_verify_')
+    try:
+        diffs = {}
+        for i, context in enumerate(samples):
+            stamped = os.path.join(work_dir, f'{i}.pdf')
+            try:
+                template.render_to(stamped, context)
+            except StampingUnsupported:
+                continue
+            docx_path = os.path.join(work_dir, f'reference_{i}.docx')
+            with open(docx_path, 'w+b') as f:
+                compiled.render_to(f, context)
+            diffs[i] = round(page_difference(convert(docx_path), stamped, dpi,
+                                             diff_dir and os.path.join(diff_dir, f'{i}.png')), 4)
+        return diffs
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# ------------------------------
+# Cache
+# ------------------------------
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def verification_path(template_path, cache_dir):
+    digest = file_sha256(os.path.abspath(template_path))
+    return os.path.join(cache_dir, f'verified-{digest}.v{LAYOUT_VERSION}.json')
+
+
+def mark_verified(template_path, cache_dir, devanagari_font, report):
+    # Keeps the outcome of a check against LibreOffice (report['verified'])
+    # for this template, layout version and Devanagari font. Returns it.
+    os.makedirs(cache_dir, exist_ok=True)
+    record = dict(report, devanagari_font=file_sha256(devanagari_font))
+    tmp = os.path.join(cache_dir, f'.{uuid.uuid4().hex}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp, verification_path(template_path, cache_dir))
+    return record
+
+
+def check_verified(template_path, cache_dir, devanagari_font):
+    # The kept outcome for this setup, or None if it has not been checked.
+    try:
+        with open(verification_path(template_path, cache_dir), encoding='utf-8') as f:
+            record = json.load(f)
+    except FileNotFoundError:
+        return None
+    return record if record.get('devanagari_font') == file_sha256(devanagari_font) else None
+
+
+def get_stamp_template(template_path, cache_dir, convert, samples, devanagari_font=DEVANAGARI_FONT,
+                       require_verified=True, max_diff=0.1):
+    # Built once per template version: kept in memory per process and on
+    # disk across processes and restarts. samples are record contexts; the
+    # probe is rendered with the first. With require_verified, a setup not
+    # checked yet is checked on the samples first and the outcome kept;
+    # raises ValueError if nothing could be compared or a page differs from
+    # LibreOffice's by more than max_diff.
+    key = os.path.abspath(template_path)
+    digest = file_sha256(key)
+    with _cache_lock:
+        cached = _cache.get((key, devanagari_font))
+        if cached is not None and cached[0] == digest and (cached[2] or not require_verified):
+            return cached[1]
+        name = f'{digest}.v{LAYOUT_VERSION}'
+        layout_path = os.path.join(cache_dir, f'{name}.json')
+        base_path = os.path.join(cache_dir, f'{name}.pdf')
+        if not (os.path.exists(layout_path) and os.path.exists(base_path)):
+            os.makedirs(cache_dir, exist_ok=True)
+            work_dir = tempfile.mkdtemp(prefix='stamp_')
+            try:
+                layout, base = build_layout(key, convert, work_dir, samples[0])
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            tmp = os.path.join(cache_dir, f'.{uuid.uuid4().hex}.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(base)
+            os.replace(tmp, base_path)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(layout, f, ensure_ascii=False)
+            os.replace(tmp, layout_path)
+        template = StampTemplate.load(layout_path, base_path, devanagari_font)
+        if require_verified:
+            record = check_verified(key, cache_dir, devanagari_font)
+            if record is None:
+                diffs = list(verify(key, template, convert, samples).values())
+                if not diffs:
+                    raise ValueError("none of the sample records could be stamped, so stamping could not be "
+                                     "checked against LibreOffice")
+                record = mark_verified(key, cache_dir, devanagari_font,
+                                       {'max_diff': max_diff, 'per_record': diffs, 'worst': max(diffs),
+                                        'verified': max(diffs) <= max_diff})
+            if not record['verified']:
+                raise ValueError(f"stamped pages differed from LibreOffice's by up to {record['worst']:.2%}; "
+                                 f"delete {verification_path(key, cache_dir)} to check again")
+        _cache[(key, devanagari_font)] = (digest, template, require_verified)
+    return template
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# Standalone generation worker. Run one or more next to the web app; each
+# consumes jobs from the shared job store (JOB_DB_URI, or JOB_DB_PATH).
+
+if __name__ == '__main__':
+    # Imported here, not at the top: render processes are spawned, and
+    # spawn re-runs this file as __mp_main__ in each of them, which would
+    # otherwise load the whole web app there too.
+    from app import run_worker
+    run_worker()
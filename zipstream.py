@@ -0,0 +1,78 @@
+import io
+import os
+import zipfile
+
+# Already-compressed formats are stored as-is; deflating them costs CPU for
+# next to no saving.
+STORED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.zip')
+CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer(io.RawIOBase):
+    # Write-only, unseekable sink. zipfile falls back to data descriptors for
+    # unseekable outputs, so nothing written is ever rewritten later.
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    # A ZIP archive built one file at a time. Every call returns the archive
+    # bytes it produced, so the caller decides where the work runs and
+    # where the bytes go.
+    def __init__(self):
+        self._buf = _StreamBuffer()
+        self._zf = zipfile.ZipFile(self._buf, 'w')
+
+    def add_chunks(self, path):
+        # Yields the bytes of one entry as the file is read.
+        info = zipfile.ZipInfo.from_file(path, arcname=os.path.basename(path))
+        if path.lower().endswith(STORED_EXTENSIONS):
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+        with open(path, 'rb') as src, self._zf.open(info, 'w', force_zip64=True) as dst:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                data = self._buf.drain()
+                if data:
+                    yield data
+        data = self._buf.drain()
+        if data:
+            yield data
+
+    def add(self, path):
+        return b''.join(self.add_chunks(path))
+
+    def close(self):
+        # The central directory.
+        self._zf.close()
+        return self._buf.drain()
+
+
+def stream_zip(paths):
+    # Yields the bytes of a ZIP archive of `paths` as it is built. `paths` may
+    # be a lazy iterable that blocks until the next file exists.
+    archive = ZipStream()
+    for path in paths:
+        yield from archive.add_chunks(path)
+    yield archive.close()